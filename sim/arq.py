@@ -0,0 +1,318 @@
+# **********************************************************************************************************************
+#   FileName:
+#       arq.py
+#
+#   Description:
+#       Sliding window automatic repeat request (ARQ) state machines for ShockBurst links. These
+#       are I/O free so the radio can drive them from its message pump.
+#
+#   2021 | Brandon Braun | brandonbraun653@gmail.com
+# **********************************************************************************************************************
+
+import time
+
+from collections import OrderedDict
+from enum import Enum
+from typing import Callable, Dict, List, Optional, Tuple
+from frame_packager import PackedFrame, FrameView
+
+# ---------------------------------------------
+# Sequence numbers live in the frameNumber field
+# ---------------------------------------------
+SEQUENCE_SPACE = 1 << PackedFrame.FRAME_NUMBER_BITS
+
+
+class ArqMode(Enum):
+    """ Retransmission strategies. Both ends of a link must use the same one. """
+    STOP_AND_WAIT = 0       # One frame in flight at a time
+    GO_BACK_N = 1           # Cumulative ACKs, resend everything after a timeout
+    SELECTIVE_REPEAT = 2    # Per-frame ACKs, resend only what timed out
+
+
+def max_window_size(mode: ArqMode) -> int:
+    """
+    Largest window that keeps sequence numbers unambiguous in the 5-bit frameNumber space
+
+    Args:
+        mode: Retransmission strategy
+
+    Returns:
+        Max number of frames that may be in flight
+    """
+    if mode == ArqMode.STOP_AND_WAIT:
+        return 1
+    elif mode == ArqMode.GO_BACK_N:
+        return SEQUENCE_SPACE - 1
+    else:
+        return SEQUENCE_SPACE // 2
+
+
+def seq_offset(base: int, seq: int) -> int:
+    """
+    Distance from base to seq, accounting for wrap around
+
+    Returns:
+        Value in range [0, SEQUENCE_SPACE)
+    """
+    return (seq - base) % SEQUENCE_SPACE
+
+
+class _InFlight:
+    __slots__ = ('frame', 'sent', 'deadline', 'retries')
+
+    def __init__(self, frame: FrameView, sent: float, deadline: float):
+        self.frame = frame
+        self.sent = sent
+        self.deadline = deadline
+        self.retries = 0
+
+
+class ArqSender:
+    """
+    Transmit side of a sliding window link. Assigns sequence numbers, tracks the
+    frames awaiting an ACK and decides what needs to be sent again.
+    """
+
+    def __init__(self, mode: ArqMode = ArqMode.SELECTIVE_REPEAT, window_size: int = 8,
+                 retransmit_timeout: float = 0.25, max_retries: int = 15,
+                 clock: Callable[[], float] = time.monotonic, on_rtt: Callable[[float], None] = None):
+        """
+        Args:
+            mode: Retransmission strategy
+            window_size: Max number of unacknowledged frames in flight
+            retransmit_timeout: Seconds to wait for an ACK before resending a frame
+            max_retries: Resends allowed before a frame is declared lost
+            clock: Time source, in seconds
+            on_rtt: Called with the seconds from each frame's first transmission
+                until it was acknowledged
+        """
+        assert(0 < window_size <= max_window_size(mode))
+        self.mode = mode
+        self.window_size = window_size
+        self.retransmit_timeout = retransmit_timeout
+        self.max_retries = max_retries
+        self.clock = clock
+        self.on_rtt = on_rtt
+
+        self._base = 0
+        self._next_seq = 0
+        self._in_flight = OrderedDict()     # type: Dict[int, _InFlight]
+
+    def __len__(self) -> int:
+        return len(self._in_flight)
+
+    def can_send(self) -> bool:
+        """
+        Checks if the window has room for another frame
+        Returns:
+            bool
+        """
+        return seq_offset(self._base, self._next_seq) < self.window_size
+
+    def send(self, frame: FrameView) -> int:
+        """
+        Stamps the next sequence number into a frame and starts its retransmit timer.
+        The frame must be transmitted by the caller right after this.
+
+        Args:
+            frame: Frame about to be transmitted. Must wrap a writable buffer.
+
+        Returns:
+            Sequence number assigned to the frame
+        """
+        assert(self.can_send())
+        seq = self._next_seq
+        frame.frameNumber = seq
+        now = self.clock()
+        self._in_flight[seq] = _InFlight(frame, now, now + self.retransmit_timeout)
+        self._next_seq = (seq + 1) % SEQUENCE_SPACE
+        return seq
+
+    def on_ack(self, seq: int) -> List[int]:
+        """
+        Processes an ACK from the receiver
+
+        Args:
+            seq: Sequence number carried by the ACK
+
+        Returns:
+            Sequence numbers that are now acknowledged, oldest first
+        """
+        outstanding = seq_offset(self._base, self._next_seq)
+        if seq_offset(self._base, seq) >= outstanding:
+            # Stale or duplicate ACK for something outside the window
+            return []
+
+        if self.mode == ArqMode.SELECTIVE_REPEAT:
+            entry = self._in_flight.pop(seq, None)
+            acked = [seq] if entry else []
+            entries = [entry] if entry else []
+        else:
+            # Cumulative: everything up to and including seq has been received
+            acked = []
+            entries = []
+            for _ in range(seq_offset(self._base, seq) + 1):
+                acked.append(self._base)
+                entry = self._in_flight.pop(self._base, None)
+                if entry is not None:
+                    entries.append(entry)
+                self._base = (self._base + 1) % SEQUENCE_SPACE
+
+        if self.on_rtt is not None and entries:
+            now = self.clock()
+            for entry in entries:
+                self.on_rtt(now - entry.sent)
+
+        # Slide the window past everything that has been acknowledged
+        while self._base != self._next_seq and self._base not in self._in_flight:
+            self._base = (self._base + 1) % SEQUENCE_SPACE
+
+        return acked
+
+    def poll_timers(self) -> Tuple[List[FrameView], List[FrameView]]:
+        """
+        Finds frames whose retransmit timers expired and restarts their timers
+
+        Returns:
+            Frames to transmit again, in order, and frames that ran out of retries.
+            Frames that ran out of retries are removed from the window.
+        """
+        now = self.clock()
+        resend = []
+        failed = []
+
+        expired = [seq for seq, entry in self._in_flight.items() if entry.deadline <= now]
+        if not expired:
+            return resend, failed
+
+        if self.mode != ArqMode.SELECTIVE_REPEAT:
+            # Go back to the oldest unacknowledged frame and resend the whole window
+            expired = list(self._in_flight.keys())
+
+        for seq in expired:
+            entry = self._in_flight[seq]
+            if entry.retries >= self.max_retries:
+                failed.append(self._in_flight.pop(seq).frame)
+                continue
+
+            entry.retries += 1
+            entry.deadline = now + self.retransmit_timeout
+            resend.append(entry.frame)
+
+        while self._base != self._next_seq and self._base not in self._in_flight:
+            self._base = (self._base + 1) % SEQUENCE_SPACE
+
+        return resend, failed
+
+    def next_deadline(self) -> Optional[float]:
+        """
+        Returns:
+            Clock time of the earliest retransmit timer, or None if nothing is in flight
+        """
+        if not self._in_flight:
+            return None
+        return min(entry.deadline for entry in self._in_flight.values())
+
+
+class ArqReceiver:
+    """
+    Receive side of a sliding window link. Decides which frames to deliver, in
+    order, and which sequence number to acknowledge.
+    """
+
+    def __init__(self, mode: ArqMode = ArqMode.SELECTIVE_REPEAT, window_size: int = 8,
+                 resync_timeout: float = 5.0, clock: Callable[[], float] = time.monotonic):
+        """
+        Args:
+            mode: Retransmission strategy, matching the sender
+            window_size: Receive window, matching the sender
+            resync_timeout: Seconds without in-order progress before giving up on a
+                missing frame. Should exceed the sender's total retry time.
+            clock: Time source, in seconds
+        """
+        assert(0 < window_size <= max_window_size(mode))
+        self.mode = mode
+        self.window_size = window_size
+        self.resync_timeout = resync_timeout
+        self.clock = clock
+
+        self._expected = 0
+        self._buffered = {}     # type: Dict[int, FrameView]
+        self._last_progress = clock()
+
+    def __len__(self) -> int:
+        """
+        Returns:
+            Number of out of order frames held back waiting for a missing frame
+        """
+        return len(self._buffered)
+
+    def _stalled(self) -> bool:
+        return (self.clock() - self._last_progress) > self.resync_timeout
+
+    def _deliver_buffered(self) -> List[FrameView]:
+        delivered = []
+        while self._expected in self._buffered:
+            delivered.append(self._buffered.pop(self._expected))
+            self._expected = (self._expected + 1) % SEQUENCE_SPACE
+
+        if delivered:
+            self._last_progress = self.clock()
+        return delivered
+
+    def on_frame(self, frame: FrameView, room: Optional[int] = None) -> Tuple[Optional[int], List[FrameView]]:
+        """
+        Processes a frame that requested an ACK
+
+        Args:
+            frame: Received frame
+            room: Number of frames the consumer can still accept, including the
+                ones held back by this receiver. Frames that might not fit are
+                refused without an ACK. None means there is no limit.
+
+        Returns:
+            Sequence number to ACK (None to stay silent) and the frames that can
+            now be delivered to the user, in order.
+        """
+        seq = frame.frameNumber
+        offset = seq_offset(self._expected, seq)
+
+        # ---------------------------------------------------------------------
+        # The sender gives up on frames that run out of retries, which leaves a
+        # hole the window can never move past. Once no progress has been made
+        # for long enough, skip ahead to whatever the sender is working on now.
+        # ---------------------------------------------------------------------
+        if offset != 0 and self._stalled():
+            if self.mode == ArqMode.SELECTIVE_REPEAT and self._buffered and offset < self.window_size:
+                self._expected = min(self._buffered, key=lambda x: seq_offset(self._expected, x))
+            else:
+                self._buffered.clear()
+                self._expected = seq
+            offset = seq_offset(self._expected, seq)
+
+        if self.mode != ArqMode.SELECTIVE_REPEAT:
+            # Only the next frame in order is accepted. Everything else gets the
+            # last cumulative ACK again so the sender can recover.
+            last_in_order = (self._expected - 1) % SEQUENCE_SPACE
+            if offset != 0:
+                return last_in_order, []
+            elif room is not None and room < 1:
+                return None, []
+
+            self._expected = (self._expected + 1) % SEQUENCE_SPACE
+            self._last_progress = self.clock()
+            return seq, [frame]
+
+        if offset < self.window_size:
+            # An out of order frame must leave space for the one filling the hole
+            needed = len(self._buffered) + (1 if offset == 0 else 2)
+            if room is not None and seq not in self._buffered and room < needed:
+                return None, []
+
+            self._buffered[seq] = frame
+            return seq, self._deliver_buffered()
+        elif offset >= SEQUENCE_SPACE - self.window_size:
+            # Retransmission of something already delivered. Our ACK was lost.
+            return seq, []
+        else:
+            return None, []
@@ -0,0 +1,185 @@
+# **********************************************************************************************************************
+#   FileName:
+#       async_shockburst.py
+#
+#   Description:
+#       asyncio flavor of the virtual ShockBurst radio. Runs entirely on the event loop, so
+#       a single thread can drive many radios.
+#
+#   2021 | Brandon Braun | brandonbraun653@gmail.com
+# **********************************************************************************************************************
+
+import asyncio
+import zmq
+import zmq.asyncio
+
+from typing import List, Optional, Tuple, Union
+from frame_interface import RxFifoEntry
+from hw_fifo import HardwareFifo
+from virtual_shockburst import ShockBurstRadioBase
+
+
+class AsyncShockBurstRadio(ShockBurstRadioBase):
+    """
+    Virtual radio driven by an asyncio task instead of a thread. Frames are
+    exchanged through awaitable FIFOs:
+
+        radio = AsyncShockBurstRadio()
+        radio.set_device_mac(mac)
+        radio.start()
+        await radio.transmit(frame.pack())
+        async for entry in radio:
+            ...
+        await radio.close()
+    """
+
+    def __init__(self, tx_fifo_depth: int = HardwareFifo.NRF24_FIFO_DEPTH,
+                 rx_fifo_depth: int = HardwareFifo.NRF24_FIFO_DEPTH,
+                 context: zmq.asyncio.Context = None, **kwargs):
+        """
+        Args:
+            tx_fifo_depth: Number of frames transmit() may queue before it waits for room
+            rx_fifo_depth: Number of received frames held. New frames are dropped without
+                an ACK when full, just like the NRF24L01.
+            context: asyncio ZMQ context to create sockets with. Defaults to the shared
+                instance so that many radios don't each pay for their own I/O threads.
+            kwargs: ARQ settings forwarded to ShockBurstRadioBase
+        """
+        super().__init__(context if context is not None else zmq.asyncio.Context.instance(), **kwargs)
+
+        self._txQueue = asyncio.Queue(tx_fifo_depth)
+        self._rxQueue = asyncio.Queue(rx_fifo_depth)
+        self._wakeup = asyncio.Event()
+        self._closed = asyncio.Event()
+        self._pump_task = None  # type: Optional[asyncio.Task]
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self) -> RxFifoEntry:
+        entry = await self._get_or_closed()
+        if entry is None:
+            raise StopAsyncIteration
+        return entry
+
+    def start(self) -> None:
+        """
+        Schedules the message pump on the running event loop
+        Returns:
+            None
+        """
+        assert(self._pump_task is None)
+        self._pump_task = asyncio.get_running_loop().create_task(self.run())
+
+    async def close(self) -> None:
+        """
+        Stops the message pump, releases anyone iterating over the radio and closes all pipes
+        Returns:
+            None
+        """
+        self._closed.set()
+        self._wakeup.set()
+        if self._pump_task is not None:
+            await self._pump_task
+
+        self._close_pipes()
+
+    async def transmit(self, data: Union[bytearray, bytes, memoryview]) -> None:
+        """
+        Queues a packed frame into the TX FIFO, waiting for room if it is full
+
+        Args:
+            data: Packed frame to transmit
+
+        Returns:
+            None
+        """
+        await self._txQueue.put((self.clock(), data))
+        self._wakeup.set()
+
+    async def receive(self, timeout: float = None) -> RxFifoEntry:
+        """
+        Pops the oldest frame out of the RX FIFO
+
+        Args:
+            timeout: Max seconds to wait. None waits forever.
+
+        Raises:
+            asyncio.TimeoutError: No frame arrived in time
+
+        Returns:
+            The received frame and the pipe it arrived on
+        """
+        return await asyncio.wait_for(self._rxQueue.get(), timeout)
+
+    async def run(self) -> None:
+        """
+        Main message pump that acts as the hardware transceiver in the NRF24L01
+        """
+        poller = zmq.asyncio.Poller()
+        for pipe in self.rxPipe:
+            poller.register(pipe, zmq.POLLIN)
+
+        while not self._closed.is_set():
+            # -----------------------------------------------------------------
+            # Sleep until a socket has data, the TX queue has work or an ARQ
+            # timer needs servicing.
+            # -----------------------------------------------------------------
+            poll = poller.poll(self._pump_timeout_ms())
+            wakeup = asyncio.ensure_future(self._wakeup.wait())
+            await asyncio.wait((poll, wakeup), return_when=asyncio.FIRST_COMPLETED)
+
+            wakeup.cancel()
+            self._wakeup.clear()
+            if poll.done():
+                ready = dict(poll.result())
+            else:
+                poll.cancel()
+                ready = {}
+
+            # Pump messages through the "transceiver"
+            self._service_pipes(ready)
+
+    async def _get_or_closed(self) -> Optional[RxFifoEntry]:
+        """
+        Waits for the next received frame, giving up once the radio is closed
+        Returns:
+            The next frame, or None if the radio was closed first
+        """
+        if not self._rxQueue.empty():
+            return self._rxQueue.get_nowait()
+
+        get = asyncio.ensure_future(self._rxQueue.get())
+        closed = asyncio.ensure_future(self._closed.wait())
+        await asyncio.wait((get, closed), return_when=asyncio.FIRST_COMPLETED)
+        closed.cancel()
+
+        if get.done():
+            return get.result()
+
+        get.cancel()
+        return None
+
+    def _recv_nowait(self, pipe: int) -> List[zmq.Frame]:
+        # Non-blocking receives on an asyncio socket complete immediately
+        return self.rxPipe[pipe].recv_multipart(flags=zmq.DONTWAIT, copy=False).result()
+
+    def _pop_tx_data(self) -> Union[bytearray, bytes, memoryview, None]:
+        if self._txQueue.empty():
+            return None
+        queued_at, data = self._txQueue.get_nowait()
+        self.metrics.tx_queue.record(self.clock() - queued_at)
+        return data
+
+    def _rx_room(self) -> Optional[int]:
+        return self._rxQueue.maxsize - self._rxQueue.qsize()
+
+    def _deliver_rx(self, entry: RxFifoEntry) -> bool:
+        try:
+            self._rxQueue.put_nowait(entry)
+            return True
+        except asyncio.QueueFull:
+            return False
+
+    def _fifo_depths(self) -> Tuple[Optional[int], Optional[int]]:
+        return self._txQueue.qsize(), self._rxQueue.qsize()
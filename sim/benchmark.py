@@ -0,0 +1,356 @@
+# **********************************************************************************************************************
+#   FileName:
+#       benchmark.py
+#
+#   Description:
+#       Microbenchmarks for the framing and radio hot paths. Results are written as JSON and can
+#       be compared against a stored baseline to catch performance regressions.
+#
+#       python benchmark.py --output baseline.json
+#       python benchmark.py --compare baseline.json
+#
+#   2021 | Brandon Braun | brandonbraun653@gmail.com
+# **********************************************************************************************************************
+
+import argparse
+import contextlib
+import json
+import platform
+import queue
+import statistics
+import sys
+import threading
+import time
+
+from typing import Callable, Dict, List, NamedTuple
+from frame_packager import PackedFrame
+from network_frames import ACKFrame
+from virtual_shockburst import FrameType, ShockBurstRadio
+from wire_format import WireFormat, decode, encode
+
+import shockburst_pb2
+
+
+class Metric(NamedTuple):
+    """ A single measured value """
+    value: float
+    unit: str
+    higher_is_better: bool
+
+
+Results = Dict[str, Metric]
+
+# Destination pipe used by the radio benchmarks unless a benchmark sweeps them
+BENCH_PIPE = 4
+
+# Radio MACs. The low byte is replaced by the pipe address modifier, so nodes
+# must differ in the upper bytes.
+MAC_A = 0xC4C5C6C700
+MAC_B = 0xD4D5D6D700
+
+
+# ---------------------------------------------
+# Measurement helpers
+# ---------------------------------------------
+def _ops_per_sec(func: Callable[[], None], min_time: float, repeat: int = 3) -> float:
+    """
+    Times func in a tight loop, growing the loop until one pass takes min_time
+
+    Returns:
+        Best rate seen over all the passes
+    """
+    loops = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(loops):
+            func()
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_time:
+            break
+        loops *= 10 if elapsed < min_time / 10 else 2
+
+    best = elapsed
+    for _ in range(repeat - 1):
+        start = time.perf_counter()
+        for _ in range(loops):
+            func()
+        best = min(best, time.perf_counter() - start)
+
+    return loops / best
+
+
+def _ops(func: Callable[[], None], min_time: float) -> Metric:
+    return Metric(_ops_per_sec(func, min_time), "ops/s", True)
+
+
+def _latency_metrics(name: str, samples: List[float]) -> Results:
+    samples = sorted(samples)
+    p99 = samples[min(len(samples) - 1, int(len(samples) * 0.99))]
+    return {
+        name + ".p50": Metric(statistics.median(samples) * 1e6, "us", False),
+        name + ".p99": Metric(p99 * 1e6, "us", False),
+    }
+
+
+def _data_frame(require_ack: bool, value: int = 0) -> bytearray:
+    frame = PackedFrame()
+    frame.requireAck = int(require_ack)
+    frame.write_data(value.to_bytes(4, 'little'))
+    return frame.pack()
+
+
+@contextlib.contextmanager
+def _radio_pair(pipe: int, duplex: bool, **kwargs):
+    """
+    Starts two radios with A able to transmit to B, and B to A if duplex
+    """
+    a = ShockBurstRadio(verbose=False, **kwargs)
+    b = ShockBurstRadio(verbose=False, **kwargs)
+    a.set_device_mac(MAC_A)
+    b.set_device_mac(MAC_B)
+    a.open_tx_pipe(MAC_B, pipe)
+    if duplex:
+        b.open_tx_pipe(MAC_A, pipe)
+
+    a.start()
+    b.start()
+
+    # The pump sleeps before it starts polling, and subscriptions need a moment to connect
+    time.sleep(0.75)
+
+    try:
+        yield a, b
+    finally:
+        for radio in (a, b):
+            radio.kill()
+        for radio in (a, b):
+            radio.join()
+            radio.close()
+
+
+# ---------------------------------------------
+# Benchmarks
+# ---------------------------------------------
+def bench_packed_frame(min_time: float) -> Results:
+    frame = PackedFrame()
+    frame.requireAck = 1
+    frame.frameNumber = 7
+    frame.write_data(bytes(range(PackedFrame.MAX_FRAME_SIZE - PackedFrame.CONTROL_FIELD_SIZE)))
+    data = frame.pack()
+
+    return {
+        "packed_frame.pack": _ops(frame.pack, min_time),
+        "packed_frame.unpack": _ops(lambda: frame.unpack(data), min_time),
+    }
+
+
+def bench_ack_frame(min_time: float) -> Results:
+    ack = ACKFrame()
+    ack.destination = MAC_A
+    ack.sequence = 3
+
+    return {
+        "ack_frame.is_valid": _ops(ack.is_valid, min_time),
+    }
+
+
+def bench_protobuf(min_time: float) -> Results:
+    pb_frame = shockburst_pb2.ShockBurstFrame()
+    pb_frame.sender = MAC_A.to_bytes(5, 'little')
+    pb_frame.crc = 0
+    pb_frame.type = FrameType.USER_DATA.value
+    pb_frame.frame_id = 3
+    pb_frame.data = bytes(_data_frame(True))
+    data = pb_frame.SerializeToString()
+
+    def parse():
+        shockburst_pb2.ShockBurstFrame().ParseFromString(data)
+
+    return {
+        "protobuf.serialize": _ops(pb_frame.SerializeToString, min_time),
+        "protobuf.parse": _ops(parse, min_time),
+    }
+
+
+def bench_compact(min_time: float) -> Results:
+    data = _data_frame(True)
+    message = bytes(encode(WireFormat.COMPACT, MAC_A, FrameType.USER_DATA.value, 3, data))
+
+    return {
+        "compact.encode": _ops(lambda: encode(WireFormat.COMPACT, MAC_A, FrameType.USER_DATA.value, 3, data), min_time),
+        "compact.decode": _ops(lambda: decode(message), min_time),
+    }
+
+
+def bench_radio_latency(min_time: float) -> Results:
+    """
+    Ping-pong between two radios. B echoes every frame straight back to A.
+    """
+    results = {}
+    for require_ack in (False, True):
+        samples = []
+        with _radio_pair(BENCH_PIPE, duplex=True) as (a, b):
+            frame = _data_frame(require_ack)
+            deadline = time.perf_counter() + min_time
+            while time.perf_counter() < deadline or len(samples) < 10:
+                start = time.perf_counter()
+                a.transmit(frame)
+                b.transmit(b.receive(True, 5).payload.pack())
+                a.receive(True, 5)
+                samples.append(time.perf_counter() - start)
+
+        name = "radio.round_trip_ack" if require_ack else "radio.round_trip_no_ack"
+        results.update(_latency_metrics(name, samples))
+
+    return results
+
+
+def bench_radio_throughput(min_time: float) -> Results:
+    """
+    Sustained one way transfer of ACK'd frames into each of the RX pipes
+    """
+    results = {}
+    for pipe in range(1, ShockBurstRadio.total_pipes()):
+        with _radio_pair(pipe, duplex=False, tx_fifo_depth=32, rx_fifo_depth=32) as (a, b):
+            stop = threading.Event()
+
+            def produce():
+                value = 0
+                while not stop.is_set():
+                    if a.transmit(_data_frame(True, value), timeout=0.1):
+                        value += 1
+
+            producer = threading.Thread(target=produce)
+            producer.start()
+
+            received = 0
+            start = time.perf_counter()
+            try:
+                while time.perf_counter() - start < min_time:
+                    b.receive(True, 5)
+                    received += 1
+            except queue.Empty:
+                pass
+            elapsed = time.perf_counter() - start
+
+            stop.set()
+            producer.join()
+
+        results["radio.throughput.pipe{}".format(pipe)] = Metric(received / elapsed, "frames/s", True)
+
+    return results
+
+
+BENCHMARKS = {
+    "packed_frame": bench_packed_frame,
+    "ack_frame": bench_ack_frame,
+    "protobuf": bench_protobuf,
+    "compact": bench_compact,
+    "radio_latency": bench_radio_latency,
+    "radio_throughput": bench_radio_throughput,
+}
+
+
+# ---------------------------------------------
+# Reporting
+# ---------------------------------------------
+def run_benchmarks(names: List[str], min_time: float) -> dict:
+    """
+    Runs the requested benchmarks
+
+    Args:
+        names: Keys of BENCHMARKS to run
+        min_time: Seconds each measurement should take, at minimum
+
+    Returns:
+        JSON serializable report
+    """
+    results = {}
+    for name in names:
+        print("Running {}...".format(name), file=sys.stderr)
+        results.update(BENCHMARKS[name](min_time))
+
+    return {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "min_time": min_time,
+        },
+        "results": {key: metric._asdict() for key, metric in sorted(results.items())},
+    }
+
+
+def compare_reports(baseline: dict, current: dict, threshold: float) -> List[str]:
+    """
+    Compares two reports, printing the change of every metric found in both
+
+    Args:
+        baseline: Report to compare against
+        current: Freshly measured report
+        threshold: Fractional change in the wrong direction that counts as a regression
+
+    Returns:
+        Names of the metrics that regressed
+    """
+    regressions = []
+    print("{:36s} {:>12s} {:>12s} {:>8s}".format("metric", "baseline", "current", "change"))
+
+    for key, metric in current["results"].items():
+        old = baseline["results"].get(key)
+        if old is None or not old["value"]:
+            print("{:36s} {:>12s} {:12.1f} {:>8s}".format(key, "-", metric["value"], "new"))
+            continue
+
+        change = (metric["value"] - old["value"]) / old["value"]
+        worse = -change if metric["higher_is_better"] else change
+        flag = ""
+        if worse > threshold:
+            regressions.append(key)
+            flag = "  REGRESSION"
+
+        print("{:36s} {:12.1f} {:12.1f} {:+7.1%}{}".format(key, old["value"], metric["value"], change, flag))
+
+    return regressions
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Framing and radio microbenchmarks")
+    parser.add_argument("benchmarks", nargs="*", metavar="BENCHMARK",
+                        help="Benchmarks to run, out of {}. Defaults to all of them.".format(", ".join(BENCHMARKS)))
+    parser.add_argument("--output", "-o", help="Write the JSON report here instead of stdout")
+    parser.add_argument("--compare", "-c", metavar="BASELINE", help="Report to check for regressions against")
+    parser.add_argument("--threshold", "-t", type=float, default=0.10,
+                        help="Fractional slowdown that counts as a regression (default 0.10)")
+    parser.add_argument("--min-time", type=float, default=0.5, help="Seconds per measurement (default 0.5)")
+    args = parser.parse_args()
+
+    unknown = [name for name in args.benchmarks if name not in BENCHMARKS]
+    if unknown:
+        parser.error("unknown benchmark(s): {}".format(", ".join(unknown)))
+
+    # Radio threads print status messages, which must not end up in the JSON
+    with contextlib.redirect_stdout(sys.stderr):
+        report = run_benchmarks(args.benchmarks or list(BENCHMARKS.keys()), args.min_time)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    elif not args.compare:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+
+        regressions = compare_reports(baseline, report, args.threshold)
+        if regressions:
+            print("\n{} regression(s): {}".format(len(regressions), ", ".join(regressions)))
+            return 1
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
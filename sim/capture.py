@@ -0,0 +1,316 @@
+# **********************************************************************************************************************
+#   FileName:
+#       capture.py
+#
+#   Description:
+#       Records every frame a radio sends or receives into a memory mapped ring file, and exports
+#       the records to pcap so captures can be opened in Wireshark.
+#
+#   2021 | Brandon Braun | brandonbraun653@gmail.com
+# **********************************************************************************************************************
+
+import mmap
+import os
+import struct
+
+from enum import Enum
+from pathlib import Path
+from threading import Lock
+from typing import Iterable, Iterator, List, NamedTuple, Union
+from frame_packager import PackedFrame
+from ipc_utils import NRF24_ADDRESS_ENDIAN, NRF24_ADDRESS_WIDTH
+
+Buffer = Union[bytes, bytearray, memoryview]
+
+
+class Direction(Enum):
+    TX = 0
+    RX = 1
+
+
+_DIRECTIONS = tuple(Direction)     # Indexed by value, which is quicker than Direction(value)
+
+
+class CaptureRecord(NamedTuple):
+    """ A single frame seen by a radio """
+    timestamp: float        # Radio clock time, in seconds
+    mac: int                # Radio that recorded the frame
+    peer: int               # Device on the other end, 0 if unknown
+    pipe: int               # Pipe on the receiving device
+    direction: Direction
+    frame_type: int         # FrameType value
+    data: bytes             # Packed frame
+
+
+# ---------------------------------------------------------------------
+# Ring file layout, little endian. A 64 byte header:
+#   magic       char[4]     RING_MAGIC
+#   version     u16
+#   record_size u16
+#   capacity    u32         Records the ring can hold
+#   written     u64         Records appended since the file was created
+#
+# Followed by capacity records of 64 bytes each:
+#   timestamp   f64
+#   mac         u64
+#   peer        u64
+#   pipe        u8
+#   direction   u8
+#   frame_type  u8
+#   length      u8          Bytes of data that are valid
+#   data        u8[32]
+# ---------------------------------------------------------------------
+RING_MAGIC = b'RCAP'
+RING_VERSION = 1
+RING_HEADER = struct.Struct('<4sHHIQ')
+RING_HEADER_SIZE = 64
+RECORD = struct.Struct('<dQQBBBB{}s4x'.format(PackedFrame.MAX_FRAME_SIZE))
+
+_WRITTEN_OFFSET = 12
+
+
+class CaptureRing:
+    """
+    Fixed size ring of capture records in a memory mapped file. Appending is a
+    struct pack into the mapping, so the OS writes the file back in the
+    background. Once full, the oldest records are overwritten, or the file is
+    rotated out if rotate_when_full is set.
+
+    Rotated files get a numeric suffix, the most recent being .1, and only the
+    newest `keep` of them are kept around.
+    """
+    DEFAULT_CAPACITY = 65536
+
+    def __init__(self, path: Union[str, Path], capacity: int = DEFAULT_CAPACITY, rotate_when_full: bool = False,
+                 keep: int = 4):
+        """
+        Args:
+            path: File to record into. Replaced if it exists.
+            capacity: Max number of records the file holds
+            rotate_when_full: Whether to start a new file rather than overwrite old records
+            keep: Max number of rotated files kept
+        """
+        assert(capacity > 0)
+        self.path = Path(path)
+        self.capacity = capacity
+        self.rotate_when_full = rotate_when_full
+        self.keep = keep
+        self.rotations = 0
+
+        self._lock = Lock()
+        self._file = None
+        self._map = None    # type: mmap.mmap
+        self._written = 0
+        self._create()
+
+    def __len__(self) -> int:
+        return min(self._written, self.capacity)
+
+    def __iter__(self) -> Iterator[CaptureRecord]:
+        with self._lock:
+            return iter(list(_iter_records(self._map, self.capacity, self._written)))
+
+    def append(self, timestamp: float, mac: int, peer: int, pipe: int, direction: Direction, frame_type: int,
+               data: Buffer) -> None:
+        """
+        Adds a record to the ring
+
+        Args:
+            timestamp: Radio clock time the frame was seen at
+            mac: Radio recording the frame
+            peer: Device on the other end, 0 if unknown
+            pipe: Pipe on the receiving device
+            direction: Whether the radio sent or received the frame
+            frame_type: FrameType value
+            data: Packed frame
+
+        Returns:
+            None
+        """
+        with self._lock:
+            if self._written >= self.capacity and self.rotate_when_full:
+                self._rotate()
+
+            offset = RING_HEADER_SIZE + (self._written % self.capacity) * RECORD.size
+            RECORD.pack_into(self._map, offset, timestamp, mac, peer, pipe, direction.value, frame_type, len(data),
+                             bytes(data))
+            self._written += 1
+            struct.pack_into('<Q', self._map, _WRITTEN_OFFSET, self._written)
+
+    def rotate(self) -> None:
+        """
+        Moves the current file aside and starts recording into a new one
+        Returns:
+            None
+        """
+        with self._lock:
+            self._rotate()
+
+    def flush(self) -> None:
+        """
+        Writes the mapping back to the file
+        Returns:
+            None
+        """
+        with self._lock:
+            self._map.flush()
+
+    def close(self) -> None:
+        """
+        Flushes and closes the file
+        Returns:
+            None
+        """
+        with self._lock:
+            self._close()
+
+    def _create(self) -> None:
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._file = open(self.path, 'w+b')
+        self._file.truncate(RING_HEADER_SIZE + self.capacity * RECORD.size)
+        self._map = mmap.mmap(self._file.fileno(), 0)
+        RING_HEADER.pack_into(self._map, 0, RING_MAGIC, RING_VERSION, RECORD.size, self.capacity, 0)
+        self._written = 0
+
+    def _close(self) -> None:
+        if self._map is not None:
+            self._map.flush()
+            self._map.close()
+            self._file.close()
+            self._map = None
+
+    def _rotate(self) -> None:
+        self._close()
+        for idx in range(self.keep, 0, -1):
+            older = rotated_path(self.path, idx)
+            if idx == self.keep:
+                if older.exists():
+                    older.unlink()
+            elif older.exists():
+                os.replace(older, rotated_path(self.path, idx + 1))
+
+        if self.keep > 0:
+            os.replace(self.path, rotated_path(self.path, 1))
+        self.rotations += 1
+        self._create()
+
+
+def rotated_path(path: Union[str, Path], index: int) -> Path:
+    """
+    Returns:
+        Where a ring file goes after being rotated out `index` times
+    """
+    path = Path(path)
+    return path.with_name("{}.{}".format(path.name, index))
+
+
+def read_capture(path: Union[str, Path]) -> List[CaptureRecord]:
+    """
+    Reads every record out of a ring file, oldest first. The file may still be
+    in use by a recorder.
+
+    Args:
+        path: Ring file
+
+    Returns:
+        The records
+    """
+    return list(iter_capture(path))
+
+
+def iter_capture(path: Union[str, Path]) -> Iterator[CaptureRecord]:
+    """
+    Streams the records out of a ring file, oldest first, without loading the
+    whole file. The file stays mapped until the iterator is exhausted or closed.
+
+    Args:
+        path: Ring file
+
+    Returns:
+        Iterator over the records
+    """
+    with open(path, 'rb') as file:
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as view:
+            magic, version, record_size, capacity, written = RING_HEADER.unpack_from(view, 0)
+            if magic != RING_MAGIC or version != RING_VERSION or record_size != RECORD.size:
+                raise ValueError("{} is not a capture ring".format(path))
+            yield from _iter_records(view, capacity, written)
+
+
+def capture_files(path: Union[str, Path]) -> List[Path]:
+    """
+    Finds a ring file and every rotated file that is still around
+
+    Args:
+        path: Ring file the recorder was created with
+
+    Returns:
+        Existing files, oldest first
+    """
+    path = Path(path)
+    files = []
+    idx = 1
+    while rotated_path(path, idx).exists():
+        files.insert(0, rotated_path(path, idx))
+        idx += 1
+    if path.exists():
+        files.append(path)
+    return files
+
+
+def _iter_records(view: Buffer, capacity: int, written: int) -> Iterator[CaptureRecord]:
+    count = min(written, capacity)
+    for idx in range(written - count, written):
+        offset = RING_HEADER_SIZE + (idx % capacity) * RECORD.size
+        timestamp, mac, peer, pipe, direction, frame_type, length, data = RECORD.unpack_from(view, offset)
+        yield CaptureRecord(timestamp, mac, peer, pipe, _DIRECTIONS[direction], frame_type, data[:length])
+
+
+# ---------------------------------------------------------------------
+# There is no registered pcap link type for the NRF24, so captures use
+# the first private one. In Wireshark, map DLT User 0 to a dissector for
+# the pseudo header below followed by the packed frame:
+#   version     u8          PSEUDO_HEADER_VERSION
+#   direction   u8          Direction
+#   pipe        u8
+#   frame_type  u8
+#   mac         u8[5]       Recording radio, little endian
+#   peer        u8[5]       Other end, little endian
+# ---------------------------------------------------------------------
+LINKTYPE_NRF24 = 147    # LINKTYPE_USER0
+PSEUDO_HEADER_VERSION = 1
+
+_PCAP_HEADER = struct.Struct('<IHHiIII')
+_PCAP_RECORD = struct.Struct('<IIII')
+_PCAP_MAGIC = 0xA1B23C4D        # Nanosecond timestamps
+_PCAP_SNAPLEN = 65535
+_PSEUDO_HEADER = struct.Struct('<BBBB5s5s')
+
+
+def export_pcap(records: Iterable[CaptureRecord], path: Union[str, Path]) -> int:
+    """
+    Writes capture records to a pcap file. Timestamps come from the radio
+    clock, so they are only meaningful relative to each other.
+
+    Args:
+        records: Records to write, such as from read_capture()
+        path: pcap file to create
+
+    Returns:
+        Number of packets written
+    """
+    count = 0
+    with open(path, 'wb') as file:
+        file.write(_PCAP_HEADER.pack(_PCAP_MAGIC, 2, 4, 0, 0, _PCAP_SNAPLEN, LINKTYPE_NRF24))
+        for record in records:
+            pseudo = _PSEUDO_HEADER.pack(PSEUDO_HEADER_VERSION, record.direction.value, record.pipe,
+                                         record.frame_type,
+                                         record.mac.to_bytes(NRF24_ADDRESS_WIDTH, NRF24_ADDRESS_ENDIAN),
+                                         record.peer.to_bytes(NRF24_ADDRESS_WIDTH, NRF24_ADDRESS_ENDIAN))
+            ns = int(round(record.timestamp * 1e9))
+            length = len(pseudo) + len(record.data)
+            file.write(_PCAP_RECORD.pack(ns // 1000000000, ns % 1000000000, length, length))
+            file.write(pseudo)
+            file.write(record.data)
+            count += 1
+    return count
@@ -0,0 +1,243 @@
+# **********************************************************************************************************************
+#   FileName:
+#       channel.py
+#
+#   Description:
+#       Lossy radio channel models placed on the links between virtual radios. Frames can be lost,
+#       corrupted, duplicated, reordered and delayed, with optional Gilbert-Elliott burst losses.
+#
+#   2021 | Brandon Braun | brandonbraun653@gmail.com
+# **********************************************************************************************************************
+
+import numpy as np
+
+from threading import Lock
+from typing import Dict, List, NamedTuple, Optional, Tuple, Union
+from phy import PhyTiming
+
+Buffer = Union[bytes, bytearray, memoryview]
+
+# ---------------------------------------------------------------------
+# Bits on the air around each payload, with a 5 byte address and 2 byte
+# CRC, that a bit error can also land in.
+# ---------------------------------------------------------------------
+FRAMING_BITS = 8 * (PhyTiming.PREAMBLE_BYTES + 5 + 2) + PhyTiming.PCF_BITS
+
+
+class GilbertElliott(NamedTuple):
+    """
+    Two state Markov model of bursty losses. The channel moves between a good
+    and a bad state once per frame, and each state has its own loss rate.
+    """
+    p_bad: float                # Chance of moving from the good state to the bad one
+    p_good: float               # Chance of moving from the bad state back to the good one
+    loss_good: float = 0.0      # Loss rate in the good state
+    loss_bad: float = 1.0       # Loss rate in the bad state
+
+    @property
+    def mean_loss(self) -> float:
+        """ Long run loss rate """
+        in_bad = self.p_bad / (self.p_bad + self.p_good) if (self.p_bad + self.p_good) else 0.0
+        return (1.0 - in_bad) * self.loss_good + in_bad * self.loss_bad
+
+
+class ChannelModel(NamedTuple):
+    """ Impairments applied to every frame crossing a link """
+    loss: float = 0.0               # Chance a frame is lost. Ignored when burst is given.
+    bit_error_rate: float = 0.0     # Chance each bit on the air is flipped
+    duplicate: float = 0.0          # Chance a frame is delivered twice
+    reorder: float = 0.0            # Chance a frame is held back so later ones overtake it
+    reorder_delay: float = 1e-3     # Seconds a reordered frame is held back for
+    latency: float = 0.0            # Seconds every frame takes to cross the link
+    jitter: float = 0.0             # Max extra seconds added to the latency, uniformly drawn
+    burst: Optional[GilbertElliott] = None
+
+    # Drop frames with bit errors like the NRF24 does, rather than delivering them with a flipped bit
+    crc: bool = True
+
+
+# Random numbers each frame uses, so the stream stays in step whatever happens to a frame
+_DRAW_STATE, _DRAW_LOSS, _DRAW_ERROR, _DRAW_BIT = range(4)
+_DRAW_DUPLICATE, _DRAW_REORDER, _DRAW_JITTER, _DRAW_JITTER_DUP = range(4, 8)
+_DRAWS_PER_FRAME = 8
+
+
+class Channel:
+    """
+    One direction of a link between two radios. Random numbers are drawn from
+    NumPy in batches, which keeps the cost per frame to a list lookup.
+    """
+    DEFAULT_BATCH_SIZE = 1024
+
+    def __init__(self, model: ChannelModel, rng: np.random.Generator = None, batch_size: int = DEFAULT_BATCH_SIZE):
+        """
+        Args:
+            model: Impairments to apply
+            rng: Random number generator. A freshly seeded one is made if not given.
+            batch_size: Number of frames worth of random numbers drawn at a time
+        """
+        assert(batch_size > 0)
+        self.model = model
+        self.batch_size = batch_size
+        self._rng = rng if rng is not None else np.random.default_rng()
+        self._draws = []        # type: List[List[float]]
+        self._cursor = 0
+        self._bad_state = False
+        self._error_rates = {}  # type: Dict[int, float]
+
+        self.frames = 0
+        self.lost = 0
+        self.corrupted = 0
+        self.duplicated = 0
+        self.reordered = 0
+
+    def transmit(self, frame: Buffer, now: float) -> List[Tuple[float, Buffer]]:
+        """
+        Sends a frame across the link
+
+        Args:
+            frame: Packed frame
+            now: Current clock time
+
+        Returns:
+            Each copy of the frame that makes it across along with the clock time it
+            arrives at. Empty if the frame was lost.
+        """
+        if self._cursor >= len(self._draws):
+            self._draws = self._rng.random((self.batch_size, _DRAWS_PER_FRAME)).tolist()
+            self._cursor = 0
+        draws = self._draws[self._cursor]
+        self._cursor += 1
+
+        model = self.model
+        self.frames += 1
+
+        # ---------------------------------------------
+        # Losses, either independent or in bursts
+        # ---------------------------------------------
+        if model.burst is not None:
+            burst = model.burst
+            if self._bad_state:
+                self._bad_state = draws[_DRAW_STATE] >= burst.p_good
+            else:
+                self._bad_state = draws[_DRAW_STATE] < burst.p_bad
+            loss = burst.loss_bad if self._bad_state else burst.loss_good
+        else:
+            loss = model.loss
+
+        if draws[_DRAW_LOSS] < loss:
+            self.lost += 1
+            return []
+
+        # ---------------------------------------------
+        # Bit errors
+        # ---------------------------------------------
+        if model.bit_error_rate and draws[_DRAW_ERROR] < self._error_rate(len(frame)):
+            self.corrupted += 1
+            if model.crc:
+                return []
+
+            frame = bytearray(frame)
+            bit = int(draws[_DRAW_BIT] * len(frame) * 8)
+            frame[bit // 8] ^= 1 << (bit % 8)
+
+        # ---------------------------------------------
+        # Timing of each copy that gets through
+        # ---------------------------------------------
+        arrival = now + model.latency + model.jitter * draws[_DRAW_JITTER]
+        if draws[_DRAW_REORDER] < model.reorder:
+            self.reordered += 1
+            arrival += model.reorder_delay
+
+        copies = [(arrival, frame)]
+        if draws[_DRAW_DUPLICATE] < model.duplicate:
+            self.duplicated += 1
+            copies.append((now + model.latency + model.jitter * draws[_DRAW_JITTER_DUP], frame))
+        return copies
+
+    def _error_rate(self, size: int) -> float:
+        """
+        Returns:
+            Chance that a frame of some size has at least one bit error
+        """
+        rate = self._error_rates.get(size)
+        if rate is None:
+            rate = 1.0 - (1.0 - self.model.bit_error_rate) ** (8 * size + FRAMING_BITS)
+            self._error_rates[size] = rate
+        return rate
+
+
+class ChannelMap:
+    """
+    Channel models for every link in a network, shared by all of the radios on
+    it. Each direction of a link has its own channel and its own random stream,
+    seeded from the map's seed and the two MAC addresses, so results don't
+    depend on which links happen to carry traffic first.
+    """
+
+    def __init__(self, default: ChannelModel = None, seed: int = 0, batch_size: int = Channel.DEFAULT_BATCH_SIZE):
+        """
+        Args:
+            default: Model for links without one of their own. None leaves them perfect.
+            seed: Seed for every link's random numbers
+            batch_size: Number of frames worth of random numbers each link draws at a time
+        """
+        self.default = default
+        self.seed = seed
+        self.batch_size = batch_size
+        self._models = {}       # type: Dict[Tuple[int, int], Optional[ChannelModel]]
+        self._channels = {}     # type: Dict[Tuple[int, int], Optional[Channel]]
+        self._lock = Lock()
+
+    def set_link(self, src_mac: int, dst_mac: int, model: Optional[ChannelModel], symmetric: bool = True) -> None:
+        """
+        Sets the model of a link. Must be called before the link carries any traffic.
+
+        Args:
+            src_mac: Transmitting device
+            dst_mac: Receiving device
+            model: Impairments to apply. None makes the link perfect.
+            symmetric: Whether the reverse direction, which carries the ACKs, gets the same model
+
+        Returns:
+            None
+        """
+        with self._lock:
+            self._models[(src_mac, dst_mac)] = model
+            if symmetric:
+                self._models[(dst_mac, src_mac)] = model
+
+    def link(self, src_mac: int, dst_mac: int) -> Optional[Channel]:
+        """
+        Looks up the channel frames from one device to another go through
+
+        Args:
+            src_mac: Transmitting device
+            dst_mac: Receiving device
+
+        Returns:
+            The channel, or None if the link is perfect
+        """
+        key = (src_mac, dst_mac)
+        try:
+            return self._channels[key]
+        except KeyError:
+            pass
+
+        with self._lock:
+            if key not in self._channels:
+                model = self._models.get(key, self.default)
+                channel = None
+                if model is not None:
+                    rng = np.random.default_rng([self.seed, src_mac, dst_mac])
+                    channel = Channel(model, rng, self.batch_size)
+                self._channels[key] = channel
+            return self._channels[key]
+
+    def channels(self) -> Dict[Tuple[int, int], Channel]:
+        """
+        Returns:
+            Every impaired link that has carried traffic, keyed by (source MAC, destination MAC)
+        """
+        with self._lock:
+            return {key: channel for key, channel in self._channels.items() if channel is not None}
@@ -0,0 +1,375 @@
+# **********************************************************************************************************************
+#   FileName:
+#       event_sim.py
+#
+#   Description:
+#       Discrete event simulation of a network of virtual radios. Time is virtual and only moves
+#       forward when there is nothing left to do at the current instant, so a scenario runs as
+#       fast as the CPU allows and the same inputs always produce the same results.
+#
+#   2021 | Brandon Braun | brandonbraun653@gmail.com
+# **********************************************************************************************************************
+
+import heapq
+import zmq
+
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from hw_fifo import OverflowPolicy
+from ipc_utils import TRANSPORT_INPROC
+from network_sim import NetworkSimulator, SimulatedRadio
+
+
+class VirtualClock:
+    """
+    Clock that only moves when told to. Calling it returns the current time,
+    so it can be handed to anything that takes a time.monotonic style clock.
+    """
+
+    def __init__(self, start: float = 0.0):
+        """
+        Args:
+            start: Initial time, in seconds
+        """
+        self.now = start
+
+    def __call__(self) -> float:
+        return self.now
+
+    def advance_to(self, when: float) -> None:
+        """
+        Moves the clock forward to some point in time
+
+        Args:
+            when: Time to move to. Must not be in the past.
+
+        Returns:
+            None
+        """
+        assert(when >= self.now)
+        self.now = when
+
+    def advance(self, delta: float) -> None:
+        """
+        Moves the clock forward by some number of seconds
+        Returns:
+            None
+        """
+        self.advance_to(self.now + delta)
+
+
+class ScheduledEvent:
+    """
+    Handle to a callback waiting in an EventScheduler
+    """
+    __slots__ = ('when', 'func', 'args', 'cancelled')
+
+    def __init__(self, when: float, func: Callable[..., Any], args: Tuple[Any, ...]):
+        self.when = when
+        self.func = func
+        self.args = args
+        self.cancelled = False
+
+    def cancel(self) -> None:
+        """
+        Stops the callback from running. Has no effect if it already ran.
+        Returns:
+            None
+        """
+        self.cancelled = True
+
+
+class EventScheduler:
+    """
+    Queue of callbacks to run at points in virtual time. Events due at the same
+    time run in the order they were scheduled.
+    """
+
+    def __init__(self, clock: VirtualClock):
+        """
+        Args:
+            clock: Clock the event times refer to
+        """
+        self.clock = clock
+        self._queue = []    # type: List[Tuple[float, int, ScheduledEvent]]
+        self._count = 0
+
+    def __len__(self) -> int:
+        return sum(1 for _, _, event in self._queue if not event.cancelled)
+
+    def call_at(self, when: float, func: Callable[..., Any], *args: Any) -> ScheduledEvent:
+        """
+        Schedules a callback for some point in time
+
+        Args:
+            when: Clock time to run at. Times in the past run at the next opportunity.
+            func: Callback to run
+            args: Arguments to pass to the callback
+
+        Returns:
+            Handle that can cancel the callback
+        """
+        event = ScheduledEvent(max(when, self.clock.now), func, args)
+        heapq.heappush(self._queue, (event.when, self._count, event))
+        self._count += 1
+        return event
+
+    def call_later(self, delay: float, func: Callable[..., Any], *args: Any) -> ScheduledEvent:
+        """
+        Schedules a callback to run some number of seconds from now
+        Returns:
+            Handle that can cancel the callback
+        """
+        return self.call_at(self.clock.now + delay, func, *args)
+
+    def next_time(self) -> Optional[float]:
+        """
+        Returns:
+            Time of the earliest pending event, or None if there aren't any
+        """
+        while self._queue and self._queue[0][2].cancelled:
+            heapq.heappop(self._queue)
+        return self._queue[0][0] if self._queue else None
+
+    def run_due(self) -> int:
+        """
+        Runs every event due at or before the current time, including any
+        that those events schedule for the current time
+
+        Returns:
+            Number of events run
+        """
+        count = 0
+        while self._queue and self._queue[0][0] <= self.clock.now:
+            _, _, event = heapq.heappop(self._queue)
+            if not event.cancelled:
+                event.func(*event.args)
+                count += 1
+        return count
+
+
+class DiscreteEventSimulator:
+    """
+    Hosts SimulatedRadio nodes like the NetworkSimulator, but on a virtual clock
+    and without a thread. Nothing happens until run() is called, which pumps the
+    nodes until the network settles, then jumps the clock straight to the next
+    scheduled event or ARQ timer.
+
+    Everything runs on the caller's thread, so workloads are written as events
+    handed to the scheduler. Events must never block: receive() is only useful
+    with block=False, and nodes refuse frames that don't fit in their TX FIFO
+    unless some other overflow policy is given.
+    """
+
+    def __init__(self, transport: str = TRANSPORT_INPROC, context: zmq.Context = None, start_time: float = 0.0):
+        """
+        Args:
+            transport: ZMQ transport used for the node pipes. Only TRANSPORT_INPROC
+                is deterministic.
+            context: Context shared by every node. A new one is made if not given.
+            start_time: Initial value of the virtual clock, in seconds
+        """
+        self.transport = transport
+        self.clock = VirtualClock(start_time)
+        self.scheduler = EventScheduler(self.clock)
+
+        NetworkSimulator._raise_fd_limit()
+        self.context = context if context is not None else zmq.Context()
+        self.context.set(zmq.MAX_SOCKETS, NetworkSimulator.MAX_SOCKETS)
+
+        self._nodes = {}            # type: Dict[int, SimulatedRadio]
+        self._poller = zmq.Poller()
+        self._socket_owner = {}     # type: Dict[zmq.Socket, SimulatedRadio]
+        self._active = {}           # Nodes with frames to send or ARQ timers running, in the order they got work
+
+        self.iterations = 0         # Pump loop passes
+        self.events = 0             # Scheduled events run
+
+    def __len__(self) -> int:
+        return len(self._nodes)
+
+    @property
+    def now(self) -> float:
+        return self.clock.now
+
+    def node(self, mac: int) -> SimulatedRadio:
+        return self._nodes[mac]
+
+    def add_node(self, mac: int, transports: Tuple[str, ...] = None, **kwargs) -> SimulatedRadio:
+        """
+        Creates a node and binds its pipes to the given MAC address
+
+        Args:
+            mac: Root MAC address of the node
+            transports: Every transport the node should be reachable over. Defaults
+                to the simulator's transport.
+            kwargs: FIFO and ARQ settings for the node
+
+        Returns:
+            The new node
+        """
+        assert(mac not in self._nodes)
+
+        # Nothing can drain a full TX FIFO while an event waits on it
+        kwargs.setdefault('tx_overflow', OverflowPolicy.ERROR)
+
+        node = SimulatedRadio(self, **kwargs)
+        self._nodes[mac] = node
+        node.set_device_mac(mac, transports)
+        for pipe in node.rxPipe:
+            self._poller.register(pipe, zmq.POLLIN)
+            self._socket_owner[pipe] = node
+        return node
+
+    def connect(self, src_mac: int, dst_mac: int, pipe: int, transport: str = None) -> None:
+        """
+        Opens the TX pipe of one node to an RX pipe of another
+
+        Args:
+            src_mac: Node that will transmit
+            dst_mac: Node that will receive
+            pipe: Which pipe to write to on the destination. Should be 1-5.
+            transport: Transport to reach the destination over. Defaults to the
+                simulator's transport, which only reaches nodes it hosts.
+
+        Returns:
+            None
+        """
+        self._nodes[src_mac].open_tx_pipe(dst_mac, pipe, transport)
+
+    def connect_multicast(self, src_mac: int, dst_mac: int, transport: str = None) -> None:
+        """
+        Puts one node in multicast range of another
+
+        Args:
+            src_mac: Node that will send multicast frames
+            dst_mac: Node that will hear them, for the groups it joins
+            transport: Transport to reach the destination over. Defaults to the
+                simulator's transport, which only reaches nodes it hosts.
+
+        Returns:
+            None
+        """
+        self._nodes[src_mac].add_multicast_peer(dst_mac, transport)
+
+    def join_group(self, mac: int, group: int, pipe: int) -> None:
+        """
+        Subscribes a node to the frames multicast to a group
+
+        Args:
+            mac: Node joining the group
+            group: Address of the group
+            pipe: Pipe the node receives the group's frames on
+
+        Returns:
+            None
+        """
+        self._nodes[mac].join_group(group, pipe)
+
+    def leave_group(self, mac: int, group: int) -> None:
+        """
+        Unsubscribes a node from the frames multicast to a group
+
+        Args:
+            mac: Node leaving the group
+            group: Address of the group
+
+        Returns:
+            None
+        """
+        self._nodes[mac].leave_group(group)
+
+    def notify_tx(self, node: SimulatedRadio) -> None:
+        """
+        Marks a node as having work for the TX side of its pump
+
+        Args:
+            node: Node that queued a frame
+
+        Returns:
+            None
+        """
+        self._active[node] = None
+
+    def close(self) -> None:
+        """
+        Closes every node and the shared context
+        Returns:
+            None
+        """
+        for node in self._nodes.values():
+            node.close()
+        self.context.term()
+
+    def run(self, until: float = None) -> float:
+        """
+        Runs events and pumps the nodes until there is nothing left to do
+
+        Args:
+            until: Clock time to stop at. Events due at exactly this time still
+                run. None runs until the network goes idle.
+
+        Returns:
+            Clock time the simulation stopped at
+        """
+        while True:
+            self._settle()
+
+            next_time = self._next_time()
+            if next_time is None or (until is not None and next_time > until):
+                break
+
+            self.clock.advance_to(next_time)
+            self.events += self.scheduler.run_due()
+
+        if until is not None and until > self.clock.now:
+            self.clock.advance_to(until)
+        return self.clock.now
+
+    def run_for(self, duration: float) -> float:
+        """
+        Runs the simulation for some number of virtual seconds
+        Returns:
+            Clock time the simulation stopped at
+        """
+        return self.run(self.clock.now + duration)
+
+    def _settle(self) -> None:
+        """
+        Pumps every node without moving the clock until no more frames are
+        moving. Nodes are visited in a fixed order so runs are repeatable.
+        """
+        idle = False
+        while True:
+            ready = dict(self._poller.poll(0))
+            self.iterations += 1
+
+            # -----------------------------------------------------------------
+            # Frames sent on the last pass only show up on the next poll, so it
+            # takes one pass with nothing to receive to be sure we're done.
+            # -----------------------------------------------------------------
+            if not ready:
+                if idle:
+                    return
+                idle = True
+            else:
+                idle = False
+
+            receivers = {self._socket_owner[sock] for sock in ready}
+            for node in sorted(receivers, key=lambda x: x.mac_address):
+                node._enqueue_rx_pipes(ready)
+
+            for node in list(self._active):
+                node._dequeue_tx_pipes()
+                if not node.has_tx_work():
+                    del self._active[node]
+
+    def _next_time(self) -> Optional[float]:
+        """
+        Returns:
+            Clock time of the next scheduled event or ARQ timer, or None if there isn't one
+        """
+        times = [x for x in (node._next_deadline() for node in self._active) if x is not None]
+        next_event = self.scheduler.next_time()
+        if next_event is not None:
+            times.append(next_event)
+        return min(times) if times else None
@@ -0,0 +1,259 @@
+# **********************************************************************************************************************
+#   FileName:
+#       fragmentation.py
+#
+#   Description:
+#       Splits messages of any size across PackedFrames and puts them back together on the
+#       receiving end.
+#
+#   2021 | Brandon Braun | brandonbraun653@gmail.com
+# **********************************************************************************************************************
+
+import time
+
+from typing import Callable, Dict, Hashable, Iterable, Iterator, List, Optional, Union
+from frame_packager import PackedFrame, FrameView
+
+# ---------------------------------------------------------------------
+# Wire rules:
+#   - endpoint selects one of 8 independent message streams
+#   - frameNumber is the fragment index within the message, mod 32
+#   - Every fragment but the last is full. The last one is short, so a
+#     message that is an exact multiple of the fragment size ends with
+#     an empty fragment.
+# ---------------------------------------------------------------------
+FRAGMENT_SIZE = PackedFrame.MAX_FRAME_SIZE - PackedFrame.CONTROL_FIELD_SIZE
+FRAGMENT_INDEX_SPACE = 1 << PackedFrame.FRAME_NUMBER_BITS
+MAX_STREAMS = 1 << PackedFrame.ENDPOINT_BITS
+
+Chunk = Union[bytes, bytearray, memoryview]
+
+
+def _make_fragment(data: Chunk, index: int, endpoint: int, require_ack: bool) -> bytearray:
+    buffer = bytearray(PackedFrame.MAX_FRAME_SIZE)
+    frame = FrameView(buffer)
+    frame.frameNumber = index % FRAGMENT_INDEX_SPACE
+    frame.endpoint = endpoint
+    frame.requireAck = require_ack
+    frame.write_data(data)
+    return buffer
+
+
+def fragment_stream(chunks: Iterable[Chunk], endpoint: int = 0, require_ack: bool = False) -> Iterator[bytearray]:
+    """
+    Lazily splits a message whose size may not be known up front. Only one
+    fragment is held at a time, so chunks can come straight off a file or sensor:
+
+        for data in fragment_stream(iter(lambda: f.read(4096), b'')):
+            radio.transmit(data)
+
+    Args:
+        chunks: Pieces of the message, in order. Any size, including empty.
+        endpoint: Message stream to send on, 0-7
+        require_ack: Whether the radio should ACK each fragment
+
+    Returns:
+        Generator of packed frames, each in its own buffer
+    """
+    assert(0 <= endpoint < MAX_STREAMS)
+    pending = bytearray()
+    index = 0
+
+    for chunk in chunks:
+        view = memoryview(chunk).cast('B')
+        offset = 0
+
+        # Top off whatever is left over from the previous chunk
+        if pending:
+            offset = min(len(view), FRAGMENT_SIZE - len(pending))
+            pending += view[:offset]
+            if len(pending) < FRAGMENT_SIZE:
+                continue
+
+            yield _make_fragment(pending, index, endpoint, require_ack)
+            pending.clear()
+            index += 1
+
+        # Then slice full fragments straight out of the chunk
+        while len(view) - offset >= FRAGMENT_SIZE:
+            yield _make_fragment(view[offset:offset + FRAGMENT_SIZE], index, endpoint, require_ack)
+            offset += FRAGMENT_SIZE
+            index += 1
+
+        pending += view[offset:]
+
+    yield _make_fragment(pending, index, endpoint, require_ack)
+
+
+def fragment(data: Chunk, endpoint: int = 0, require_ack: bool = False) -> Iterator[bytearray]:
+    """
+    Lazily splits a message into packed frames
+
+    Args:
+        data: Message to send
+        endpoint: Message stream to send on, 0-7
+        require_ack: Whether the radio should ACK each fragment
+
+    Returns:
+        Generator of packed frames, each in its own buffer
+    """
+    return fragment_stream((data,), endpoint, require_ack)
+
+
+def fragment_count(size: int) -> int:
+    """
+    Returns:
+        Number of frames a message of the given size is split into
+    """
+    return size // FRAGMENT_SIZE + 1
+
+
+class _Reassembly:
+    __slots__ = ('buffer', 'length', 'next_index', 'last_update', 'overflow')
+
+    def __init__(self, buffer: bytearray, now: float):
+        self.buffer = buffer
+        self.length = 0
+        self.next_index = 0
+        self.last_update = now
+        self.overflow = False
+
+
+class Reassembler:
+    """
+    Rebuilds messages from fragments. Messages from different sources and
+    endpoints may arrive interleaved. Buffers come from a pool allocated up
+    front, and a partial message is dropped once it stops receiving fragments.
+    """
+
+    def __init__(self, max_message_size: int = 4096, max_messages: int = 8, timeout: float = 1.0,
+                 check_sequence: bool = True, clock: Callable[[], float] = time.monotonic):
+        """
+        Args:
+            max_message_size: Largest message that can be reassembled. Bigger ones are dropped.
+            max_messages: Number of messages that may be in progress at once
+            timeout: Seconds without a new fragment before a partial message is dropped
+            check_sequence: Whether to check fragment indices for gaps. Turn this off
+                for fragments sent with require_ack, as the radio's ARQ overwrites
+                frameNumber with its own sequence number and already guarantees
+                in order delivery.
+            clock: Time source, in seconds
+        """
+        self.max_message_size = max_message_size
+        self.timeout = timeout
+        self.check_sequence = check_sequence
+        self.clock = clock
+        self.dropped = 0
+
+        self._free = [bytearray(max_message_size) for _ in range(max_messages)]     # type: List[bytearray]
+        self._active = {}   # type: Dict[Hashable, _Reassembly]
+
+    def __len__(self) -> int:
+        """
+        Returns:
+            Number of messages currently being reassembled
+        """
+        return len(self._active)
+
+    def push(self, frame: Union[PackedFrame, FrameView, Chunk], source: Hashable = 0) -> Optional[bytes]:
+        """
+        Adds a received fragment
+
+        Args:
+            frame: The fragment, either decoded or as a packed frame
+            source: Identifies the sender, such as the pipe the frame arrived on.
+                Each source has its own set of 8 streams.
+
+        Returns:
+            The message once its last fragment arrives, otherwise None
+        """
+        if not isinstance(frame, (PackedFrame, FrameView)):
+            frame = FrameView(frame)
+
+        now = self.clock()
+        key = (source, frame.endpoint)
+        index = frame.frameNumber
+        entry = self._active.get(key)
+
+        # ---------------------------------------------------------------------
+        # A message that stopped receiving fragments was abandoned, maybe by
+        # the ARQ, so it must not run into whatever the source sends next
+        # ---------------------------------------------------------------------
+        if entry is not None and now - entry.last_update > self.timeout:
+            self._release(key)
+            self.dropped += 1
+            entry = None
+
+        # ---------------------------------------------------------------------
+        # A gap means a fragment went missing. Throw the message away, but the
+        # fragment that exposed the gap may well be the start of the next one.
+        # ---------------------------------------------------------------------
+        if entry is not None and self.check_sequence and index != entry.next_index:
+            self._release(key)
+            self.dropped += 1
+            entry = None
+
+        if entry is None:
+            if self.check_sequence and index != 0:
+                # Middle of a message that was already dropped
+                return None
+
+            entry = self._acquire(key, now)
+            if entry is None:
+                self.dropped += 1
+                return None
+
+        # ---------------------------------------------
+        # Append the fragment
+        # ---------------------------------------------
+        data = frame.userData[:frame.dataLength]
+        size = len(data)
+        if entry.length + size > self.max_message_size:
+            # Too big. Keep eating fragments until the end of the message.
+            entry.overflow = True
+        elif not entry.overflow:
+            entry.buffer[entry.length:entry.length + size] = data
+            entry.length += size
+
+        entry.next_index = (entry.next_index + 1) % FRAGMENT_INDEX_SPACE
+        entry.last_update = now
+
+        if size == FRAGMENT_SIZE:
+            return None
+
+        # ---------------------------------------------
+        # Short fragment, so the message is complete
+        # ---------------------------------------------
+        message = None if entry.overflow else bytes(entry.buffer[:entry.length])
+        if message is None:
+            self.dropped += 1
+        self._release(key)
+        return message
+
+    def expire(self) -> int:
+        """
+        Drops every partial message that timed out, returning its buffer to the pool
+
+        Returns:
+            Number of messages dropped
+        """
+        now = self.clock()
+        stale = [key for key, entry in self._active.items() if now - entry.last_update > self.timeout]
+        for key in stale:
+            self._release(key)
+
+        self.dropped += len(stale)
+        return len(stale)
+
+    def _acquire(self, key: Hashable, now: float) -> Optional[_Reassembly]:
+        if not self._free:
+            self.expire()
+        if not self._free:
+            return None
+
+        entry = _Reassembly(self._free.pop(), now)
+        self._active[key] = entry
+        return entry
+
+    def _release(self, key: Hashable) -> None:
+        self._free.append(self._active.pop(key).buffer)
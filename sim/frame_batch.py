@@ -0,0 +1,167 @@
+# **********************************************************************************************************************
+#   FileName:
+#       frame_batch.py
+#
+#   Description:
+#       Vectorized packing and unpacking of many PackedFrames at once using NumPy
+#
+#   2021 | Brandon Braun | brandonbraun653@gmail.com
+# **********************************************************************************************************************
+
+import numpy as np
+
+from typing import Iterable, List, Optional, Union
+from frame_packager import PackedFrame
+
+# ---------------------------------------------
+# Column layout of a batch of unpacked frames.
+# Field names match the PackedFrame attributes.
+# ---------------------------------------------
+USER_DATA_SIZE = PackedFrame.MAX_FRAME_SIZE - PackedFrame.CONTROL_FIELD_SIZE
+
+FRAME_DTYPE = np.dtype([
+    ('version', np.uint8),
+    ('dataLength', np.uint8),
+    ('frameNumber', np.uint8),
+    ('endpoint', np.uint8),
+    ('multicast', np.bool_),
+    ('requireAck', np.bool_),
+    ('userData', np.uint8, (USER_DATA_SIZE,))
+])
+
+
+def new_frames(count: int) -> np.ndarray:
+    """
+    Allocates a zeroed batch of frames
+
+    Args:
+        count: Number of frames in the batch
+
+    Returns:
+        Structured array of FRAME_DTYPE
+    """
+    return np.zeros(count, dtype=FRAME_DTYPE)
+
+
+def as_frame_buffer(data: Union[bytes, bytearray, memoryview, np.ndarray]) -> np.ndarray:
+    """
+    Views contiguous packed frame data as an (N, 32) array without copying it
+
+    Args:
+        data: Back to back packed frames
+
+    Returns:
+        uint8 array of shape (N, PackedFrame.MAX_FRAME_SIZE)
+    """
+    buffer = np.frombuffer(data, dtype=np.uint8) if not isinstance(data, np.ndarray) else data
+    assert(buffer.size % PackedFrame.MAX_FRAME_SIZE == 0)
+    return buffer.reshape(-1, PackedFrame.MAX_FRAME_SIZE)
+
+
+def unpack_frames(data: Union[bytes, bytearray, memoryview, np.ndarray], out: Optional[np.ndarray] = None) -> np.ndarray:
+    """
+    Batch equivalent of PackedFrame.unpack()
+
+    Args:
+        data: Back to back packed frames, or an (N, 32) uint8 array
+        out: Optional preallocated FRAME_DTYPE array of length N to decode into
+
+    Returns:
+        Structured array of FRAME_DTYPE, one entry per frame
+    """
+    buffer = as_frame_buffer(data)
+    frames = new_frames(len(buffer)) if out is None else out
+    assert(len(frames) == len(buffer))
+
+    byte0 = buffer[:, 0]
+    byte1 = buffer[:, 1]
+    byte2 = buffer[:, 2]
+
+    frames['version'] = (byte0 >> PackedFrame.VERSION_LENGTH_OFFSET) & PackedFrame.VERSION_LENGTH_MASK
+    frames['dataLength'] = (byte0 >> PackedFrame.DATA_LENGTH_OFFSET) & PackedFrame.DATA_LENGTH_MASK
+    frames['frameNumber'] = (byte1 >> PackedFrame.FRAME_NUMBER_OFFSET) & PackedFrame.FRAME_NUMBER_MASK
+    frames['endpoint'] = (byte1 >> PackedFrame.ENDPOINT_OFFSET) & PackedFrame.ENDPOINT_MASK
+    frames['multicast'] = (byte2 >> PackedFrame.MULTICAST_LENGTH_OFFSET) & PackedFrame.MULTICAST_LENGTH_MASK
+    frames['requireAck'] = (byte2 >> PackedFrame.REQ_ACK_LENGTH_OFFSET) & PackedFrame.REQ_ACK_LENGTH_MASK
+    frames['userData'] = buffer[:, PackedFrame.CONTROL_FIELD_SIZE:]
+
+    return frames
+
+
+def pack_frames(frames: np.ndarray, out: Optional[np.ndarray] = None) -> np.ndarray:
+    """
+    Batch equivalent of PackedFrame.pack()
+
+    Args:
+        frames: Structured array of FRAME_DTYPE
+        out: Optional preallocated (N, 32) uint8 array to encode into
+
+    Returns:
+        uint8 array of shape (N, PackedFrame.MAX_FRAME_SIZE). Use .tobytes() or
+        index a row to get the data for a single transfer.
+    """
+    if out is None:
+        out = np.empty((len(frames), PackedFrame.MAX_FRAME_SIZE), dtype=np.uint8)
+    assert(out.shape == (len(frames), PackedFrame.MAX_FRAME_SIZE))
+
+    # ---------------------------------------------
+    # Pack the user data
+    # ---------------------------------------------
+    out[:, PackedFrame.CONTROL_FIELD_SIZE:] = frames['userData']
+
+    # ---------------------------------------------
+    # Pack the control field
+    # ---------------------------------------------
+    # Byte 0
+    out[:, 0] = ((frames['version'] & PackedFrame.VERSION_LENGTH_MASK) << PackedFrame.VERSION_LENGTH_OFFSET) | \
+                ((frames['dataLength'] & PackedFrame.DATA_LENGTH_MASK) << PackedFrame.DATA_LENGTH_OFFSET)
+
+    # Byte 1
+    out[:, 1] = ((frames['frameNumber'] & PackedFrame.FRAME_NUMBER_MASK) << PackedFrame.FRAME_NUMBER_OFFSET) | \
+                ((frames['endpoint'] & PackedFrame.ENDPOINT_MASK) << PackedFrame.ENDPOINT_OFFSET)
+
+    # Byte 2
+    multicast = frames['multicast'].astype(np.uint8)
+    require_ack = frames['requireAck'].astype(np.uint8)
+    out[:, 2] = ((multicast & PackedFrame.MULTICAST_LENGTH_MASK) << PackedFrame.MULTICAST_LENGTH_OFFSET) | \
+                ((require_ack & PackedFrame.REQ_ACK_LENGTH_MASK) << PackedFrame.REQ_ACK_LENGTH_OFFSET)
+
+    return out
+
+
+def from_packed_frames(frames: Iterable[PackedFrame]) -> np.ndarray:
+    """
+    Converts scalar PackedFrame objects into a batch
+
+    Args:
+        frames: Frames to convert
+
+    Returns:
+        Structured array of FRAME_DTYPE
+    """
+    frames = list(frames)
+    buffer = bytearray(len(frames) * PackedFrame.MAX_FRAME_SIZE)
+    for idx, frame in enumerate(frames):
+        offset = idx * PackedFrame.MAX_FRAME_SIZE
+        buffer[offset:offset + PackedFrame.MAX_FRAME_SIZE] = frame.pack()
+
+    return unpack_frames(buffer)
+
+
+def to_packed_frames(frames: np.ndarray) -> List[PackedFrame]:
+    """
+    Converts a batch back into scalar PackedFrame objects
+
+    Args:
+        frames: Structured array of FRAME_DTYPE
+
+    Returns:
+        One PackedFrame per batch entry
+    """
+    output = []
+    for row in pack_frames(frames):
+        frame = PackedFrame()
+        frame.unpack(bytearray(row.tobytes()))
+        output.append(frame)
+
+    return output
@@ -9,7 +9,8 @@
 # **********************************************************************************************************************
 
 from abc import ABCMeta, abstractmethod
-from frame_packager import PackedFrame
+from typing import Union
+from frame_packager import PackedFrame, FrameView
 
 
 class BaseFrame(metaclass=ABCMeta):
@@ -56,6 +57,6 @@ class BaseFrame(metaclass=ABCMeta):
 
 class RxFifoEntry(metaclass=ABCMeta):
 
-    def __init__(self, pipe: int, frame: PackedFrame):
+    def __init__(self, pipe: int, frame: Union[PackedFrame, FrameView]):
         self.pipe = pipe
         self.payload = frame
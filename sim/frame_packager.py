@@ -89,7 +89,7 @@ class PackedFrame:
         Returns:
             User data
         """
-        assert(self.dataLength < len(self.userData))
+        assert(self.dataLength <= len(self.userData))
         return self.userData[:self.dataLength]
 
     def pack(self) -> bytearray:
@@ -150,3 +150,135 @@ class PackedFrame:
         self.requireAck = int((data[2] >> self.REQ_ACK_LENGTH_OFFSET) & self.REQ_ACK_LENGTH_MASK)
 
 
+class FrameView:
+    """
+    Zero-copy alternative to PackedFrame that operates directly on a packed 32 byte
+    buffer. Control fields are decoded when read and encoded in place when written,
+    so a frame can travel from a socket to its consumer without ever being copied.
+    Writing requires the wrapped buffer to be mutable.
+    """
+    __slots__ = ('_buffer',)
+
+    def __init__(self, data: Union[bytearray, bytes, memoryview, None] = None):
+        """
+        Args:
+            data: Packed frame to wrap. A zeroed frame is allocated if not given.
+        """
+        self.unpack(bytearray(PackedFrame.MAX_FRAME_SIZE) if data is None else data)
+
+    def _get_bits(self, byte: int, offset: int, mask: int) -> int:
+        return (self._buffer[byte] >> offset) & mask
+
+    def _set_bits(self, byte: int, offset: int, mask: int, value: int) -> None:
+        self._buffer[byte] = (self._buffer[byte] & ~(mask << offset)) | ((int(value) & mask) << offset)
+
+    @property
+    def version(self) -> int:
+        return self._get_bits(0, PackedFrame.VERSION_LENGTH_OFFSET, PackedFrame.VERSION_LENGTH_MASK)
+
+    @version.setter
+    def version(self, value: int) -> None:
+        self._set_bits(0, PackedFrame.VERSION_LENGTH_OFFSET, PackedFrame.VERSION_LENGTH_MASK, value)
+
+    @property
+    def dataLength(self) -> int:
+        return self._get_bits(0, PackedFrame.DATA_LENGTH_OFFSET, PackedFrame.DATA_LENGTH_MASK)
+
+    @dataLength.setter
+    def dataLength(self, value: int) -> None:
+        self._set_bits(0, PackedFrame.DATA_LENGTH_OFFSET, PackedFrame.DATA_LENGTH_MASK, value)
+
+    @property
+    def frameNumber(self) -> int:
+        return self._get_bits(1, PackedFrame.FRAME_NUMBER_OFFSET, PackedFrame.FRAME_NUMBER_MASK)
+
+    @frameNumber.setter
+    def frameNumber(self, value: int) -> None:
+        self._set_bits(1, PackedFrame.FRAME_NUMBER_OFFSET, PackedFrame.FRAME_NUMBER_MASK, value)
+
+    @property
+    def endpoint(self) -> int:
+        return self._get_bits(1, PackedFrame.ENDPOINT_OFFSET, PackedFrame.ENDPOINT_MASK)
+
+    @endpoint.setter
+    def endpoint(self, value: int) -> None:
+        self._set_bits(1, PackedFrame.ENDPOINT_OFFSET, PackedFrame.ENDPOINT_MASK, value)
+
+    @property
+    def multicast(self) -> int:
+        return self._get_bits(2, PackedFrame.MULTICAST_LENGTH_OFFSET, PackedFrame.MULTICAST_LENGTH_MASK)
+
+    @multicast.setter
+    def multicast(self, value: bool) -> None:
+        self._set_bits(2, PackedFrame.MULTICAST_LENGTH_OFFSET, PackedFrame.MULTICAST_LENGTH_MASK, value)
+
+    @property
+    def requireAck(self) -> int:
+        return self._get_bits(2, PackedFrame.REQ_ACK_LENGTH_OFFSET, PackedFrame.REQ_ACK_LENGTH_MASK)
+
+    @requireAck.setter
+    def requireAck(self, value: bool) -> None:
+        self._set_bits(2, PackedFrame.REQ_ACK_LENGTH_OFFSET, PackedFrame.REQ_ACK_LENGTH_MASK, value)
+
+    @property
+    def userData(self) -> memoryview:
+        return self._buffer[PackedFrame.CONTROL_FIELD_SIZE:]
+
+    def write_data(self, data: Union[bytearray, bytes, memoryview]) -> None:
+        """
+        Copies byte level data into the user data section of the wrapped buffer
+        Args:
+            data: Data to be placed
+
+        Returns:
+            None
+        """
+        size = len(data)
+        assert(size <= PackedFrame.MAX_FRAME_SIZE - PackedFrame.CONTROL_FIELD_SIZE)
+        self._buffer[PackedFrame.CONTROL_FIELD_SIZE:PackedFrame.CONTROL_FIELD_SIZE + size] = data
+        self.dataLength = size
+
+    def read_data(self) -> memoryview:
+        """
+        Reads the packed user data out to the caller without copying it
+
+        Returns:
+            View of the user data
+        """
+        size = self.dataLength
+        assert(size <= PackedFrame.MAX_FRAME_SIZE - PackedFrame.CONTROL_FIELD_SIZE)
+        return self._buffer[PackedFrame.CONTROL_FIELD_SIZE:PackedFrame.CONTROL_FIELD_SIZE + size]
+
+    def pack(self) -> memoryview:
+        """
+        The frame is always stored packed, so this simply exposes the wrapped buffer
+
+        Returns:
+            View of the 32 byte packed frame
+        """
+        return self._buffer
+
+    def unpack(self, data: Union[bytearray, bytes, memoryview]) -> None:
+        """
+        Points the view at a new packed frame. No data is copied or decoded.
+
+        Returns:
+            None
+        """
+        view = data if isinstance(data, memoryview) else memoryview(data)
+        if view.format != 'B' or view.ndim != 1:
+            view = view.cast('B')
+
+        assert(len(view) == PackedFrame.MAX_FRAME_SIZE)
+        self._buffer = view
+
+    def to_packed_frame(self) -> PackedFrame:
+        """
+        Copies the view out into an independent PackedFrame
+
+        Returns:
+            PackedFrame
+        """
+        frame = PackedFrame()
+        frame.unpack(bytearray(self._buffer))
+        return frame
@@ -0,0 +1,143 @@
+# **********************************************************************************************************************
+#   FileName:
+#       hw_fifo.py
+#
+#   Description:
+#       In-process bounded FIFO that models the TX/RX FIFOs of the NRF24L01
+#
+#   2021 | Brandon Braun | brandonbraun653@gmail.com
+# **********************************************************************************************************************
+
+from collections import deque
+from enum import Enum
+from queue import Empty, Full
+from threading import Lock, Condition
+from typing import Any, Callable, Optional
+
+
+class OverflowPolicy(Enum):
+    """ What a FIFO does when an item is pushed while it is full """
+    BLOCK = 0           # Wait for space to become available
+    DROP_NEWEST = 1     # Discard the incoming item, like the NRF24 RX FIFO does
+    DROP_OLDEST = 2     # Discard the item at the head of the FIFO to make room
+    ERROR = 3           # Raise queue.Full immediately
+
+
+class HardwareFifo:
+    """
+    Thread safe, fixed depth FIFO for sharing frames between threads of a single
+    process. Items are stored by reference, so nothing is ever serialized.
+    """
+    NRF24_FIFO_DEPTH = 3  # Entries available in each of the NRF24L01 TX and RX FIFOs
+
+    def __init__(self, depth: int = NRF24_FIFO_DEPTH, policy: OverflowPolicy = OverflowPolicy.BLOCK,
+                 on_put: Optional[Callable[[], None]] = None):
+        """
+        Args:
+            depth: Max number of entries the FIFO can hold
+            policy: Behavior when pushing into a full FIFO
+            on_put: Optional callback invoked (outside the lock) after each successful push
+        """
+        assert(depth > 0)
+        self.depth = depth
+        self.policy = policy
+        self.dropped = 0
+
+        self._on_put = on_put
+        self._items = deque()
+        self._wake_count = 0
+        self._lock = Lock()
+        self._not_empty = Condition(self._lock)
+        self._not_full = Condition(self._lock)
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def empty(self) -> bool:
+        return not self._items
+
+    def full(self) -> bool:
+        return len(self._items) >= self.depth
+
+    def put(self, item: Any, block: bool = True, timeout: Optional[float] = None) -> bool:
+        """
+        Pushes an item onto the tail of the FIFO, applying the overflow policy if full.
+
+        Args:
+            item: Item to push
+            block: For the BLOCK policy, whether to wait for space to become available
+            timeout: For the BLOCK policy, max seconds to wait. None waits forever.
+
+        Raises:
+            queue.Full: ERROR policy and the FIFO is full, or the BLOCK policy ran out of time
+
+        Returns:
+            True if the item was stored, False if it was dropped
+        """
+        with self._lock:
+            if len(self._items) >= self.depth:
+                if self.policy == OverflowPolicy.DROP_NEWEST:
+                    self.dropped += 1
+                    return False
+                elif self.policy == OverflowPolicy.DROP_OLDEST:
+                    self._items.popleft()
+                    self.dropped += 1
+                elif self.policy == OverflowPolicy.ERROR or not block:
+                    raise Full
+                elif not self._not_full.wait_for(lambda: len(self._items) < self.depth, timeout):
+                    raise Full
+
+            self._items.append(item)
+            self._not_empty.notify()
+
+        if self._on_put:
+            self._on_put()
+
+        return True
+
+    def get(self, block: bool = True, timeout: Optional[float] = None) -> Any:
+        """
+        Pops the item at the head of the FIFO
+
+        Args:
+            block: Whether to wait for an item to become available
+            timeout: Max seconds to wait. None waits forever.
+
+        Raises:
+            queue.Empty: Nothing was available in time, or the wait was cut short by wake()
+
+        Returns:
+            The oldest item in the FIFO
+        """
+        with self._lock:
+            if not self._items and block:
+                wake_count = self._wake_count
+                self._not_empty.wait_for(lambda: self._items or self._wake_count != wake_count, timeout)
+
+            if not self._items:
+                raise Empty
+
+            item = self._items.popleft()
+            self._not_full.notify()
+            return item
+
+    def clear(self) -> None:
+        """
+        Discards everything currently held in the FIFO, like a FLUSH_TX/FLUSH_RX command
+        Returns:
+            None
+        """
+        with self._lock:
+            self._items.clear()
+            self._not_full.notify_all()
+
+    def wake(self) -> None:
+        """
+        Releases every reader currently blocked in get(). Those readers raise
+        queue.Empty if the FIFO is still empty once they wake up.
+        Returns:
+            None
+        """
+        with self._lock:
+            self._wake_count += 1
+            self._not_empty.notify_all()
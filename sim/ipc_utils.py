@@ -9,6 +9,7 @@
 # **********************************************************************************************************************
 
 from pathlib import Path
+from typing import Dict, Tuple
 
 # ---------------------------------------------
 # Address modifiers for pipes. Must match code.
@@ -23,29 +24,144 @@ EndpointAddressModifiers = (
 )
 
 
-def _gen_ipc_path(path, base_mac, pipe) -> Path:
+# ---------------------------------------------
+# Transports a pipe may be bound to
+# ---------------------------------------------
+TRANSPORT_IPC = "ipc"        # Unix domain sockets, usable across processes
+TRANSPORT_INPROC = "inproc"  # In-memory, limited to sockets sharing a zmq.Context
+
+
+# ---------------------------------------------
+# Where the IPC socket files live
+# ---------------------------------------------
+IPC_ROOT = Path("/tmp/ripple_ipc")
+IPC_RX_DIR = IPC_ROOT / "rx"
+IPC_TX_DIR = IPC_ROOT / "tx"
+IPC_MCAST_DIR = IPC_ROOT / "mcast"
+
+PIPE_COUNT = len(EndpointAddressModifiers)
+NRF24_ADDRESS_WIDTH = 5     # Bytes
+NRF24_ADDRESS_ENDIAN = 'little'
+
+_ipc_dirs_ready = False
+
+
+def _ensure_ipc_dirs() -> None:
+    global _ipc_dirs_ready
+    if not _ipc_dirs_ready:
+        IPC_RX_DIR.mkdir(parents=True, exist_ok=True)
+        IPC_TX_DIR.mkdir(parents=True, exist_ok=True)
+        IPC_MCAST_DIR.mkdir(parents=True, exist_ok=True)
+        _ipc_dirs_ready = True
+
+
+def pipe_address(base_mac, pipe) -> int:
+    """
+    Applies the NRF24 address modifier of a pipe to a root MAC address
+    """
     if pipe == 0:
-        ipc_path = Path(path, str(int(base_mac)) + ".ipc")
-    else:
-        masked_mac = (base_mac & ~0xFF) | EndpointAddressModifiers[pipe]
-        ipc_path = Path(path, str(int(masked_mac)) + ".ipc")
+        return int(base_mac)
+    return int((base_mac & ~0xFF) | EndpointAddressModifiers[pipe])
+
+
+class NodeAddresses:
+    """
+    Every address of one node's pipes, worked out once. Indexed by pipe number.
+    """
+    __slots__ = ('mac', 'pipe_addresses', 'address_bytes', '_rx_urls', '_tx_urls', '_mcast_urls')
+
+    def __init__(self, mac: int):
+        """
+        Args:
+            mac: Root MAC address of the node
+        """
+        self.mac = int(mac)
+        self.pipe_addresses = tuple(pipe_address(mac, pipe) for pipe in range(PIPE_COUNT))
+
+        # Addresses as written into the RX_ADDR_Px registers of the radio
+        self.address_bytes = tuple(x.to_bytes(NRF24_ADDRESS_WIDTH, NRF24_ADDRESS_ENDIAN) for x in self.pipe_addresses)
 
-    return ipc_path
+        self._rx_urls = {
+            TRANSPORT_IPC: tuple("ipc://{}/{}.ipc".format(IPC_RX_DIR, x) for x in self.pipe_addresses),
+            TRANSPORT_INPROC: tuple("inproc://ripple/rx/{}".format(x) for x in self.pipe_addresses),
+        }   # type: Dict[str, Tuple[str, ...]]
+        self._tx_urls = {
+            TRANSPORT_IPC: tuple("ipc://{}/{}.ipc".format(IPC_TX_DIR, x) for x in self.pipe_addresses),
+            TRANSPORT_INPROC: tuple("inproc://ripple/tx/{}".format(x) for x in self.pipe_addresses),
+        }   # type: Dict[str, Tuple[str, ...]]
+        self._mcast_urls = {
+            TRANSPORT_IPC: "ipc://{}/{}.ipc".format(IPC_MCAST_DIR, self.mac),
+            TRANSPORT_INPROC: "inproc://ripple/mcast/{}".format(self.mac),
+        }   # type: Dict[str, str]
+
+    def rx_url(self, pipe: int, transport: str = TRANSPORT_IPC) -> str:
+        """
+        Returns:
+            ZMQ URL the RX pipe binds to
+        """
+        return self._rx_urls[transport][pipe]
+
+    def tx_url(self, pipe: int, transport: str = TRANSPORT_IPC) -> str:
+        """
+        Returns:
+            ZMQ URL the TX side of the pipe binds to for replies
+        """
+        return self._tx_urls[transport][pipe]
+
+    def mcast_url(self, transport: str = TRANSPORT_IPC) -> str:
+        """
+        Returns:
+            ZMQ URL the node listens for multicast frames on
+        """
+        return self._mcast_urls[transport]
+
+
+_address_table = {}     # type: Dict[int, NodeAddresses]
+
+
+def resolve(mac: int) -> NodeAddresses:
+    """
+    Looks up the addresses of a node, building them the first time the node is seen
+
+    Args:
+        mac: Root MAC address of the node
+
+    Returns:
+        The node's addresses
+    """
+    addresses = _address_table.get(mac)
+    if addresses is None:
+        _ensure_ipc_dirs()
+        addresses = NodeAddresses(mac)
+        _address_table[mac] = addresses
+    return addresses
 
 
 def gen_ipc_path(base_mac, pipe) -> Path:
     """
     Builds a path that should represent some RX pipe
     """
-    base_path = Path("/tmp/ripple_ipc/rx")
-    base_path.mkdir(exist_ok=True)
-    return _gen_ipc_path(base_path, base_mac, pipe)
+    _ensure_ipc_dirs()
+    return Path(IPC_RX_DIR, str(pipe_address(base_mac, pipe)) + ".ipc")
 
 
 def gen_ipc_path_for_tx_pipe(base_mac, pipe) -> Path:
     """
     Builds a path that should represent some TX pipe
     """
-    base_path = Path("/tmp/ripple_ipc/tx")
-    base_path.mkdir(exist_ok=True)
-    return _gen_ipc_path(base_path, base_mac, pipe)
+    _ensure_ipc_dirs()
+    return Path(IPC_TX_DIR, str(pipe_address(base_mac, pipe)) + ".ipc")
+
+
+def gen_url(base_mac, pipe, transport=TRANSPORT_IPC) -> str:
+    """
+    Looks up the ZMQ URL of some RX pipe
+    """
+    return resolve(base_mac).rx_url(pipe, transport)
+
+
+def gen_url_for_tx_pipe(base_mac, pipe, transport=TRANSPORT_IPC) -> str:
+    """
+    Looks up the ZMQ URL of some TX pipe
+    """
+    return resolve(base_mac).tx_url(pipe, transport)
@@ -0,0 +1,150 @@
+# **********************************************************************************************************************
+#   FileName:
+#       medium.py
+#
+#   Description:
+#       Shared RF medium for simulated radios. Tracks every transmission on each RF channel and
+#       marks those that overlap in time as collided, which the receivers then never see.
+#
+#   2021 | Brandon Braun | brandonbraun653@gmail.com
+# **********************************************************************************************************************
+
+import time
+
+from threading import Lock
+from typing import Callable, Dict, List, NamedTuple
+
+
+class ChannelLoad(NamedTuple):
+    """ Traffic seen on one RF channel """
+    rf_channel: int
+    transmissions: int      # Packets put on the air, ACKs included
+    collisions: int         # Packets that overlapped with another one
+    busy_time: float        # Seconds at least one packet was on the air
+    elapsed: float          # Seconds the medium has been observed for
+
+    @property
+    def collision_rate(self) -> float:
+        """ Fraction of packets lost to collisions """
+        return self.collisions / self.transmissions if self.transmissions else 0.0
+
+    @property
+    def utilization(self) -> float:
+        """ Fraction of the time the channel was busy """
+        return self.busy_time / self.elapsed if self.elapsed else 0.0
+
+
+class Transmission:
+    """
+    A packet on the air. Once the clock passes its end, collided is final.
+    """
+    __slots__ = ('sender', 'start', 'end', 'collided')
+
+    def __init__(self, sender: int, start: float, end: float):
+        self.sender = sender
+        self.start = start
+        self.end = end
+        self.collided = False
+
+
+class _ChannelState:
+    __slots__ = ('on_air', 'transmissions', 'collisions', 'busy_time', 'busy_until')
+
+    def __init__(self):
+        self.on_air = []            # type: List[Transmission]
+        self.transmissions = 0
+        self.collisions = 0
+        self.busy_time = 0.0
+        self.busy_until = float('-inf')
+
+
+class SharedMedium:
+    """
+    Every radio that shares a SharedMedium hears every other radio on the same
+    RF channel. Any two packets that overlap in time corrupt each other, with
+    no capture effect, so neither gets through and the ARQ has to recover.
+    Radios that retry on the same period can lock step and keep colliding, as
+    NRF24s sharing an ARD do, so give each its own ARD or retransmit_timeout.
+
+    Packets must be reported before the clock reaches their start time. The
+    radios do so as they begin to settle into TX, which is exact under the
+    discrete event simulator and close to it for radios pumped in real time.
+    """
+
+    def __init__(self, clock: Callable[[], float] = time.monotonic):
+        """
+        Args:
+            clock: Time source shared with the radios, in seconds
+        """
+        self.clock = clock
+        self._start_time = clock()
+        self._channels = {}     # type: Dict[int, _ChannelState]
+        self._lock = Lock()
+
+    def transmit(self, rf_channel: int, sender: int, start: float, end: float) -> Transmission:
+        """
+        Puts a packet on the air
+
+        Args:
+            rf_channel: RF channel the packet is sent on
+            sender: MAC address of the transmitting device
+            start: Clock time the first bit goes out
+            end: Clock time the last bit goes out
+
+        Returns:
+            The transmission, which tells whether the packet collided
+        """
+        packet = Transmission(sender, start, end)
+        with self._lock:
+            state = self._channels.get(rf_channel)
+            if state is None:
+                state = _ChannelState()
+                self._channels[rf_channel] = state
+
+            # Packets that are already over can't collide with anything new
+            now = self.clock()
+            state.on_air = [x for x in state.on_air if x.end > now]
+            for other in state.on_air:
+                if other.start < end and start < other.end:
+                    if not other.collided:
+                        other.collided = True
+                        state.collisions += 1
+                    if not packet.collided:
+                        packet.collided = True
+                        state.collisions += 1
+
+            state.on_air.append(packet)
+            state.transmissions += 1
+            state.busy_time += max(0.0, end - max(start, state.busy_until))
+            state.busy_until = max(state.busy_until, end)
+
+        return packet
+
+    def report(self) -> List[ChannelLoad]:
+        """
+        Returns:
+            Load on every RF channel that has carried traffic, in channel order
+        """
+        elapsed = self.clock() - self._start_time
+        with self._lock:
+            return [ChannelLoad(rf_channel, x.transmissions, x.collisions, x.busy_time, elapsed)
+                    for rf_channel, x in sorted(self._channels.items())]
+
+
+def format_loads(loads: List[ChannelLoad]) -> str:
+    """
+    Renders channel loads as a table, flagging channels that are close to saturating
+
+    Args:
+        loads: Output of SharedMedium.report()
+
+    Returns:
+        Printable table
+    """
+    lines = ["channel  packets  collisions   rate   util   busy_s"]
+    for x in loads:
+        hot = " <- saturated" if x.utilization > 0.5 or x.collision_rate > 0.25 else ""
+        lines.append("{:7d}  {:7d}  {:10d}  {:5.3f}  {:5.3f}  {:7.3f}{}".format(
+            x.rf_channel, x.transmissions, x.collisions, x.collision_rate, x.utilization, x.busy_time, hot))
+
+    return "\n".join(lines)
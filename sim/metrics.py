@@ -0,0 +1,253 @@
+# **********************************************************************************************************************
+#   FileName:
+#       metrics.py
+#
+#   Description:
+#       Counters and latency histograms kept by the virtual radios. Updating them is a handful of
+#       list increments, and they can be read at any time from another thread without locking.
+#
+#   2021 | Brandon Braun | brandonbraun653@gmail.com
+# **********************************************************************************************************************
+
+from typing import List, NamedTuple, Optional
+
+
+class HistogramSnapshot(NamedTuple):
+    """ Copy of a LatencyHistogram taken at some point in time """
+    counts: List[int]   # Samples in each bucket
+    sub_bits: int       # Buckets per power of two are 1 << sub_bits
+    unit: float         # Seconds per histogram tick
+    total: int          # Sum of every sample, in ticks
+
+    @property
+    def count(self) -> int:
+        """ Number of samples """
+        return sum(self.counts)
+
+    @property
+    def mean(self) -> float:
+        """ Average sample, in seconds """
+        count = self.count
+        return self.total * self.unit / count if count else 0.0
+
+    @property
+    def max(self) -> float:
+        """ Largest sample, to within the bucket resolution, in seconds """
+        for idx in range(len(self.counts) - 1, -1, -1):
+            if self.counts[idx]:
+                return _bucket_high(idx, self.sub_bits) * self.unit
+        return 0.0
+
+    def percentile(self, percent: float) -> float:
+        """
+        Args:
+            percent: Percentile to look up, 0 to 100
+
+        Returns:
+            Value that the given percent of samples are at or below, to within the
+            bucket resolution, in seconds. Zero if there are no samples.
+        """
+        assert(0.0 <= percent <= 100.0)
+        count = self.count
+        if not count:
+            return 0.0
+
+        target = max(1, int(count * percent / 100.0 + 0.5))
+        seen = 0
+        for idx, bucket in enumerate(self.counts):
+            seen += bucket
+            if seen >= target:
+                return _bucket_high(idx, self.sub_bits) * self.unit
+        return self.max
+
+
+def _bucket_high(index: int, sub_bits: int) -> int:
+    """
+    Returns:
+        Largest value, in ticks, that falls into a bucket
+    """
+    sub_count = 1 << sub_bits
+    if index < 2 * sub_count:
+        return index
+
+    exponent = index // sub_count - 1
+    mantissa = index % sub_count + sub_count
+    return ((mantissa + 1) << exponent) - 1
+
+
+class LatencyHistogram:
+    """
+    Log-linear histogram in the style of HdrHistogram. Values up to twice the
+    bucket count per power of two are stored exactly, and beyond that each
+    power of two is split into equal buckets, so the error on any value is
+    under 1 / (1 << sub_bits). Values past the top bucket are clamped into it.
+    """
+
+    def __init__(self, unit: float = 1e-6, sub_bits: int = 5, max_value: float = 100.0):
+        """
+        Args:
+            unit: Seconds per tick, the finest resolution recorded
+            sub_bits: Buckets per power of two, as a power of two. 5 keeps the error under 3%.
+            max_value: Largest value tracked, in seconds
+        """
+        assert(unit > 0 and sub_bits > 0)
+        self.unit = unit
+        self.sub_bits = sub_bits
+        self._scale = 1.0 / unit
+        self._exact = 2 << sub_bits     # Values below this get a bucket each
+        self._shift = sub_bits + 1
+        self._max_ticks = max(1, int(max_value / unit))
+        self._counts = [0] * (self._index(self._max_ticks) + 1)
+        self._total = 0
+
+    def record(self, seconds: float) -> None:
+        """
+        Adds a sample
+
+        Args:
+            seconds: Latency to record
+
+        Returns:
+            None
+        """
+        ticks = int(seconds * self._scale)
+        if ticks < self._exact:
+            if ticks < 0:
+                ticks = 0
+            self._counts[ticks] += 1
+        else:
+            if ticks > self._max_ticks:
+                ticks = self._max_ticks
+            exponent = ticks.bit_length() - self._shift
+            self._counts[(exponent << self.sub_bits) + (ticks >> exponent)] += 1
+        self._total += ticks
+
+    def snapshot(self) -> HistogramSnapshot:
+        """
+        Copies the histogram. Safe to call while another thread records into it,
+        though samples recorded during the copy may or may not make it in.
+        Returns:
+            HistogramSnapshot
+        """
+        return HistogramSnapshot(list(self._counts), self.sub_bits, self.unit, self._total)
+
+    def reset(self) -> None:
+        """
+        Clears every sample
+        Returns:
+            None
+        """
+        self._counts[:] = [0] * len(self._counts)
+        self._total = 0
+
+    def _index(self, ticks: int) -> int:
+        if ticks < self._exact:
+            return ticks
+
+        exponent = ticks.bit_length() - self._shift
+        return (exponent << self.sub_bits) + (ticks >> exponent)
+
+
+class PipeStats(NamedTuple):
+    """ Traffic through one pipe of a radio """
+    pipe: int
+    tx_frames: int          # User frames sent to this pipe on other devices, retransmissions included
+    tx_bytes: int
+    retransmits: int        # Frames resent after their ACK timed out
+    acks_received: int      # Frames acknowledged by the receiver
+    ack_timeouts: int       # Frames that ran out of retries without an ACK
+    rx_frames: int          # User frames received on this pipe and stored in the RX FIFO
+    rx_bytes: int
+    rx_dropped: int         # Frames refused or dropped for lack of room, or outside the ARQ window
+    acks_sent: int
+
+    @property
+    def ack_success_rate(self) -> float:
+        """ Fraction of frames needing an ACK that got one, of those that have finished """
+        done = self.acks_received + self.ack_timeouts
+        return self.acks_received / done if done else 1.0
+
+
+class RadioStats(NamedTuple):
+    """ Snapshot of a radio's counters and histograms """
+    mac: int
+    pipes: List[PipeStats]
+    tx_fifo_depth: Optional[int]    # Frames waiting in the TX FIFO, None if unknown
+    rx_fifo_depth: Optional[int]    # Frames waiting for the user in the RX FIFO, None if unknown
+    rtt: HistogramSnapshot          # From first transmission of a frame to its ACK, retries included
+    tx_queue: HistogramSnapshot     # Time frames waited in the TX FIFO
+    pump: HistogramSnapshot         # Time the pump spent servicing the pipes on each pass
+
+    def totals(self) -> PipeStats:
+        """
+        Returns:
+            Counters summed over every pipe, with a pipe of -1
+        """
+        summed = [sum(column) for column in zip(*(x[1:] for x in self.pipes))]
+        return PipeStats(-1, *summed)
+
+
+# Counter rows of RadioMetrics, in PipeStats field order
+(TX_FRAMES, TX_BYTES, RETRANSMITS, ACKS_RECEIVED, ACK_TIMEOUTS,
+ RX_FRAMES, RX_BYTES, RX_DROPPED, ACKS_SENT) = range(9)
+NUM_COUNTERS = 9
+
+
+class RadioMetrics:
+    """
+    Everything a radio measures about itself. Counters are plain lists indexed
+    by pipe, so only the pump thread ever writes them and readers just copy.
+    """
+
+    def __init__(self, num_pipes: int):
+        """
+        Args:
+            num_pipes: Number of pipes the radio has
+        """
+        self.num_pipes = num_pipes
+        self.counters = [[0] * num_pipes for _ in range(NUM_COUNTERS)]
+        self.rtt = LatencyHistogram()
+        self.tx_queue = LatencyHistogram()
+        self.pump = LatencyHistogram()
+
+        # Rows pulled out for the hot path
+        self.tx_frames = self.counters[TX_FRAMES]
+        self.tx_bytes = self.counters[TX_BYTES]
+        self.retransmits = self.counters[RETRANSMITS]
+        self.acks_received = self.counters[ACKS_RECEIVED]
+        self.ack_timeouts = self.counters[ACK_TIMEOUTS]
+        self.rx_frames = self.counters[RX_FRAMES]
+        self.rx_bytes = self.counters[RX_BYTES]
+        self.rx_dropped = self.counters[RX_DROPPED]
+        self.acks_sent = self.counters[ACKS_SENT]
+
+    def snapshot(self, mac: int, tx_fifo_depth: Optional[int], rx_fifo_depth: Optional[int]) -> RadioStats:
+        """
+        Copies the metrics without stopping the pump. Each counter is read once,
+        so totals are exact for any single counter but related ones may be a
+        frame apart.
+
+        Args:
+            mac: Address of the radio
+            tx_fifo_depth: Current depth of the TX FIFO
+            rx_fifo_depth: Current depth of the RX FIFO
+
+        Returns:
+            RadioStats
+        """
+        rows = [list(row) for row in self.counters]
+        pipes = [PipeStats(pipe, *(row[pipe] for row in rows)) for pipe in range(self.num_pipes)]
+        return RadioStats(mac, pipes, tx_fifo_depth, rx_fifo_depth, self.rtt.snapshot(), self.tx_queue.snapshot(),
+                          self.pump.snapshot())
+
+    def reset(self) -> None:
+        """
+        Zeroes every counter and histogram
+        Returns:
+            None
+        """
+        for row in self.counters:
+            row[:] = [0] * self.num_pipes
+        self.rtt.reset()
+        self.tx_queue.reset()
+        self.pump.reset()
@@ -8,22 +8,28 @@
 #   2/28/21 | Brandon Braun | brandonbraun653@gmail.com
 # **********************************************************************************************************************
 
-from frame_packager import PackedFrame
+from frame_packager import FrameView
 from frame_interface import BaseFrame
 
 
 class ACKFrame(BaseFrame):
-    """ A ShockBurst ACK frame """
+    """
+    A ShockBurst ACK frame. The sequence number being acknowledged is carried in
+    the frameNumber field, the pipe it arrived on in the endpoint field and the
+    MAC of the node being acknowledged follows the magic value in the user data.
+    """
     _ENDIAN = 'little'
     _DATA_SIZE = 4
     _DATA_VALUE = 0xAABBCCDD
     _DATA_BYTES = _DATA_VALUE.to_bytes(_DATA_SIZE, _ENDIAN)
+    _MAC_SIZE = 5
 
     def __init__(self):
-        self._frame = PackedFrame()
+        self._frame = FrameView()
         self._frame.write_data(self._DATA_BYTES)
 
     def from_bytes(self, data: bytearray) -> None:
+        # Wraps the data in place rather than copying it
         self._frame.unpack(data)
 
     def to_bytes(self) -> bytearray:
@@ -32,6 +38,32 @@ class ACKFrame(BaseFrame):
     def reset(self) -> None:
         self.__init__()
 
+    @property
+    def sequence(self) -> int:
+        return self._frame.frameNumber
+
+    @sequence.setter
+    def sequence(self, value: int) -> None:
+        self._frame.frameNumber = value
+
+    @property
+    def pipe(self) -> int:
+        """ RX pipe the acknowledged frame arrived on, carried in the endpoint field """
+        return self._frame.endpoint
+
+    @pipe.setter
+    def pipe(self, value: int) -> None:
+        self._frame.endpoint = value
+
+    @property
+    def destination(self) -> int:
+        data_bytes = self._frame.userData[self._DATA_SIZE:self._DATA_SIZE + self._MAC_SIZE]
+        return int.from_bytes(data_bytes, self._ENDIAN)
+
+    @destination.setter
+    def destination(self, mac: int) -> None:
+        self._frame.write_data(self._DATA_BYTES + mac.to_bytes(self._MAC_SIZE, self._ENDIAN))
+
     def is_valid(self) -> bool:
         data_bytes = self._frame.userData[:self._DATA_SIZE]
         stored_value = int.from_bytes(data_bytes, self._ENDIAN)
@@ -0,0 +1,331 @@
+# **********************************************************************************************************************
+#   FileName:
+#       network_sim.py
+#
+#   Description:
+#       Hosts many virtual ShockBurst radios inside a single process. All nodes share one ZMQ
+#       context and talk over inproc:// pipes, with a single thread pumping every node.
+#
+#   2021 | Brandon Braun | brandonbraun653@gmail.com
+# **********************************************************************************************************************
+
+import time
+import zmq
+
+from threading import Thread, Lock, Event
+from typing import Callable, Dict, List, Tuple
+from ipc_utils import TRANSPORT_INPROC
+from virtual_shockburst import BufferedShockBurstRadio
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+
+class SimulatedRadio(BufferedShockBurstRadio):
+    """
+    Radio node hosted by a NetworkSimulator. It has the same transmit() and
+    receive() interface as ShockBurstRadio, but no thread of its own.
+    """
+
+    def __init__(self, simulator: 'NetworkSimulator', **kwargs):
+        """
+        Args:
+            simulator: Simulator that owns and pumps this node
+            kwargs: FIFO and ARQ settings forwarded to BufferedShockBurstRadio
+        """
+        super().__init__(simulator.context, transport=simulator.transport, verbose=False, clock=simulator.clock,
+                         **kwargs)
+        self._simulator = simulator
+
+    def close(self) -> None:
+        """
+        Closes all of the node's pipes
+        Returns:
+            None
+        """
+        self._close_pipes()
+
+    def _on_tx_queued(self) -> None:
+        self._simulator.notify_tx(self)
+
+
+class NetworkSimulator(Thread):
+    """
+    Single threaded host for hundreds or thousands of SimulatedRadio nodes. Nodes
+    use the same MAC and pipe addressing as standalone radios, only the transport
+    differs. Everything that touches node sockets runs on the simulator thread,
+    so topology changes made while it is running are queued up for it.
+    """
+    MAX_SOCKETS = 65536
+
+    def __init__(self, transport: str = TRANSPORT_INPROC, context: zmq.Context = None):
+        """
+        Args:
+            transport: ZMQ transport used for the node pipes
+            context: Context shared by every node. A new one is made if not given.
+        """
+        super().__init__()
+        self.transport = transport
+        self.clock = time.monotonic
+
+        # ---------------------------------------------------------------------
+        # Each node owns 14 sockets and every socket holds a file descriptor
+        # for its mailbox, so lift the limits that would stop us at a few
+        # dozen nodes. Must happen before the context makes any sockets.
+        # ---------------------------------------------------------------------
+        self._raise_fd_limit()
+        self.context = context if context is not None else zmq.Context()
+        self.context.set(zmq.MAX_SOCKETS, self.MAX_SOCKETS)
+
+        self._nodes = {}            # type: Dict[int, SimulatedRadio]
+        self._poller = zmq.Poller()
+        self._socket_owner = {}     # type: Dict[zmq.Socket, SimulatedRadio]
+        self._active = set()        # Nodes with frames to send or ARQ timers running
+        self._activeLock = Lock()
+        self._pending = []          # type: List[Callable[[], None]]
+        self._pendingLock = Lock()
+        self._kill_switch = Event()
+
+        # ---------------------------------------------
+        # Load accounting
+        # ---------------------------------------------
+        self.iterations = 0         # Pump loop passes
+        self.busy_time = 0.0        # Seconds spent servicing nodes rather than waiting
+
+        # ---------------------------------------------
+        # Doorbell used to wake the simulator thread
+        # ---------------------------------------------
+        doorbell_url = "inproc://network_sim_doorbell_{}".format(id(self))
+        self._doorbell_rx = self.context.socket(zmq.PAIR)
+        self._doorbell_rx.setsockopt(zmq.LINGER, 0)
+        self._doorbell_rx.bind(doorbell_url)
+        self._doorbell_tx = self.context.socket(zmq.PAIR)
+        self._doorbell_tx.setsockopt(zmq.LINGER, 0)
+        self._doorbell_tx.connect(doorbell_url)
+        self._doorbellLock = Lock()
+        self._poller.register(self._doorbell_rx, zmq.POLLIN)
+
+    def __len__(self) -> int:
+        return len(self._nodes)
+
+    def node(self, mac: int) -> SimulatedRadio:
+        return self._nodes[mac]
+
+    def add_node(self, mac: int, transports: Tuple[str, ...] = None, **kwargs) -> SimulatedRadio:
+        """
+        Creates a node and binds its pipes to the given MAC address
+
+        Args:
+            mac: Root MAC address of the node
+            transports: Every transport the node should be reachable over. Defaults
+                to the simulator's transport.
+            kwargs: FIFO and ARQ settings for the node
+
+        Returns:
+            The new node
+        """
+        assert(mac not in self._nodes)
+        node = SimulatedRadio(self, **kwargs)
+        self._nodes[mac] = node
+
+        def register():
+            node.set_device_mac(mac, transports)
+            for pipe in node.rxPipe:
+                self._poller.register(pipe, zmq.POLLIN)
+                self._socket_owner[pipe] = node
+
+        self._call_on_sim_thread(register)
+        return node
+
+    def connect(self, src_mac: int, dst_mac: int, pipe: int, transport: str = None) -> None:
+        """
+        Opens the TX pipe of one node to an RX pipe of another
+
+        Args:
+            src_mac: Node that will transmit
+            dst_mac: Node that will receive
+            pipe: Which pipe to write to on the destination. Should be 1-5.
+            transport: Transport to reach the destination over. Defaults to the
+                simulator's transport, which only reaches nodes it hosts.
+
+        Returns:
+            None
+        """
+        node = self._nodes[src_mac]
+        self._call_on_sim_thread(lambda: node.open_tx_pipe(dst_mac, pipe, transport))
+
+    def connect_multicast(self, src_mac: int, dst_mac: int, transport: str = None) -> None:
+        """
+        Puts one node in multicast range of another
+
+        Args:
+            src_mac: Node that will send multicast frames
+            dst_mac: Node that will hear them, for the groups it joins
+            transport: Transport to reach the destination over. Defaults to the
+                simulator's transport, which only reaches nodes it hosts.
+
+        Returns:
+            None
+        """
+        node = self._nodes[src_mac]
+        self._call_on_sim_thread(lambda: node.add_multicast_peer(dst_mac, transport))
+
+    def join_group(self, mac: int, group: int, pipe: int) -> None:
+        """
+        Subscribes a node to the frames multicast to a group
+
+        Args:
+            mac: Node joining the group
+            group: Address of the group
+            pipe: Pipe the node receives the group's frames on
+
+        Returns:
+            None
+        """
+        node = self._nodes[mac]
+        # Checked here, as a failure on the simulator thread would take it down
+        assert(0 <= pipe < node.total_pipes())
+        self._call_on_sim_thread(lambda: node.join_group(group, pipe))
+
+    def leave_group(self, mac: int, group: int) -> None:
+        """
+        Unsubscribes a node from the frames multicast to a group
+
+        Args:
+            mac: Node leaving the group
+            group: Address of the group
+
+        Returns:
+            None
+        """
+        node = self._nodes[mac]
+        self._call_on_sim_thread(lambda: node.leave_group(group))
+
+    def notify_tx(self, node: SimulatedRadio) -> None:
+        """
+        Marks a node as having work for the TX side of its pump. Called from
+        whichever thread queued the frame.
+
+        Args:
+            node: Node that queued a frame
+
+        Returns:
+            None
+        """
+        with self._activeLock:
+            self._active.add(node)
+        self._ring_doorbell()
+
+    def kill(self) -> None:
+        self._kill_switch.set()
+        self._ring_doorbell()
+        for node in self._nodes.values():
+            node._rxQueue.wake()
+
+    def close(self) -> None:
+        """
+        Closes every node and the shared context. The simulator must not be running.
+        Returns:
+            None
+        """
+        assert(not self.is_alive())
+        for node in self._nodes.values():
+            node.close()
+        self._doorbell_rx.close()
+        self._doorbell_tx.close()
+        self.context.term()
+
+    def run(self) -> None:
+        """
+        Pumps every node from a single thread
+        """
+        while not self._kill_switch.is_set():
+            # Sleep until any node has data or work to do
+            ready = dict(self._poller.poll(self._pump_timeout_ms()))
+            if self._doorbell_rx in ready:
+                self._drain_doorbell()
+
+            # Topology changes first, so frames queued after them use the new pipes
+            self._run_pending()
+
+            start_time = time.perf_counter()
+            self.iterations += 1
+
+            # -----------------------------------------------------------------
+            # RX side, only visiting the nodes that have data waiting
+            # -----------------------------------------------------------------
+            receivers = {self._socket_owner[sock] for sock in ready if sock in self._socket_owner}
+            for node in receivers:
+                node._enqueue_rx_pipes(ready)
+
+            # -----------------------------------------------------------------
+            # TX side, only visiting the nodes that have something to send
+            # -----------------------------------------------------------------
+            with self._activeLock:
+                active = list(self._active)
+
+            for node in active:
+                node._dequeue_tx_pipes()
+
+            with self._activeLock:
+                for node in active:
+                    if not node.has_tx_work():
+                        self._active.discard(node)
+
+            self.busy_time += time.perf_counter() - start_time
+
+        self._run_pending()
+
+    def _pump_timeout_ms(self) -> int:
+        with self._activeLock:
+            active = list(self._active)
+
+        timeout = BufferedShockBurstRadio.PUMP_IDLE_TIMEOUT_MS
+        for node in active:
+            timeout = min(timeout, node._pump_timeout_ms())
+        return timeout
+
+    def _call_on_sim_thread(self, func: Callable[[], None]) -> None:
+        """
+        Runs a function that touches node sockets on the simulator thread, or
+        right away if the simulator isn't running.
+        """
+        if not self.is_alive():
+            func()
+            return
+
+        with self._pendingLock:
+            self._pending.append(func)
+        self._ring_doorbell()
+
+    def _run_pending(self) -> None:
+        with self._pendingLock:
+            pending, self._pending = self._pending, []
+
+        for func in pending:
+            func()
+
+    def _ring_doorbell(self) -> None:
+        with self._doorbellLock:
+            try:
+                self._doorbell_tx.send(b'', flags=zmq.DONTWAIT)
+            except zmq.Again:
+                pass
+
+    def _drain_doorbell(self) -> None:
+        while True:
+            try:
+                self._doorbell_rx.recv(flags=zmq.DONTWAIT)
+            except zmq.Again:
+                break
+
+    @staticmethod
+    def _raise_fd_limit() -> None:
+        if resource is None:
+            return
+
+        soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+        if soft != resource.RLIM_INFINITY and (hard == resource.RLIM_INFINITY or soft < hard):
+            resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
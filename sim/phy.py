@@ -0,0 +1,107 @@
+# **********************************************************************************************************************
+#   FileName:
+#       phy.py
+#
+#   Description:
+#       Timing model of the NRF24L01+ physical layer. Works out how long a frame occupies the air,
+#       including the radio settling times and the Enhanced ShockBurst ACK handshake.
+#
+#   2021 | Brandon Braun | brandonbraun653@gmail.com
+# **********************************************************************************************************************
+
+from enum import Enum
+from frame_packager import PackedFrame
+
+
+class DataRate(Enum):
+    """ Over the air data rates of the NRF24L01+, in bits per second """
+    DR_250KBPS = 250000
+    DR_1MBPS = 1000000
+    DR_2MBPS = 2000000
+
+
+class PhyTiming:
+    """
+    Works out the on-air timing of Enhanced ShockBurst packets, following
+    section 7.9 of the NRF24L01+ datasheet. All times are in seconds.
+
+    A packet is a preamble, the address, a 9 bit packet control field, the
+    payload and the CRC. Before a packet goes out the radio spends TX_SETTLE
+    switching from standby to TX. When an ACK was requested, the transmitter
+    then settles into RX while the receiver turns around and answers with an
+    empty packet.
+    """
+    PREAMBLE_BYTES = 1
+    PCF_BITS = 9                # Payload length, PID and NO_ACK flag
+    TX_SETTLE = 130e-6          # Standby to TX (Tstby2a)
+    RX_SETTLE = 130e-6          # TX to RX, and the receiver's RX to TX turnaround
+
+    ARD_STEP = 250e-6           # Auto retransmit delay is set in steps of this
+    ARD_MAX = 4000e-6
+
+    def __init__(self, data_rate: DataRate = DataRate.DR_2MBPS, address_width: int = 5, crc_length: int = 2,
+                 retransmit_delay: float = 500e-6):
+        """
+        Args:
+            data_rate: Over the air data rate
+            address_width: Bytes in the address, 3 to 5
+            crc_length: Bytes of CRC, 1 or 2. Enhanced ShockBurst requires the CRC.
+            retransmit_delay: Auto retransmit delay (ARD), the time from the end of
+                a transmission to the start of the next attempt. A multiple of
+                ARD_STEP up to ARD_MAX.
+        """
+        assert(3 <= address_width <= 5)
+        assert(crc_length in (1, 2))
+        assert(self.ARD_STEP <= retransmit_delay <= self.ARD_MAX)
+        self.data_rate = data_rate
+        self.address_width = address_width
+        self.crc_length = crc_length
+        self.retransmit_delay = retransmit_delay
+
+    def air_time(self, payload_size: int = PackedFrame.MAX_FRAME_SIZE) -> float:
+        """
+        Args:
+            payload_size: Bytes of payload in the packet
+
+        Returns:
+            Time the packet itself spends on the air
+        """
+        assert(0 <= payload_size <= PackedFrame.MAX_FRAME_SIZE)
+        size_bytes = self.PREAMBLE_BYTES + self.address_width + payload_size + self.crc_length
+        return (8 * size_bytes + self.PCF_BITS) / self.data_rate.value
+
+    def ack_time(self) -> float:
+        """
+        Returns:
+            Time from the end of a transmission until its ACK has been received
+        """
+        return self.RX_SETTLE + self.air_time(0)
+
+    def frame_time(self, payload_size: int = PackedFrame.MAX_FRAME_SIZE, require_ack: bool = True) -> float:
+        """
+        Args:
+            payload_size: Bytes of payload in the packet
+            require_ack: Whether the transmitter waits for an ACK afterwards
+
+        Returns:
+            Time the transmitter is busy with a single attempt at sending a packet
+        """
+        busy = self.TX_SETTLE + self.air_time(payload_size)
+        if require_ack:
+            busy += self.ack_time()
+        return busy
+
+    def retransmit_time(self, payload_size: int = PackedFrame.MAX_FRAME_SIZE, require_ack: bool = True) -> float:
+        """
+        Returns:
+            Time the transmitter is busy with an attempt at resending a packet, which
+            must first wait out the auto retransmit delay
+        """
+        return self.retransmit_delay + self.frame_time(payload_size, require_ack)
+
+    def max_frame_rate(self, payload_size: int = PackedFrame.MAX_FRAME_SIZE, require_ack: bool = True) -> float:
+        """
+        Returns:
+            Frames per second a single transmitter can send back to back
+        """
+        return 1.0 / self.frame_time(payload_size, require_ack)
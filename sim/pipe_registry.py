@@ -0,0 +1,199 @@
+# **********************************************************************************************************************
+#   FileName:
+#       pipe_registry.py
+#
+#   Description:
+#       Cache of sockets connected to the RX pipes of other devices
+#
+#   2021 | Brandon Braun | brandonbraun653@gmail.com
+# **********************************************************************************************************************
+
+import zmq
+
+from collections import OrderedDict
+from typing import Dict, Optional, Set, Tuple
+from ipc_utils import TRANSPORT_IPC, resolve
+
+
+class _Pipe:
+    __slots__ = ('socket', 'joined')
+
+    def __init__(self, socket: zmq.Socket):
+        self.socket = socket
+        self.joined = False
+
+
+class PipeRegistry:
+    """
+    Keeps a socket connected to each (destination MAC, pipe) that has been
+    talked to, so replying to a device is a dictionary lookup rather than a
+    new connection. The least recently used sockets are closed once more than
+    `capacity` are open, which bounds the number of file descriptors in use.
+    Pinned sockets are never closed this way.
+
+    Like any ZMQ publisher, a new socket drops messages until the subscription
+    from the other end reaches it. The sockets are XPUBs so that joined() can
+    tell when that has happened.
+    """
+    DEFAULT_CAPACITY = 64
+
+    def __init__(self, context: zmq.Context, transport: str = TRANSPORT_IPC, capacity: int = DEFAULT_CAPACITY):
+        """
+        Args:
+            context: ZMQ context used to create the sockets
+            transport: Transport used to reach devices without a route of their own
+            capacity: Max number of sockets kept open
+        """
+        assert(capacity > 0)
+        self.context = context
+        self.transport = transport
+        self.capacity = capacity
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        self._pipes = OrderedDict()     # type: Dict[Tuple[int, int], _Pipe]
+        self._routes = {}               # type: Dict[int, str]
+        self._pinned = set()            # type: Set[Tuple[int, int]]
+
+    def __len__(self) -> int:
+        return len(self._pipes)
+
+    def __contains__(self, key: Tuple[int, int]) -> bool:
+        return key in self._pipes
+
+    def set_route(self, mac: int, transport: str) -> None:
+        """
+        Selects the transport used to reach a device. Only affects sockets
+        connected after the call.
+
+        Args:
+            mac: Root MAC address of the device
+            transport: Transport the device's pipes are bound to
+
+        Returns:
+            None
+        """
+        self._routes[mac] = transport
+
+    def route(self, mac: int) -> str:
+        """
+        Returns:
+            Transport used to reach a device
+        """
+        return self._routes.get(mac, self.transport)
+
+    def get(self, mac: int, pipe: int) -> zmq.Socket:
+        """
+        Looks up the socket for an RX pipe on some device, connecting a new one
+        if needed. Marks the socket as recently used.
+
+        Args:
+            mac: Root MAC address of the device
+            pipe: RX pipe on the device
+
+        Returns:
+            Socket that publishes to the pipe
+        """
+        key = (mac, pipe)
+        entry = self._pipes.get(key)
+        if entry is not None:
+            self._pipes.move_to_end(key)
+            self.hits += 1
+            return entry.socket
+
+        self.misses += 1
+        while len(self._pipes) >= self.capacity:
+            # Oldest first. Goes over capacity rather than close a pinned socket.
+            stale = next((x for x in self._pipes if x not in self._pinned), None)
+            if stale is None:
+                break
+            self._pipes.pop(stale).socket.close(linger=0)
+            self.evictions += 1
+
+        # Always a plain socket, even with an asyncio context, as publishing never blocks
+        sock = zmq.Socket(self.context, zmq.XPUB)
+        sock.connect(resolve(mac).rx_url(pipe, self.route(mac)))
+        self._pipes[key] = _Pipe(sock)
+        return sock
+
+    def pin(self, mac: int, pipe: int) -> zmq.Socket:
+        """
+        Looks up the socket for a pipe like get(), and keeps it from being evicted
+        until unpinned. A socket that is reconnected drops messages until it has
+        joined again, so the pipe a radio is transmitting to must stay open.
+
+        Args:
+            mac: Root MAC address of the device
+            pipe: RX pipe on the device
+
+        Returns:
+            Socket that publishes to the pipe
+        """
+        self._pinned.add((mac, pipe))
+        return self.get(mac, pipe)
+
+    def unpin(self, mac: int, pipe: int) -> None:
+        """
+        Lets the socket for a pipe be evicted again once it is least recently used
+        Returns:
+            None
+        """
+        self._pinned.discard((mac, pipe))
+
+    def joined(self, mac: int, pipe: int) -> bool:
+        """
+        Checks if the socket for a pipe is connected and subscribed to, meaning
+        messages sent on it will be delivered
+
+        Args:
+            mac: Root MAC address of the device
+            pipe: RX pipe on the device
+
+        Returns:
+            bool
+        """
+        entry = self._pipes.get((mac, pipe))
+        if entry is None:
+            return False
+
+        if not entry.joined:
+            try:
+                entry.socket.recv(flags=zmq.DONTWAIT)
+                entry.joined = True
+            except zmq.Again:
+                pass
+
+        return entry.joined
+
+    def peek(self, mac: int, pipe: int) -> Optional[zmq.Socket]:
+        """
+        Looks up a socket without connecting one or touching the LRU order
+
+        Returns:
+            Socket that publishes to the pipe, or None if there isn't one
+        """
+        entry = self._pipes.get((mac, pipe))
+        return entry.socket if entry is not None else None
+
+    def evict(self, mac: int, pipe: int) -> None:
+        """
+        Closes the socket for a pipe, if there is one
+        Returns:
+            None
+        """
+        entry = self._pipes.pop((mac, pipe), None)
+        if entry is not None:
+            entry.socket.close(linger=0)
+
+    def close(self) -> None:
+        """
+        Closes every socket in the registry
+        Returns:
+            None
+        """
+        for entry in self._pipes.values():
+            entry.socket.close(linger=0)
+        self._pipes.clear()
+        self._pinned.clear()
@@ -0,0 +1,335 @@
+# **********************************************************************************************************************
+#   FileName:
+#       profiling.py
+#
+#   Description:
+#       Opt-in profiling of the stages of a radio's message pump. Timers, cProfile or a sampler
+#       can be switched on and off while the radio runs, and the breakdown written to a file.
+#
+#   2021 | Brandon Braun | brandonbraun653@gmail.com
+# **********************************************************************************************************************
+
+import cProfile
+import io
+import pstats
+import sys
+import time
+
+from enum import Enum
+from threading import Event, Lock, Thread
+from typing import Callable, Dict, List, NamedTuple, Optional
+
+# ---------------------------------------------------------------------
+# Pump methods that make up each stage. Stages nest, so the self time of
+# one leaves out the stages it calls into: "rx" is what's left of a pass
+# over the RX pipes once receiving, decoding, delivering and ACKing are
+# taken out. Sends are split by the type of frame.
+# ---------------------------------------------------------------------
+STAGES = {
+    '_enqueue_rx_pipes': 'rx',
+    '_recv_nowait': 'rx.recv',
+    '_process_rx_frame': 'rx.process',
+    '_decode': 'rx.decode',
+    '_deliver_rx': 'rx.deliver',
+    '_process_ack_frame': 'rx.ack',
+    '_process_multicast_frame': 'rx.multicast',
+    '_dequeue_tx_pipes': 'tx',
+    '_pop_tx_frame': 'tx.dequeue',
+    '_run_transmitter': 'tx.phy',
+    '_send_delayed': 'tx.delayed',
+    '_send': 'send',
+    '_send_multicast': 'send.multicast',
+}
+
+# The stage each pass of the pump ends with
+_PASS_METHOD = '_dequeue_tx_pipes'
+
+# Methods cProfile is switched on around. Every other stage runs inside one of them.
+_ROOT_METHODS = ('_enqueue_rx_pipes', '_dequeue_tx_pipes')
+
+
+class ProfileMode(Enum):
+    OFF = 0
+    STAGES = 1          # Times every stage with perf_counter
+    CPROFILE = 2        # Runs cProfile over the pump, function by function
+    SAMPLING = 3        # Periodically looks at what the pump is doing, from another thread
+
+
+class StageTimes(NamedTuple):
+    """ Time spent in one stage of the pump """
+    stage: str
+    calls: int
+    total: float        # Seconds spent in the stage, including the stages it calls
+    self_time: float    # Seconds spent in the stage itself
+    max_call: float     # Longest single call, in seconds
+
+
+class _StageCounter:
+    __slots__ = ('calls', 'total', 'self_time', 'max_call')
+
+    def __init__(self):
+        self.calls = 0
+        self.total = 0.0
+        self.self_time = 0.0
+        self.max_call = 0.0
+
+
+class PumpProfiler:
+    """
+    Profiles the pump of one radio, whichever flavor of pump drives it. Hooks
+    are installed on the radio instance itself, so nothing is added to the
+    pump while profiling is off.
+
+        profiler = PumpProfiler(radio)
+        profiler.set_mode(ProfileMode.STAGES)
+        ...
+        profiler.dump("pump_profile.txt")
+    """
+
+    def __init__(self, radio, sample_interval: float = 1e-3):
+        """
+        Args:
+            radio: Radio to profile
+            sample_interval: Seconds between samples in SAMPLING mode
+        """
+        self.radio = radio
+        self.sample_interval = sample_interval
+        self.mode = ProfileMode.OFF
+
+        self._lock = Lock()
+        self._started = None        # type: Optional[float]
+        self._elapsed = 0.0
+        self._passes = 0            # Passes timed in STAGES mode
+        self._profiled_passes = 0   # Passes run under cProfile
+        self._stages = {}           # type: Dict[str, _StageCounter]
+        self._stack = []            # type: List[float]
+        self._profile = None        # type: Optional[cProfile.Profile]
+        self._samples = {}          # type: Dict[str, int]
+        self._sampler = None        # type: Optional[Thread]
+        self._stop_sampling = Event()
+
+    def set_mode(self, mode: ProfileMode) -> None:
+        """
+        Switches profiling over, keeping whatever was gathered so far. Safe to
+        call while the pump runs; the change applies from the pump's next call
+        into one of its stages.
+
+        Args:
+            mode: What to profile with
+
+        Returns:
+            None
+        """
+        with self._lock:
+            if mode == self.mode:
+                return
+
+            self._stop()
+            self.mode = mode
+            if mode == ProfileMode.STAGES:
+                for method, stage in STAGES.items():
+                    self._hook(method, self._timed(method, stage))
+            elif mode == ProfileMode.CPROFILE:
+                if self._profile is None:
+                    self._profile = cProfile.Profile()
+                for method in _ROOT_METHODS:
+                    self._hook(method, self._profiled(method))
+            elif mode == ProfileMode.SAMPLING:
+                self._stop_sampling.clear()
+                self._sampler = Thread(target=self._sample, daemon=True)
+                self._sampler.start()
+
+            if mode != ProfileMode.OFF:
+                self._started = time.perf_counter()
+
+    def reset(self) -> None:
+        """
+        Throws away everything gathered so far
+        Returns:
+            None
+        """
+        with self._lock:
+            self._elapsed = 0.0
+            self._passes = 0
+            self._profiled_passes = 0
+            self._stages.clear()
+            self._samples.clear()
+            self._profile = cProfile.Profile() if self.mode == ProfileMode.CPROFILE else None
+            if self._started is not None:
+                self._started = time.perf_counter()
+
+    def stage_times(self) -> List[StageTimes]:
+        """
+        Returns:
+            Time spent in each stage timed in STAGES mode, most self time first
+        """
+        times = [StageTimes(stage, x.calls, x.total, x.self_time, x.max_call)
+                 for stage, x in list(self._stages.items())]
+        return sorted(times, key=lambda x: x.self_time, reverse=True)
+
+    def samples(self) -> Dict[str, int]:
+        """
+        Returns:
+            Number of samples that caught the pump in each stage in SAMPLING mode.
+            Samples that caught it outside of every stage count as "idle".
+        """
+        return dict(self._samples)
+
+    def dump(self, path: str) -> None:
+        """
+        Writes the per-stage breakdown of everything gathered so far, in every mode used
+
+        Args:
+            path: Text file to write
+
+        Returns:
+            None
+        """
+        with open(path, 'w') as file:
+            file.write(self.format())
+
+    def format(self) -> str:
+        """
+        Returns:
+            Per-stage breakdown of everything gathered so far
+        """
+        elapsed = self._elapsed
+        if self._started is not None:
+            elapsed += time.perf_counter() - self._started
+
+        lines = ["Pump profile of radio {}, mode {}, {:.3f} s profiled".format(
+            hex(self.radio.mac_address), self.mode.name, elapsed)]
+
+        stages = self.stage_times()
+        if stages:
+            busy = sum(x.self_time for x in stages)
+            lines += ["", "Stage timers, {} passes".format(self._passes),
+                      "{:16s} {:>10s} {:>10s} {:>10s} {:>7s} {:>11s} {:>10s}".format(
+                          "stage", "calls", "total_ms", "self_ms", "self%", "us/pass", "max_us")]
+            for x in stages:
+                lines.append("{:16s} {:10d} {:10.3f} {:10.3f} {:7.1%} {:11.2f} {:10.1f}".format(
+                    x.stage, x.calls, x.total * 1e3, x.self_time * 1e3, x.self_time / busy if busy else 0.0,
+                    x.self_time / self._passes * 1e6 if self._passes else 0.0, x.max_call * 1e6))
+
+        samples = self.samples()
+        if samples:
+            count = sum(samples.values())
+            lines += ["", "Samples, every {:.1f} ms".format(self.sample_interval * 1e3),
+                      "{:16s} {:>10s} {:>7s}".format("stage", "samples", "share")]
+            for stage, hits in sorted(samples.items(), key=lambda x: x[1], reverse=True):
+                lines.append("{:16s} {:10d} {:7.1%}".format(stage, hits, hits / count))
+
+        # pstats refuses a profile that hasn't recorded anything yet, as after a reset
+        if self._profile is not None and self._profile.getstats():
+            stream = io.StringIO()
+            stats = pstats.Stats(self._profile, stream=stream)
+            stats.sort_stats(pstats.SortKey.TIME).print_stats(30)
+            lines += ["", "cProfile, {} passes, by self time".format(self._profiled_passes), stream.getvalue()]
+
+        return "\n".join(lines) + "\n"
+
+    def _stop(self) -> None:
+        """
+        Takes down whatever the current mode set up
+        """
+        for method in STAGES:
+            self.radio.__dict__.pop(method, None)
+
+        if self._sampler is not None:
+            self._stop_sampling.set()
+            self._sampler.join()
+            self._sampler = None
+
+        if self._started is not None:
+            self._elapsed += time.perf_counter() - self._started
+            self._started = None
+
+    def _hook(self, method: str, wrapper: Callable) -> None:
+        # An instance attribute shadows the class's method for this radio only
+        setattr(self.radio, method, wrapper)
+
+    def _timed(self, method: str, stage: str) -> Callable:
+        """
+        Returns:
+            Stand-in for a pump method that times it as a stage
+        """
+        func = getattr(type(self.radio), method).__get__(self.radio)
+        clock = time.perf_counter
+        stack = self._stack
+        stages = self._stages
+        counts_pass = method == _PASS_METHOD
+        by_frame_type = method == '_send'
+
+        def timed(*args, **kwargs):
+            start = clock()
+            stack.append(0.0)
+            try:
+                return func(*args, **kwargs)
+            finally:
+                elapsed = clock() - start
+                children = stack.pop()
+                if stack:
+                    stack[-1] += elapsed
+
+                name = "{}.{}".format(stage, args[1].name.lower()) if by_frame_type else stage
+                counter = stages.get(name)
+                if counter is None:
+                    counter = stages[name] = _StageCounter()
+                counter.calls += 1
+                counter.total += elapsed
+                counter.self_time += elapsed - children
+                if elapsed > counter.max_call:
+                    counter.max_call = elapsed
+                if counts_pass:
+                    self._passes += 1
+
+        return timed
+
+    def _profiled(self, method: str) -> Callable:
+        """
+        Returns:
+            Stand-in for a pump method that runs it under cProfile
+        """
+        func = getattr(type(self.radio), method).__get__(self.radio)
+        counts_pass = method == _PASS_METHOD
+
+        def profiled(*args, **kwargs):
+            # Looked up on every call, as reset() swaps in a fresh profile
+            profile = self._profile
+            profile.enable()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                profile.disable()
+                if counts_pass:
+                    self._profiled_passes += 1
+
+        return profiled
+
+    def _sample(self) -> None:
+        """
+        Sampler thread. Finds the innermost stage each thread is in for this
+        radio, so radios sharing a pump thread are told apart.
+        """
+        codes = {}
+        for method, stage in STAGES.items():
+            func = getattr(type(self.radio), method, None)
+            if func is not None:
+                codes[func.__code__] = stage
+
+        current_frames = sys._current_frames
+        while not self._stop_sampling.wait(self.sample_interval):
+            stage = 'idle'
+            for frame in current_frames().values():
+                while frame is not None:
+                    if frame.f_code in codes and frame.f_locals.get('self') is self.radio:
+                        stage = codes[frame.f_code]
+                        if stage == 'send':
+                            frame_type = frame.f_locals.get('frame_type')
+                            stage = "send.{}".format(frame_type.name.lower()) if frame_type is not None else stage
+                        break
+                    frame = frame.f_back
+                if stage != 'idle':
+                    break
+
+            self._samples[stage] = self._samples.get(stage, 0) + 1
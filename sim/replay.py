@@ -0,0 +1,232 @@
+# **********************************************************************************************************************
+#   FileName:
+#       replay.py
+#
+#   Description:
+#       Replays captured traffic into radios or straight into frame consumers, at the original
+#       timing, a scaled rate or as fast as possible.
+#
+#   2021 | Brandon Braun | brandonbraun653@gmail.com
+# **********************************************************************************************************************
+
+import heapq
+import itertools
+import queue
+import time
+
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, Iterator, NamedTuple, Optional, Union
+from capture import CaptureRecord, Direction, capture_files, iter_capture
+from event_sim import EventScheduler
+from frame_packager import FrameView
+from virtual_shockburst import BufferedShockBurstRadio, FrameType
+
+Sink = Callable[[CaptureRecord], Any]
+
+
+class ReplayStats(NamedTuple):
+    """ Summary of a replay run """
+    frames: int         # Records handed to the sink
+    elapsed: float      # Seconds the replay took
+    max_lag: float      # Furthest the replay fell behind the requested timing, in seconds
+
+    @property
+    def rate(self) -> float:
+        """ Frames per second handed to the sink """
+        return self.frames / self.elapsed if self.elapsed else 0.0
+
+
+def user_frames(records: Iterable[CaptureRecord], direction: Direction = Direction.TX) -> Iterator[CaptureRecord]:
+    """
+    Picks out the user data a capture holds, leaving out ACKs, which radios
+    generate for themselves on replay. With the default of TX only, each frame
+    is replayed once even when both ends of a link were recorded.
+
+    Args:
+        records: Capture records
+        direction: Which side of the link to keep
+
+    Returns:
+        Iterator over the matching records
+    """
+    for record in records:
+        if record.direction == direction and record.frame_type == FrameType.USER_DATA.value:
+            yield record
+
+
+def stream_capture(path: Union[str, Path]) -> Iterator[CaptureRecord]:
+    """
+    Streams a capture along with whatever the recorder rotated out of it, oldest first
+
+    Args:
+        path: Ring file the recorder was created with
+
+    Returns:
+        Iterator over the records
+    """
+    return itertools.chain.from_iterable(iter_capture(x) for x in capture_files(path))
+
+
+def merge_captures(*paths: Union[str, Path]) -> Iterator[CaptureRecord]:
+    """
+    Interleaves captures from several recorders by timestamp, for when each
+    radio was given its own. The recorders must have shared a clock.
+
+    Args:
+        paths: Ring files the recorders were created with
+
+    Returns:
+        Iterator over the records, oldest first
+    """
+    return heapq.merge(*(stream_capture(x) for x in paths), key=lambda x: x.timestamp)
+
+
+class TraceReplay:
+    """
+    Feeds capture records to a sink, spaced out like they were recorded. The
+    records are consumed lazily, so a capture streamed with stream_capture() is
+    never loaded as a whole.
+    """
+
+    def __init__(self, records: Iterable[CaptureRecord], speed: Optional[float] = 1.0,
+                 clock: Callable[[], float] = time.perf_counter, sleep: Callable[[float], None] = time.sleep):
+        """
+        Args:
+            records: Records to replay, oldest first
+            speed: Multiple of the recorded rate to replay at. None replays as fast as possible.
+            clock: Time source used to pace the replay, in seconds
+            sleep: Waits for some number of seconds
+        """
+        assert(speed is None or speed > 0)
+        self.records = records
+        self.speed = speed
+        self.clock = clock
+        self.sleep = sleep
+
+    def run(self, sink: Sink) -> ReplayStats:
+        """
+        Replays every record, blocking until done
+
+        Args:
+            sink: Called with each record when it's due
+
+        Returns:
+            How the replay went
+        """
+        frames = 0
+        max_lag = 0.0
+        first = None
+        start = self.clock()
+
+        for record in self.records:
+            if self.speed is not None:
+                if first is None:
+                    first = record.timestamp
+
+                # -------------------------------------------------------------
+                # Pace against the start of the replay rather than the last
+                # record, so time lost to the sink doesn't add up.
+                # -------------------------------------------------------------
+                due = start + (record.timestamp - first) / self.speed
+                wait = due - self.clock()
+                if wait > 0:
+                    self.sleep(wait)
+                else:
+                    max_lag = max(max_lag, -wait)
+
+            sink(record)
+            frames += 1
+
+        return ReplayStats(frames, self.clock() - start, max_lag)
+
+    def schedule(self, scheduler: EventScheduler, sink: Sink, start: float = None) -> None:
+        """
+        Replays the records in virtual time, for use with the DiscreteEventSimulator.
+        Only one record is waiting in the scheduler at a time.
+
+        Args:
+            scheduler: Scheduler to run the replay on
+            sink: Called with each record when it's due
+            start: Clock time of the first record. Defaults to now.
+
+        Returns:
+            None
+        """
+        records = iter(self.records)
+        start = start if start is not None else scheduler.clock.now
+        first = []
+
+        def deliver(record: CaptureRecord) -> None:
+            sink(record)
+            queue_next()
+
+        def queue_next() -> None:
+            record = next(records, None)
+            if record is None:
+                return
+
+            if not first:
+                first.append(record.timestamp)
+            offset = (record.timestamp - first[0]) / self.speed if self.speed is not None else 0.0
+            scheduler.call_at(start + offset, deliver, record)
+
+        queue_next()
+
+
+def frame_sink(consumer: Callable[[FrameView], Any]) -> Sink:
+    """
+    Makes a sink that hands each recorded frame to a PackedFrame consumer,
+    viewing the record's data rather than unpacking it
+
+    Args:
+        consumer: Called with each frame
+
+    Returns:
+        Sink for TraceReplay
+    """
+    def sink(record: CaptureRecord) -> None:
+        consumer(FrameView(record.data))
+
+    return sink
+
+
+class RadioSink:
+    """
+    Sink that transmits each recorded frame from a radio standing in for the
+    device that recorded it
+    """
+
+    def __init__(self, radios: Dict[int, BufferedShockBurstRadio], retarget: bool = False, block: bool = True):
+        """
+        Args:
+            radios: Radio to transmit from, keyed by the MAC address in the capture
+            retarget: Whether to point each radio's TX pipe at the device and pipe the
+                frame was originally sent to. Only safe where the replay runs on the
+                thread that pumps the radios, such as under the DiscreteEventSimulator,
+                or while they aren't running. open_tx_pipe() isn't thread safe, so
+                leave this off for a started ShockBurstRadio or a running
+                NetworkSimulator, and connect those up front instead.
+            block: Whether to wait for room in a full TX FIFO. Frames that find no
+                room are counted in dropped rather than stopping the replay.
+        """
+        self.radios = radios
+        self.retarget = retarget
+        self.block = block
+        self.unrouted = 0   # Records from devices without a radio
+        self.dropped = 0    # Frames the radio's TX FIFO had no room for
+
+    def __call__(self, record: CaptureRecord) -> None:
+        radio = self.radios.get(record.mac)
+        if radio is None:
+            self.unrouted += 1
+            return
+
+        if self.retarget and record.peer and radio.tx_target() != (record.peer, record.pipe):
+            radio.open_tx_pipe(record.peer, record.pipe)
+        try:
+            queued = radio.transmit(record.data, block=self.block)
+        except queue.Full:
+            queued = False
+
+        if not queued:
+            self.dropped += 1
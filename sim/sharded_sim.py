@@ -0,0 +1,242 @@
+# **********************************************************************************************************************
+#   FileName:
+#       sharded_sim.py
+#
+#   Description:
+#       Splits a network of simulated radios across worker processes, one shard per core. Links
+#       inside a shard use inproc:// pipes and only links between shards go over ipc://.
+#
+#   2021 | Brandon Braun | brandonbraun653@gmail.com
+# **********************************************************************************************************************
+
+import multiprocessing
+import os
+import time
+
+from threading import BrokenBarrierError
+from typing import Any, Callable, Dict, Iterable, List, NamedTuple, Optional, Tuple
+from ipc_utils import TRANSPORT_IPC, TRANSPORT_INPROC
+from network_sim import NetworkSimulator
+
+# ---------------------------------------------
+# A link is (source MAC, destination MAC, pipe)
+# ---------------------------------------------
+Link = Tuple[int, int, int]
+Placement = Dict[int, int]
+Workload = Callable[[NetworkSimulator, List[int]], Any]
+
+
+class ShardReport(NamedTuple):
+    """ Load summary returned by each shard once the simulation ends """
+    shard: int
+    nodes: int
+    local_links: int
+    remote_links: int
+    wall_time: float        # Seconds the workload ran for
+    cpu_time: float         # CPU seconds used by the shard process over the same period
+    iterations: int         # Pump loop passes
+    busy_time: float        # Seconds the pump spent servicing nodes
+    result: Any             # Whatever the workload returned
+
+    @property
+    def utilization(self) -> float:
+        """ Fraction of one core the shard kept busy """
+        return self.cpu_time / self.wall_time if self.wall_time else 0.0
+
+
+def round_robin_placement(macs: Iterable[int], shards: int) -> Placement:
+    """
+    Deals nodes out to shards one at a time
+    """
+    return {mac: idx % shards for idx, mac in enumerate(macs)}
+
+
+def contiguous_placement(macs: Iterable[int], shards: int) -> Placement:
+    """
+    Gives each shard a contiguous block of nodes, which keeps neighbors in chains
+    and rings on the same shard
+    """
+    macs = list(macs)
+    per_shard = -(-len(macs) // shards)
+    return {mac: idx // per_shard for idx, mac in enumerate(macs)}
+
+
+def _links_to_nodes(links: Iterable[Link]) -> List[int]:
+    macs = []
+    seen = set()
+    for src, dst, _ in links:
+        for mac in (src, dst):
+            if mac not in seen:
+                seen.add(mac)
+                macs.append(mac)
+    return macs
+
+
+class ShardedSimulation:
+    """
+    Runs a topology of simulated radios across a pool of worker processes:
+
+        sim = ShardedSimulation(links, workload=my_workload)
+        reports = sim.run()
+        print(format_reports(reports))
+
+    The workload runs inside every shard once all nodes are connected. It gets the
+    shard's NetworkSimulator and the MACs of the nodes placed on it, and must be a
+    module level function so it can be sent to the workers.
+    """
+
+    def __init__(self, links: Iterable[Link], workload: Workload, shards: int = None,
+                 placement: Optional[Placement] = None,
+                 placement_func: Callable[[Iterable[int], int], Placement] = contiguous_placement,
+                 node_kwargs: Dict[str, Any] = None, settle_time: float = 0.25):
+        """
+        Args:
+            links: Every (source MAC, destination MAC, pipe) to open
+            workload: Function run in each shard once the network is up
+            shards: Number of worker processes. Defaults to the number of cores.
+            placement: Explicit MAC to shard mapping. Overrides placement_func.
+            placement_func: Strategy used to place nodes when no explicit mapping is given
+            node_kwargs: FIFO and ARQ settings applied to every node
+            settle_time: Seconds to let connections establish before the workload starts
+        """
+        self.links = list(links)
+        self.workload = workload
+        self.shards = shards if shards is not None else os.cpu_count()
+        self.node_kwargs = node_kwargs if node_kwargs is not None else {}
+        self.settle_time = settle_time
+
+        macs = _links_to_nodes(self.links)
+        self.placement = placement if placement is not None else placement_func(macs, self.shards)
+        assert(all(0 <= self.placement[mac] < self.shards for mac in macs))
+
+    def run(self) -> List[ShardReport]:
+        """
+        Starts every shard, runs the workload and waits for all of them to finish
+
+        Returns:
+            One report per shard, ordered by shard index
+        """
+        barrier = multiprocessing.Barrier(self.shards)
+        with multiprocessing.Pool(self.shards, initializer=_init_worker, initargs=(barrier,)) as pool:
+            # With one task per worker and every task waiting on the barrier,
+            # each shard is guaranteed its own process.
+            args = [(shard, self.links, self.placement, self.workload, self.node_kwargs, self.settle_time)
+                    for shard in range(self.shards)]
+            pending = [pool.apply_async(_run_shard, x) for x in args]
+
+            # -----------------------------------------------------------------
+            # A shard that fails breaks the barrier for all the others, so wait
+            # for every shard and raise the failure rather than a broken barrier
+            # -----------------------------------------------------------------
+            reports = []
+            errors = []
+            for result in pending:
+                try:
+                    reports.append(result.get())
+                except Exception as e:
+                    errors.append(e)
+
+            if errors:
+                raise next((e for e in errors if not isinstance(e, BrokenBarrierError)), errors[0])
+            return reports
+
+
+# ---------------------------------------------
+# Worker process side
+# ---------------------------------------------
+_barrier = None
+
+
+def _init_worker(barrier) -> None:
+    global _barrier
+    _barrier = barrier
+
+
+def _run_shard(shard: int, links: List[Link], placement: Placement, workload: Workload,
+               node_kwargs: Dict[str, Any], settle_time: float) -> ShardReport:
+    local = [mac for mac, owner in placement.items() if owner == shard]
+    local_set = set(local)
+
+    # ---------------------------------------------------------------------
+    # Nodes that talk to other shards must also be reachable over IPC, both
+    # to receive data and to receive the ACKs for what they send.
+    # ---------------------------------------------------------------------
+    remote_peers = set()
+    for src, dst, _ in links:
+        if (src in local_set) != (dst in local_set):
+            remote_peers.update((src, dst))
+
+    sim = NetworkSimulator(TRANSPORT_INPROC)
+    try:
+        for mac in local:
+            transports = (TRANSPORT_INPROC, TRANSPORT_IPC) if mac in remote_peers else (TRANSPORT_INPROC,)
+            sim.add_node(mac, transports, **node_kwargs)
+
+        # Every shard must have bound its pipes before anyone connects to them
+        _barrier.wait()
+
+        local_links = 0
+        remote_links = 0
+        for src, dst, pipe in links:
+            if src not in local_set:
+                if dst in local_set:
+                    # ACKs go back to the sender in the other shard
+                    sim.node(dst).pipeRegistry.set_route(src, TRANSPORT_IPC)
+                continue
+
+            if dst in local_set:
+                sim.connect(src, dst, pipe, TRANSPORT_INPROC)
+                local_links += 1
+            else:
+                sim.connect(src, dst, pipe, TRANSPORT_IPC)
+                remote_links += 1
+
+        sim.start()
+        _barrier.wait()
+        time.sleep(settle_time)
+
+        # ---------------------------------------------
+        # Run the workload and measure the load
+        # ---------------------------------------------
+        start_wall = time.perf_counter()
+        start_cpu = time.process_time()
+        result = workload(sim, local)
+        wall_time = time.perf_counter() - start_wall
+        cpu_time = time.process_time() - start_cpu
+
+        # Keep serving traffic until every shard is done with its workload
+        _barrier.wait()
+    except BaseException:
+        # Break the barrier so the other shards fail too rather than wait forever
+        _barrier.abort()
+        raise
+    finally:
+        if sim.is_alive():
+            sim.kill()
+            sim.join()
+        sim.close()
+
+    return ShardReport(shard, len(local), local_links, remote_links, wall_time, cpu_time,
+                       sim.iterations, sim.busy_time, result)
+
+
+def format_reports(reports: List[ShardReport]) -> str:
+    """
+    Renders shard reports as a table, flagging shards that are far busier than average
+
+    Args:
+        reports: Output of ShardedSimulation.run()
+
+    Returns:
+        Printable table
+    """
+    lines = ["shard  nodes  local  remote   wall_s    cpu_s  util  iterations   busy_s"]
+    mean_util = sum(r.utilization for r in reports) / len(reports) if reports else 0.0
+
+    for r in reports:
+        hot = " <- rebalance" if mean_util and r.utilization > 1.5 * mean_util else ""
+        lines.append("{:5d}  {:5d}  {:5d}  {:6d}  {:7.3f}  {:7.3f}  {:4.2f}  {:10d}  {:7.3f}{}".format(
+            r.shard, r.nodes, r.local_links, r.remote_links, r.wall_time, r.cpu_time, r.utilization,
+            r.iterations, r.busy_time, hot))
+
+    return "\n".join(lines)
@@ -0,0 +1,428 @@
+# **********************************************************************************************************************
+#   FileName:
+#       shared_stats.py
+#
+#   Description:
+#       Publishes radio stats into shared memory, one segment per radio, and a top style monitor
+#       that reads every segment on the machine. Nothing goes over the ZMQ pipes being measured.
+#
+#       python shared_stats.py
+#       python shared_stats.py --interval 0.5 0xB4B5B6B7B5
+#
+#   2021 | Brandon Braun | brandonbraun653@gmail.com
+# **********************************************************************************************************************
+
+import argparse
+import os
+import sys
+import time
+import numpy as np
+
+from multiprocessing import resource_tracker, shared_memory
+from threading import Event, Lock, Thread
+from typing import Dict, Iterable, List, NamedTuple, Optional
+from metrics import NUM_COUNTERS, PipeStats, RadioStats
+
+SEGMENT_PREFIX = "ripple_stats_"
+_SHM_DIR = "/dev/shm"
+
+# ---------------------------------------------------------------------
+# Segment layout, an array of native int64 words. A header of
+# HEADER_WORDS, of which these are used:
+#   magic       STATS_MAGIC
+#   sequence    Odd while the publisher is writing
+#   mac         Radio's address
+#   pid         Process hosting the radio
+#   num_pipes
+#   updated_ns  Wall clock time of the last write
+#   tx_fifo     Frames in the TX FIFO, -1 if unknown
+#   rx_fifo     Frames in the RX FIFO, -1 if unknown
+#   rtt_p50     Median ACK round trip, in microseconds
+#   rtt_p99
+#   pump_p99    99th percentile pump pass, in microseconds
+#
+# Followed by the counters, NUM_COUNTERS rows of num_pipes words in
+# PipeStats field order.
+# ---------------------------------------------------------------------
+STATS_MAGIC = 0x31545352    # 'RST1'
+HEADER_WORDS = 16
+(_MAGIC, _SEQUENCE, _MAC, _PID, _PIPES, _UPDATED_NS, _TX_FIFO, _RX_FIFO,
+ _RTT_P50, _RTT_P99, _PUMP_P99) = range(11)
+
+_WORD = np.dtype(np.int64)
+
+
+class StatsSample(NamedTuple):
+    """ A consistent read of one radio's segment """
+    mac: int
+    pid: int
+    updated: float                  # Wall clock time of the publish, in seconds
+    tx_fifo_depth: Optional[int]
+    rx_fifo_depth: Optional[int]
+    rtt_p50: float                  # Seconds
+    rtt_p99: float
+    pump_p99: float
+    pipes: List[PipeStats]
+
+
+def segment_name(mac: int) -> str:
+    """
+    Returns:
+        Name of the shared memory segment holding a radio's stats
+    """
+    return "{}{:010x}".format(SEGMENT_PREFIX, mac)
+
+
+def list_segments() -> List[str]:
+    """
+    Finds every stats segment on the machine. Only works where POSIX shared
+    memory shows up in /dev/shm, such as Linux.
+
+    Returns:
+        Segment names, sorted
+    """
+    if not os.path.isdir(_SHM_DIR):
+        return []
+    return sorted(x for x in os.listdir(_SHM_DIR) if x.startswith(SEGMENT_PREFIX))
+
+
+class StatsSegment:
+    """
+    One radio's stats in shared memory. A single publisher writes it, using a
+    sequence counter rather than a lock, and any number of readers in other
+    processes retry whenever they catch a write in progress.
+    """
+
+    def __init__(self, shm: shared_memory.SharedMemory, owner: bool):
+        self._shm = shm
+        self._owner = owner
+        self._words = np.ndarray((shm.size // _WORD.itemsize,), dtype=_WORD, buffer=shm.buf)
+
+    @property
+    def name(self) -> str:
+        return self._shm.name
+
+    @classmethod
+    def create(cls, mac: int, num_pipes: int) -> 'StatsSegment':
+        """
+        Creates the segment for a radio, replacing any left behind by a process that died
+
+        Args:
+            mac: Radio's address
+            num_pipes: Number of pipes the radio has
+
+        Returns:
+            StatsSegment
+        """
+        name = segment_name(mac)
+        size = (HEADER_WORDS + NUM_COUNTERS * num_pipes) * _WORD.itemsize
+        try:
+            shm = shared_memory.SharedMemory(name, create=True, size=size)
+        except FileExistsError:
+            stale = shared_memory.SharedMemory(name)
+            stale.close()
+            stale.unlink()
+            shm = shared_memory.SharedMemory(name, create=True, size=size)
+
+        segment = cls(shm, owner=True)
+        words = segment._words
+        words[:] = 0
+        words[_MAC] = mac
+        words[_PID] = os.getpid()
+        words[_PIPES] = num_pipes
+        words[_MAGIC] = STATS_MAGIC
+        return segment
+
+    @classmethod
+    def attach(cls, name: str) -> 'StatsSegment':
+        """
+        Opens a segment created by some other process
+
+        Args:
+            name: Segment name, from segment_name() or list_segments()
+
+        Raises:
+            FileNotFoundError: No such segment
+            ValueError: The segment doesn't hold radio stats
+
+        Returns:
+            StatsSegment
+        """
+        shm = shared_memory.SharedMemory(name)
+        segment = cls(shm, owner=False)
+        valid = segment._words.size >= HEADER_WORDS and segment._words[_MAGIC] == STATS_MAGIC
+
+        # -----------------------------------------------------------------
+        # Before Python 3.13, attaching registers the segment with this
+        # process's resource tracker, which would unlink it from under the
+        # publisher when this process exits. A segment this process created
+        # is already registered, and the publisher's unlink unregisters it.
+        # -----------------------------------------------------------------
+        if not valid or segment._words[_PID] != os.getpid():
+            resource_tracker.unregister('/' + shm.name, "shared_memory")
+
+        if not valid:
+            segment.close()
+            raise ValueError("{} does not hold radio stats".format(name))
+        return segment
+
+    def write(self, stats: RadioStats) -> None:
+        """
+        Publishes a stats snapshot. Must only be called from one thread at a time.
+
+        Args:
+            stats: Snapshot from the radio
+
+        Returns:
+            None
+        """
+        words = self._words
+        num_pipes = int(words[_PIPES])
+        counters = [value for row in zip(*(x[1:] for x in stats.pipes)) for value in row]
+
+        words[_SEQUENCE] += 1
+        words[_UPDATED_NS] = time.time_ns()
+        words[_TX_FIFO] = stats.tx_fifo_depth if stats.tx_fifo_depth is not None else -1
+        words[_RX_FIFO] = stats.rx_fifo_depth if stats.rx_fifo_depth is not None else -1
+        words[_RTT_P50] = int(stats.rtt.percentile(50) * 1e6)
+        words[_RTT_P99] = int(stats.rtt.percentile(99) * 1e6)
+        words[_PUMP_P99] = int(stats.pump.percentile(99) * 1e6)
+        words[HEADER_WORDS:HEADER_WORDS + NUM_COUNTERS * num_pipes] = counters
+        words[_SEQUENCE] += 1
+
+    def read(self, attempts: int = 100) -> Optional[StatsSample]:
+        """
+        Reads the segment without blocking the publisher
+
+        Args:
+            attempts: Times to retry when the publisher is mid write
+
+        Returns:
+            StatsSample, or None if no consistent copy could be taken
+        """
+        words = self._words
+        for _ in range(attempts):
+            sequence = int(words[_SEQUENCE])
+            if sequence & 1:
+                continue
+
+            copy = words.copy()
+            if int(words[_SEQUENCE]) == sequence:
+                return _to_sample(copy)
+
+        return None
+
+    def close(self) -> None:
+        """
+        Detaches from the segment, and removes it if this process created it
+        Returns:
+            None
+        """
+        # The array must let go of the buffer before the mapping can close
+        self._words = None
+        self._shm.close()
+        if self._owner:
+            try:
+                self._shm.unlink()
+            except FileNotFoundError:
+                pass
+
+
+def _to_sample(words: np.ndarray) -> StatsSample:
+    num_pipes = int(words[_PIPES])
+    rows = words[HEADER_WORDS:HEADER_WORDS + NUM_COUNTERS * num_pipes].reshape(NUM_COUNTERS, num_pipes).tolist()
+    pipes = [PipeStats(pipe, *(row[pipe] for row in rows)) for pipe in range(num_pipes)]
+    depth = [int(words[x]) if words[x] >= 0 else None for x in (_TX_FIFO, _RX_FIFO)]
+    return StatsSample(int(words[_MAC]), int(words[_PID]), int(words[_UPDATED_NS]) / 1e9, depth[0], depth[1],
+                       int(words[_RTT_P50]) / 1e6, int(words[_RTT_P99]) / 1e6, int(words[_PUMP_P99]) / 1e6, pipes)
+
+
+class StatsPublisher(Thread):
+    """
+    Background thread that copies the stats of a set of radios into shared
+    memory on a fixed period. Radios are only ever read through stats(), so
+    publishing costs the pumps nothing.
+    """
+
+    def __init__(self, radios: Iterable = (), interval: float = 0.25):
+        """
+        Args:
+            radios: Radios to publish, which must have their MAC address set
+            interval: Seconds between publishes
+        """
+        Thread.__init__(self, daemon=True)
+        self.interval = interval
+        self._segments = {}     # type: Dict[object, StatsSegment]
+        self._lock = Lock()
+        self._kill_switch = Event()
+
+        for radio in radios:
+            self.add(radio)
+
+    def add(self, radio) -> None:
+        """
+        Starts publishing a radio's stats
+
+        Args:
+            radio: Radio with its MAC address set
+
+        Returns:
+            None
+        """
+        with self._lock:
+            if radio not in self._segments:
+                segment = StatsSegment.create(radio.mac_address, radio.total_pipes())
+                segment.write(radio.stats())
+                self._segments[radio] = segment
+
+    def remove(self, radio) -> None:
+        """
+        Stops publishing a radio's stats and removes its segment
+
+        Args:
+            radio: Radio given to add()
+
+        Returns:
+            None
+        """
+        with self._lock:
+            segment = self._segments.pop(radio, None)
+            if segment is not None:
+                segment.close()
+
+    def publish(self) -> None:
+        """
+        Writes the current stats of every radio
+        Returns:
+            None
+        """
+        with self._lock:
+            for radio, segment in self._segments.items():
+                segment.write(radio.stats())
+
+    def run(self) -> None:
+        while not self._kill_switch.wait(self.interval):
+            self.publish()
+
+    def close(self) -> None:
+        """
+        Stops the thread and removes every segment
+        Returns:
+            None
+        """
+        self._kill_switch.set()
+        if self.is_alive():
+            self.join()
+        with self._lock:
+            for segment in self._segments.values():
+                segment.close()
+            self._segments.clear()
+
+
+# ---------------------------------------------
+# Monitor
+# ---------------------------------------------
+def format_top(previous: Dict[int, StatsSample], current: Dict[int, StatsSample], show_pipes: bool = True) -> str:
+    """
+    Renders one screen of the monitor. Rates are worked out between two reads
+    of each radio, using the publish times.
+
+    Args:
+        previous: Last read of each radio, keyed by MAC address
+        current: Latest read of each radio, keyed by MAC address
+        show_pipes: Whether to break each radio down by pipe
+
+    Returns:
+        Printable table
+    """
+    lines = ["{:>12s} {:>7s} {:>9s} {:>9s} {:>8s} {:>8s} {:>6s} {:>5s} {:>9s} {:>9s}".format(
+        "device", "pid", "tx/s", "rx/s", "retry/s", "fail/s", "ack%", "fifo", "rtt p50", "rtt p99")]
+
+    def rates(old: Optional[PipeStats], new: PipeStats, elapsed: float) -> List[float]:
+        if old is None or elapsed <= 0:
+            return [0.0] * 4
+        return [(new.tx_frames - old.tx_frames) / elapsed, (new.rx_frames - old.rx_frames) / elapsed,
+                (new.retransmits - old.retransmits) / elapsed, (new.ack_timeouts - old.ack_timeouts) / elapsed]
+
+    for mac in sorted(current):
+        sample = current[mac]
+        old = previous.get(mac)
+        elapsed = sample.updated - old.updated if old is not None else 0.0
+
+        total = _sum_pipes(sample.pipes)
+        tx, rx, retry, fail = rates(_sum_pipes(old.pipes) if old is not None else None, total, elapsed)
+        fifo = "{}/{}".format(*("-" if x is None else x for x in (sample.tx_fifo_depth, sample.rx_fifo_depth)))
+        lines.append("{:>12s} {:7d} {:9.1f} {:9.1f} {:8.1f} {:8.1f} {:6.1%} {:>5s} {:7.0f}us {:7.0f}us".format(
+            hex(mac), sample.pid, tx, rx, retry, fail, total.ack_success_rate, fifo, sample.rtt_p50 * 1e6,
+            sample.rtt_p99 * 1e6))
+
+        if not show_pipes:
+            continue
+
+        for pipe in sample.pipes:
+            old_pipe = old.pipes[pipe.pipe] if old is not None else None
+            tx, rx, retry, fail = rates(old_pipe, pipe, elapsed)
+            if pipe.tx_frames or pipe.rx_frames:
+                lines.append("{:>12s} {:>7s} {:9.1f} {:9.1f} {:8.1f} {:8.1f} {:6.1%}".format(
+                    "pipe {}".format(pipe.pipe), "", tx, rx, retry, fail, pipe.ack_success_rate))
+
+    return "\n".join(lines)
+
+
+def _sum_pipes(pipes: List[PipeStats]) -> PipeStats:
+    return PipeStats(-1, *(sum(column) for column in zip(*(x[1:] for x in pipes))))
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Live view of the stats published by every radio on this machine")
+    parser.add_argument("devices", nargs="*", metavar="MAC",
+                        help="Radios to show, in hex. Defaults to every one found in {}.".format(_SHM_DIR))
+    parser.add_argument("--interval", "-i", type=float, default=1.0, help="Seconds between refreshes (default 1.0)")
+    parser.add_argument("--count", "-n", type=int, default=0, help="Refreshes before exiting, 0 to run until killed")
+    parser.add_argument("--no-pipes", action="store_true", help="Only show totals for each radio")
+    args = parser.parse_args()
+
+    segments = {}   # type: Dict[str, StatsSegment]
+    previous = {}   # type: Dict[int, StatsSample]
+    refreshes = 0
+    try:
+        while not args.count or refreshes < args.count:
+            names = [segment_name(int(x, 16)) for x in args.devices] if args.devices else list_segments()
+
+            # Pick up radios that came up since the last refresh, and forget the ones that went away
+            current = {}
+            for name in names:
+                try:
+                    segment = segments.get(name) or StatsSegment.attach(name)
+                except (FileNotFoundError, ValueError):
+                    continue
+
+                segments[name] = segment
+                sample = segment.read()
+                if sample is not None:
+                    current[sample.mac] = sample
+
+            for name in [x for x in segments if x not in names]:
+                segments.pop(name).close()
+
+            if sys.stdout.isatty():
+                print("\x1b[H\x1b[2J", end="")
+            print(time.strftime("%H:%M:%S"), "{} radio(s)".format(len(current)))
+            print(format_top(previous, current, not args.no_pipes))
+            sys.stdout.flush()
+
+            previous = current
+            refreshes += 1
+            if not args.count or refreshes < args.count:
+                time.sleep(args.interval)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for segment in segments.values():
+            segment.close()
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -13,6 +13,7 @@ from pathlib import Path
 
 from binascii import hexlify
 from frame_packager import PackedFrame
+from ipc_utils import pipe_address
 
 # ---------------------------------------------
 # NRF24 radio hardware addresses. Ordering is
@@ -21,30 +22,13 @@ from frame_packager import PackedFrame
 srcMAC = 0xA4A5A6A7A0
 dstMAC = 0xB4B5B6B7B5
 
-# ---------------------------------------------
-# Address modifiers for pipes. Must match code.
-# ---------------------------------------------
-EndpointAddressModifiers = {
-    0xCA,   # DEVICE CONTROL
-    0xC5,   # NETWORK_SERVICES
-    0x54,   # DATA FORWARDING
-    0xB3,   # APPLICATION DATA 0
-    0xD3    # APPLICATION DATA 1
-  }
-
 
 def gen_ipc_path_for_rx_pipe(base_mac, pipe) -> Path:
     """
     Builds a path that should represent some RX pipe
     """
     base_path = Path("/tmp/ripple_ipc/rx_endpoint")
-    if pipe == 0:
-        ipc_path = Path(base_path, str(int(base_mac)) + ".ipc")
-    else:
-        masked_mac = (base_mac & ~0xFF) | EndpointAddressModifiers[pipe]
-        ipc_path = Path(base_path, str(int(masked_mac)) + ".ipc")
-
-    return ipc_path
+    return Path(base_path, str(pipe_address(base_mac, pipe)) + ".ipc")
 
 
 def gen_ipc_path_for_tx_pipe(mac) -> Path:
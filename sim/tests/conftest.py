@@ -0,0 +1,15 @@
+# **********************************************************************************************************************
+#   FileName:
+#       conftest.py
+#
+#   Description:
+#       Puts the simulator modules on the import path, as they import each other by bare name
+#
+#   2021 | Brandon Braun | brandonbraun653@gmail.com
+# **********************************************************************************************************************
+
+import sys
+
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
@@ -0,0 +1,34 @@
+# **********************************************************************************************************************
+#   FileName:
+#       test_fragmentation.py
+#
+#   Description:
+#       Tests for reassembling fragmented messages
+#
+#   2021 | Brandon Braun | brandonbraun653@gmail.com
+# **********************************************************************************************************************
+
+from fragmentation import Reassembler, fragment
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def test_abandoned_message_does_not_merge_into_next():
+    clock = FakeClock()
+    reassembler = Reassembler(timeout=1.0, check_sequence=False, clock=clock)
+
+    # Only the first two fragments of a message make it before the sender gives up
+    abandoned = list(fragment(b'A' * 100))
+    assert reassembler.push(abandoned[0]) is None
+    assert reassembler.push(abandoned[1]) is None
+
+    clock.now += 10.0
+    assert reassembler.push(next(fragment(b'B' * 10))) == b'B' * 10
+    assert reassembler.dropped == 1
+    assert len(reassembler) == 0
@@ -8,16 +8,26 @@
 #   2/27/21 | Brandon Braun | brandonbraun653@gmail.com
 # **********************************************************************************************************************
 
+import heapq
 import time
 import zmq
-import shockburst_pb2
 
+from collections import deque
 from enum import Enum
-from threading import Thread, RLock, Event
-from multiprocessing import Queue
-from ipc_utils import gen_ipc_path, gen_ipc_path_for_tx_pipe
+from typing import Callable, Dict, List, Optional, Tuple, Union
+from threading import Thread, Lock, Event
+from hw_fifo import HardwareFifo, OverflowPolicy
+from ipc_utils import NRF24_ADDRESS_ENDIAN, NRF24_ADDRESS_WIDTH, TRANSPORT_IPC, NodeAddresses, resolve
 from frame_interface import BaseFrame, RxFifoEntry
-from frame_packager import PackedFrame
+from frame_packager import PackedFrame, FrameView
+from arq import ArqMode, ArqSender, ArqReceiver
+from capture import CaptureRing, Direction
+from channel import ChannelMap
+from medium import SharedMedium, Transmission
+from metrics import RadioMetrics, RadioStats
+from phy import PhyTiming
+from pipe_registry import PipeRegistry
+from wire_format import COMPACT_MAGIC, PROTOBUF_TAG, Envelope, WireFormat, decode_parts, encode_parts
 from network_frames import *
 
 
@@ -29,31 +39,179 @@ class FrameType(Enum):
     USER_DATA = 3
 
 
-class ShockBurstRadio(Thread):
-    TOPIC_DATA = b'packet'
-    TOPIC_SHOCKBURST = b'shockburst'
+# -----------------------------------------------------------------------------
+# Every frame a virtual radio sends goes out behind a topic part of the
+# destination's root MAC followed by the frame type. RX sockets subscribe to
+# their own MAC, so libzmq drops frames for other devices, such as the ACKs
+# for every sender on a reply channel, without them ever being decoded. Where
+# the publisher is told the subscriptions, they aren't even sent.
+#
+# The embedded code sends its envelopes without a topic, so RX sockets also
+# subscribe to the first byte of either envelope. A topic that happens to
+# start with one of those bytes gets through too, and is checked in Python.
+# -----------------------------------------------------------------------------
+TOPIC_SIZE = NRF24_ADDRESS_WIDTH + 1
+UNTOPICED_PREFIXES = (bytes((PROTOBUF_TAG,)), bytes((COMPACT_MAGIC,)))
+
+
+def frame_topic(mac: int, frame_type: FrameType = None) -> bytes:
+    """
+    Args:
+        mac: Root MAC address of the destination device
+        frame_type: Type of frame, or None for every type
+
+    Returns:
+        ZMQ topic that frames for the device are sent under, or subscribed to with
+    """
+    topic = mac.to_bytes(NRF24_ADDRESS_WIDTH, NRF24_ADDRESS_ENDIAN)
+    return topic + bytes((frame_type.value,)) if frame_type is not None else topic
+
+
+def group_topic(group: int) -> bytes:
+    """
+    Returns:
+        ZMQ subscription topic that multicast frames to a group are sent under
+    """
+    return group.to_bytes(NRF24_ADDRESS_WIDTH, NRF24_ADDRESS_ENDIAN)
 
-    def __init__(self):
-        super().__init__()
+
+class ShockBurstRadioBase:
+    """
+    Pipe addressing, framing and ARQ handling shared by every flavor of virtual
+    radio. Subclasses provide the FIFOs and the message pump that drives this.
+    """
+    # Index of the multicast socket in rxPipe, just past the pipes
+    MULTICAST_RX = 6
+
+    # Upper bound on how long the pump sleeps without any socket activity.
+    # Only acts as a safety net, as the pump is woken whenever it has work.
+    PUMP_IDLE_TIMEOUT_MS = 100
+
+    # Seconds to wait for an ACK before resending, without the phy model
+    DEFAULT_RETRANSMIT_TIMEOUT = 0.25
+
+    def __init__(self, context: zmq.Context, transport: str = TRANSPORT_IPC, verbose: bool = True,
+                 arq_mode: ArqMode = ArqMode.SELECTIVE_REPEAT, arq_window: int = 8,
+                 retransmit_timeout: float = None, max_retries: int = 15,
+                 pipe_cache_size: int = PipeRegistry.DEFAULT_CAPACITY,
+                 wire_format: WireFormat = WireFormat.PROTOBUF,
+                 clock: Callable[[], float] = time.monotonic, phy: PhyTiming = None,
+                 channel: ChannelMap = None, medium: SharedMedium = None, rf_channel: int = 0,
+                 recorder: CaptureRing = None):
+        """
+        Args:
+            context: ZMQ context used to create all of the pipe sockets
+            transport: ZMQ transport the pipes use. TRANSPORT_INPROC only reaches
+                radios that share the same context.
+            verbose: Whether to print pipe setup messages
+            arq_mode: Retransmission strategy for frames that require an ACK.
+                Must match the mode used by the other nodes.
+            arq_window: Max number of unacknowledged frames in flight
+            retransmit_timeout: Seconds to wait for an ACK before resending a frame. None
+                waits as long as the hardware would with the phy model, which is
+                the ACK wait plus the auto retransmit delay, or 0.25 s without it.
+            max_retries: Resends allowed before a frame is reported as failed
+            pipe_cache_size: Max number of sockets kept connected to other devices
+            wire_format: Envelope for outgoing frames. Frames of either format are
+                accepted, and once a device is heard from, frames sent to it use
+                whichever format it spoke last. COMPACT should only be configured
+                where every peer is simulated.
+            clock: Time source for the ARQ timers, in seconds. A virtual clock
+                needs something that advances it to drive the pump, such as
+                the DiscreteEventSimulator.
+            phy: Air time model of the radio. When given, frames are sent one at
+                a time and each arrives once its time on the air is over. None
+                delivers frames as fast as ZMQ can move them.
+            channel: Impairments on the links to other devices, usually shared by
+                every radio in the network. Applied to frames and ACKs on their
+                way out. None makes every link perfect.
+            medium: RF medium shared with the other radios. Packets, ACKs included,
+                that overlap on the air with another on the same RF channel are
+                lost. Needs the phy model. None lets every radio talk at once.
+            rf_channel: RF channel the radio is tuned to on the medium
+            recorder: Capture file every frame sent or received is logged to. May
+                be shared by many radios.
+        """
         self.mac_address = 0
+        self.clock = clock
+        self.addresses = None   # type: Optional[NodeAddresses]
+        self._rxTopic = frame_topic(0)
+        self.transport = transport
+        self.verbose = verbose
+        self.wire_format = wire_format
+        self._peerFormats = {}  # type: Dict[int, WireFormat]
+        self.metrics = RadioMetrics(self.total_pipes())
 
         # ---------------------------------------------------------------------
         # Create pub/sub sockets for all pipes. Only pipe 0 is used for actual
         # data transmission. Pipes 1-5 are used to mimic ShockBurst functions
         # like auto-ack or ack-payloads without getting in the way of pipe 0.
         # ---------------------------------------------------------------------
-        self.context = zmq.Context()
+        self.context = context
         self.txPipe = [self.context.socket(zmq.PUB) for x in range(self.total_pipes())]
         self.rxPipe = [self.context.socket(zmq.SUB) for x in range(self.total_pipes())]
 
+        # ---------------------------------------------------------------------
+        # Multicast. Frames flagged as multicast are published once on the
+        # multicast pipe, which is connected to every device in range, and
+        # libzmq filters them out before they reach devices that haven't
+        # joined the group. The receiving socket sits after the pipes in
+        # rxPipe so that every pump polls it.
+        # ---------------------------------------------------------------------
+        self.mcastPipe = self.context.socket(zmq.PUB)
+        self.rxPipe.append(self.context.socket(zmq.SUB))
+        self._txGroup = None                # type: Optional[bytes]
+        self._groups = {}                   # type: Dict[bytes, int]
+        self._multicastPeers = set()
+
+        # ---------------------------------------------------------------------
+        # Sockets connected to the RX pipes of other devices. Data goes out on
+        # the one selected with open_tx_pipe() and ACKs go straight back to the
+        # sender's pipe 0, without reconnecting for every frame.
+        # ---------------------------------------------------------------------
+        self.pipeRegistry = PipeRegistry(self.context, transport, pipe_cache_size)
+        self._txTarget = None               # type: Optional[Tuple[int, int]]
+        self._replySubscriptions = set()
+
         # ---------------------------------------------
-        # Internal multi-threading utilities
+        # Sliding window retransmission state
         # ---------------------------------------------
-        self._txQueue = Queue()
-        self._txLock = RLock()
-        self._rxQueue = Queue()
-        self._rxLock = RLock()
-        self._kill_switch = Event()
+        self._arq_mode = arq_mode
+        self._arq_window = arq_window
+        if retransmit_timeout is None:
+            retransmit_timeout = self.DEFAULT_RETRANSMIT_TIMEOUT
+            if phy is not None:
+                retransmit_timeout = phy.frame_time() + phy.ack_time() + phy.retransmit_delay
+        self._retransmit_timeout = retransmit_timeout
+        self._max_retries = max_retries
+        self._arqTx = {None: self._new_arq_sender()}   # (dst MAC, pipe) -> ArqSender
+        self._arqRx = {}                                # (pipe, sender MAC) -> ArqReceiver
+        self._ackFrames = {}                            # (sender MAC, pipe) -> ACKFrame
+
+        # ---------------------------------------------------------------------
+        # Transmitter state for the PHY timing model. Only one frame is on the
+        # air at a time, and the transmitter stays busy through any ACK.
+        # ---------------------------------------------------------------------
+        self.phy = phy
+        self._onAir = None          # (arrival time, target, frame, packet on the medium) of the frame being sent
+        self._txFreeAt = None       # type: Optional[float]
+        self._txRetries = deque()   # Frames waiting on the transmitter to be resent
+
+        # ---------------------------------------------
+        # Frames held back by the channel model
+        # ---------------------------------------------
+        self.channel = channel
+        self._delayed = []          # type: List[Tuple[float, int, zmq.Socket, List[bytes], Optional[Transmission]]]
+        self._delayedCount = 0
+
+        # ---------------------------------------------
+        # Contention with the other radios
+        # ---------------------------------------------
+        assert(medium is None or phy is not None)
+        self.medium = medium
+        self.rf_channel = rf_channel
+
+        self.recorder = recorder
 
     @staticmethod
     def available_tx_pipes():
@@ -67,10 +225,7 @@ class ShockBurstRadio(Thread):
     def total_pipes():
         return 6
 
-    def kill(self) -> None:
-        self._kill_switch.set()
-
-    def open_tx_pipe(self, dst_mac: int, pipe: int) -> None:
+    def open_tx_pipe(self, dst_mac: int, pipe: int, transport: str = None) -> None:
         """
         Opens a TX pipe to an RX pipe on a given MAC address. Also opens
         RX pipe 0 for receiving any ACKS or additional data.
@@ -78,28 +233,46 @@ class ShockBurstRadio(Thread):
         Args:
             dst_mac: Address to open the pipe to
             pipe: Which pipe to write to on the destination. Should be 1-5.
+            transport: Transport to reach the destination over. Defaults to the radio's own.
         """
+        if transport is not None:
+            self.pipeRegistry.set_route(dst_mac, transport)
+        transport = self.pipeRegistry.route(dst_mac)
+
         # ---------------------------------------------------------------------
-        # Figure out the address of the RX pipe on the destination device, then
-        # instruct Pipe 0 publisher to open a connection to it. If that RX pipe
-        # exists, it will have attempted to connect to the publisher already.
+        # Point pipe 0 at the RX pipe on the destination device. The registry
+        # reuses the connection if this destination was opened before. The RX
+        # pipe binds to that address when the destination sets its MAC. The
+        # socket is pinned, as one evicted and reconnected by ACK traffic to
+        # other devices would silently drop frames until it rejoined.
         # ---------------------------------------------------------------------
-        tx_ipc_path = gen_ipc_path(dst_mac, pipe)
-        tx_url = "ipc://" + str(tx_ipc_path)
-        self.txPipe[0].connect(tx_url)
-        print("TX pipe 0 connected to device {} pipe {}. IPC address: {}".format(hex(dst_mac), pipe, tx_url))
+        if self._txTarget is not None:
+            self.pipeRegistry.unpin(*self._txTarget)
+        self.pipeRegistry.pin(dst_mac, pipe)
+        self._txTarget = (dst_mac, pipe)
+
+        # Each destination keeps its own sequence numbers, so switching between them is seamless
+        if self._txTarget not in self._arqTx:
+            self._arqTx[self._txTarget] = self._new_arq_sender()
+        if self.verbose:
+            tx_url = resolve(dst_mac).rx_url(pipe, transport)
+            print("TX pipe 0 connected to device {} pipe {}. Address: {}".format(hex(dst_mac), pipe, tx_url))
 
         # ---------------------------------------------------------------------
         # Set up pipe 0 RX socket to subscribe to messages from the destination
         # device's pipe <x> TX socket. This will allow us to receive ShockBurst
         # messages in reply should they be needed.
         # ---------------------------------------------------------------------
-        rx_ipc_path = gen_ipc_path(dst_mac, pipe)
-        rx_url = "ipc://" + str(rx_ipc_path)
+        rx_url = resolve(dst_mac).tx_url(pipe, transport)
+        if rx_url in self._replySubscriptions:
+            return
+
+        self._replySubscriptions.add(rx_url)
         self.rxPipe[0].connect(rx_url)
-        print("RX pipe 0 listen to device {} pipe {}. IPC address: {}".format(hex(dst_mac), pipe, rx_url))
+        if self.verbose:
+            print("RX pipe 0 listen to device {} pipe {}. Address: {}".format(hex(dst_mac), pipe, rx_url))
 
-    def set_device_mac(self, mac: int) -> None:
+    def set_device_mac(self, mac: int, transports: Tuple[str, ...] = None) -> None:
         """
         Opens up the root RX pipe with the given mac and then opens the
         remaining pipes following the NRF24L01 addressing scheme. Assumes
@@ -111,125 +284,866 @@ class ShockBurstRadio(Thread):
 
         Args:
             mac: Root MAC address
+            transports: Every transport the pipes should be reachable over.
+                Defaults to just the radio's own.
         """
-        rx_ipc_paths = [gen_ipc_path(mac, x) for x in range(self.total_pipes())]
+        self.mac_address = mac
+        self.addresses = resolve(mac)
+        self._rxTopic = frame_topic(mac)
+        transports = transports if transports is not None else (self.transport,)
 
-        idx = 0
-        for path in rx_ipc_paths:
-            url = "ipc://" + str(path)
-            self.rxPipe[idx].connect(url)
-            self.rxPipe[idx].set(zmq.SUBSCRIBE, b'')
-            #self.rxPipe[idx].set(zmq.SUBSCRIBE, self.TOPIC_DATA)
-            #self.rxPipe[idx].set(zmq.SUBSCRIBE, self.TOPIC_SHOCKBURST)
-            print("RX pipe {} on device {} is listening on {}".format(idx, hex(mac), url))
-            idx += 1
+        for idx in range(self.total_pipes()):
+            urls = [self.addresses.rx_url(idx, transport) for transport in transports]
+            for url in urls:
+                self.rxPipe[idx].bind(url)
 
-    def transmit(self, data: bytearray) -> None:
-        with self._txLock:
-            self._txQueue.put(data)
+            self.rxPipe[idx].set(zmq.SUBSCRIBE, frame_topic(mac))
+            for prefix in UNTOPICED_PREFIXES:
+                self.rxPipe[idx].set(zmq.SUBSCRIBE, prefix)
+            if self.verbose:
+                print("RX pipe {} on device {} is listening on {}".format(idx, hex(mac), ", ".join(urls)))
 
-    def receive(self, block, timeout) -> RxFifoEntry:
-        with self._rxLock:
-            return self._rxQueue.get(block=block, timeout=timeout)
+            # -----------------------------------------------------------------
+            # TX side of pipes 1-5 publishes replies, like ACKs, back to anyone
+            # that opened a TX pipe to this device.
+            # -----------------------------------------------------------------
+            if idx != 0:
+                for transport in transports:
+                    self.txPipe[idx].bind(self.addresses.tx_url(idx, transport))
 
-    def run(self) -> None:
+        for transport in transports:
+            self.rxPipe[self.MULTICAST_RX].bind(self.addresses.mcast_url(transport))
+
+    def add_multicast_peer(self, dst_mac: int, transport: str = None) -> None:
         """
-        Main message pump that acts as the hardware transceiver in the NRF24L01
+        Puts another device in multicast range, so that it hears any multicast
+        frames sent to the groups it has joined
+
+        Args:
+            dst_mac: Device to reach
+            transport: Transport to reach the device over. Defaults to its route.
         """
-        process_period = 0.1
-        print("Starting ShockBurst processing")
-        time.sleep(0.5)
+        url = resolve(dst_mac).mcast_url(transport if transport is not None else self.pipeRegistry.route(dst_mac))
+        if url not in self._multicastPeers:
+            self._multicastPeers.add(url)
+            self.mcastPipe.connect(url)
 
-        while not self._kill_switch.is_set():
-            # Pump messages through the "transceiver"
-            time.sleep(process_period)
-            self._enqueue_rx_pipes()
-            self._dequeue_tx_pipes()
+    def join_group(self, group: int, pipe: int) -> None:
+        """
+        Starts receiving the frames multicast to a group. Frames sent to groups
+        that haven't been joined are dropped by ZMQ before the radio sees them.
 
-        print("Killing ShockBurst thread")
+        Args:
+            group: Address of the group
+            pipe: Pipe to deliver the group's frames on
+        """
+        assert(0 <= pipe < self.total_pipes())
+        topic = group_topic(group)
+        if topic not in self._groups:
+            self.rxPipe[self.MULTICAST_RX].set(zmq.SUBSCRIBE, topic)
+        self._groups[topic] = pipe
+
+    def leave_group(self, group: int) -> None:
+        """
+        Stops receiving the frames multicast to a group
+
+        Args:
+            group: Address of the group
+        """
+        topic = group_topic(group)
+        if self._groups.pop(topic, None) is not None:
+            self.rxPipe[self.MULTICAST_RX].set(zmq.UNSUBSCRIBE, topic)
+
+    def open_multicast_group(self, group: int) -> None:
+        """
+        Selects the group that frames with the multicast flag set are sent to.
+        They go out once, aren't ACK'd and skip the ARQ window.
+
+        Args:
+            group: Address of the group
+        """
+        self._txGroup = group_topic(group)
+
+    def _close_pipes(self) -> None:
+        """
+        Closes every socket the radio owns
+        Returns:
+            None
+        """
+        for pipe in self.txPipe + self.rxPipe + [self.mcastPipe]:
+            pipe.close(linger=0)
+        self.pipeRegistry.close()
+
+    def tx_target(self) -> Optional[Tuple[int, int]]:
+        """
+        Returns:
+            Destination MAC and pipe the TX pipe was last opened to, or None if it
+            hasn't been opened
+        """
+        return self._txTarget
+
+    def stats(self) -> RadioStats:
+        """
+        Takes a snapshot of the radio's counters and latency histograms. Safe to
+        call from any thread while the pump runs.
+        Returns:
+            RadioStats
+        """
+        tx_depth, rx_depth = self._fifo_depths()
+        return self.metrics.snapshot(self.mac_address, tx_depth, rx_depth)
+
+    def _new_arq_sender(self) -> ArqSender:
+        return ArqSender(self._arq_mode, self._arq_window, self._retransmit_timeout, self._max_retries, self.clock,
+                         on_rtt=self.metrics.rtt.record)
+
+    def _frames_in_flight(self) -> int:
+        return sum(len(sender) for sender in self._arqTx.values())
+
+    def _tx_socket(self, target: Optional[Tuple[int, int]]) -> zmq.Socket:
+        """
+        Args:
+            target: Destination MAC and pipe, as given to open_tx_pipe()
+
+        Returns:
+            Socket connected to the destination. Before any destination is opened
+            this is TX pipe 0, which isn't connected to anything.
+        """
+        if target is None:
+            return self.txPipe[0]
+        return self.pipeRegistry.get(*target)
 
-    def _enqueue_rx_pipes(self) -> None:
+    def _on_tx_queued(self) -> None:
         """
-        Enqueues all data that may be present in the RX pipes
+        Called after a frame is queued up for transmission, from whichever thread
+        queued it, so the pump knows it has TX work
         Returns:
             None
         """
-        with self._rxLock:
+        pass
 
-            for pipe in range(len(self.rxPipe)):
+    def _pop_tx_data(self) -> Union[bytearray, bytes, memoryview, None]:
+        """
+        Takes the next packed frame out of the TX FIFO without blocking
+        Returns:
+            Packed frame, or None if the FIFO is empty
+        """
+        raise NotImplementedError
+
+    def _rx_room(self) -> Optional[int]:
+        """
+        Returns:
+            Number of frames the RX FIFO can still accept if full frames must be
+            refused without an ACK, otherwise None.
+        """
+        raise NotImplementedError
+
+    def _deliver_rx(self, entry: RxFifoEntry) -> bool:
+        """
+        Pushes a received frame into the RX FIFO
+
+        Args:
+            entry: Received frame and the pipe it arrived on
+
+        Returns:
+            True if the frame was stored, False if it was dropped
+        """
+        raise NotImplementedError
+
+    def _fifo_depths(self) -> Tuple[Optional[int], Optional[int]]:
+        """
+        Returns:
+            Number of frames in the TX and RX FIFOs, None for either if unknown
+        """
+        return None, None
+
+    def _service_pipes(self, ready: dict) -> None:
+        """
+        Runs one pass of the pump over every pipe, timing how long it takes
+
+        Args:
+            ready: Socket events returned from zmq.Poller.poll()
+
+        Returns:
+            None
+        """
+        start_time = time.perf_counter()
+        self._enqueue_rx_pipes(ready)
+        self._dequeue_tx_pipes()
+        self.metrics.pump.record(time.perf_counter() - start_time)
+
+    def _count_rx(self, pipe: int, entry: RxFifoEntry, size: int) -> None:
+        """
+        Delivers a received frame, counting whether it made it into the RX FIFO
+        """
+        if self._deliver_rx(entry):
+            self.metrics.rx_frames[pipe] += 1
+            self.metrics.rx_bytes[pipe] += size
+        else:
+            self.metrics.rx_dropped[pipe] += 1
+
+    def _recv_nowait(self, pipe: int) -> List[zmq.Frame]:
+        """
+        Reads the next message waiting on an RX pipe as zmq.Frames, whose buffers
+        are handed to the decoder as they are. Frames are far below
+        zmq.COPY_THRESHOLD, so this saves no meaningful copy over copy=True and
+        only pays off for much larger messages.
+
+        Args:
+            pipe: Pipe to read from
+
+        Raises:
+            zmq.Again: Nothing is waiting
+
+        Returns:
+            Message parts
+        """
+        return self.rxPipe[pipe].recv_multipart(flags=zmq.DONTWAIT, copy=False)
+
+    def _enqueue_rx_pipes(self, ready: dict) -> None:
+        """
+        Enqueues all data that is present in the RX pipes reported as ready
+        by the poller. Each ready pipe is drained completely.
+
+        Args:
+            ready: Socket events returned from zmq.Poller.poll()
+
+        Returns:
+            None
+        """
+        for pipe in range(len(self.rxPipe)):
+            if self.rxPipe[pipe] not in ready:
+                continue
+
+            multicast = pipe == self.MULTICAST_RX
+            while True:
                 # ---------------------------------------------
-                # Any data available?
+                # Any data left?
                 # ---------------------------------------------
                 try:
-                    data = self.rxPipe[pipe].recv(flags=zmq.DONTWAIT)
-                    if not data:
-                        continue
+                    parts = self._recv_nowait(pipe)
                 except zmq.Again:
-                    continue
+                    break
 
-                pb_frame = shockburst_pb2.ShockBurstFrame()
-                pb_frame.ParseFromString(data)
+                if multicast:
+                    self._process_multicast_frame([part.buffer for part in parts])
+                else:
+                    self._process_rx_frame(pipe, [part.buffer for part in parts])
 
-                # ---------------------------------------------
-                # Enqueue the RX'd frame
-                # ---------------------------------------------
-                frame = PackedFrame()
-                frame.unpack(pb_frame.data)
-                self._rxQueue.put(RxFifoEntry(pipe, frame))
+    def _process_rx_frame(self, pipe: int, parts: List[memoryview]) -> None:
+        """
+        Decodes a single frame received on a pipe, enqueues it for the
+        user and sends out an ACK if one was requested.
 
-                # ---------------------------------------------
-                # If required, transmit an ACK
-                # ---------------------------------------------
-                if frame.requireAck:
-                    ack_frame = shockburst_pb2.ShockBurstFrame()
-                    ack_frame.sender = "abcd"
-                    ack_frame.crc = 0
-                    ack_frame.type = FrameType.ACK_FRAME
-                    ack_frame.frame_id = pb_frame.frame_id
+        Args:
+            pipe: Pipe the frame was received on
+            parts: Buffers of the message parts read from the pipe, starting with
+                the topic unless sent by the embedded code
+
+        Returns:
+            None
+        """
+        # ---------------------------------------------------------------------
+        # An envelope is a single part, or a compact header and frame, so only
+        # a topic is ever a first part of TOPIC_SIZE with more parts behind it
+        # ---------------------------------------------------------------------
+        if len(parts) > 1 and len(parts[0]) == TOPIC_SIZE:
+            if parts[0][:NRF24_ADDRESS_WIDTH] != self._rxTopic:
+                return
+            parts = parts[1:]
+
+        envelope = self._decode(parts)
+        if envelope is None:
+            # Malformed or failed the CRC check, so the "hardware" never saw it
+            return
+
+        sender_mac = envelope.sender
+        self._peerFormats[sender_mac] = envelope.format
+        if self.recorder is not None:
+            self.recorder.append(self.clock(), self.mac_address, sender_mac, pipe, Direction.RX, envelope.type,
+                                 envelope.data)
 
-                    # Need to open a TX pipe to the destination. Pipe registry!!!
-                    self.txPipe[pipe].send(pb_frame.SerializeToString())
+        if envelope.type == FrameType.ACK_FRAME.value:
+            self._process_ack_frame(envelope)
+            return
+
+        # ---------------------------------------------
+        # Frames without an ACK go straight to the user
+        # ---------------------------------------------
+        frame = FrameView(envelope.data)
+        if not frame.requireAck:
+            self._count_rx(pipe, RxFifoEntry(pipe, frame), len(envelope.data))
+            return
+
+        # ---------------------------------------------
+        # Let the ARQ window decide what is delivered
+        # ---------------------------------------------
+        receiver = self._arqRx.get((pipe, sender_mac))
+        if receiver is None:
+            receiver = ArqReceiver(self._arq_mode, self._arq_window,
+                                   resync_timeout=self._retransmit_timeout * (self._max_retries + 1),
+                                   clock=self.clock)
+            self._arqRx[(pipe, sender_mac)] = receiver
+
+        # ---------------------------------------------------------------------
+        # Like the hardware, a frame that doesn't fit in the RX FIFO is dropped
+        # without an ACK so that the sender will retransmit it later. Frames
+        # held back by any ARQ window for reordering count against the space.
+        # ---------------------------------------------------------------------
+        room = self._rx_room()
+        if room is not None:
+            room -= sum(len(x) for x in self._arqRx.values()) - len(receiver)
+
+        ack_seq, delivered = receiver.on_frame(frame, room)
+        for rx_frame in delivered:
+            self._count_rx(pipe, RxFifoEntry(pipe, rx_frame), len(rx_frame.pack()))
+        if ack_seq is None:
+            self.metrics.rx_dropped[pipe] += 1
+
+        # ---------------------------------------------
+        # Transmit the ACK
+        # ---------------------------------------------
+        if ack_seq is not None:
+            ack = self._ackFrames.get((sender_mac, pipe))
+            if ack is None:
+                ack = ACKFrame()
+                ack.destination = sender_mac
+                ack.pipe = pipe
+                self._ackFrames[(sender_mac, pipe)] = ack
+            ack.sequence = ack_seq
+
+            # -----------------------------------------------------------------
+            # Senders listen for ACKs on their pipe 0. Until our socket to it
+            # has joined, fall back to the reply channel the sender subscribed
+            # to when it opened its TX pipe, which every sender hears.
+            # -----------------------------------------------------------------
+            reply_socket = self.pipeRegistry.get(sender_mac, 0)
+            if not self.pipeRegistry.joined(sender_mac, 0):
+                reply_socket = self.txPipe[pipe]
+
+            # The ACK is on the air once the radio has turned around into TX
+            packet = None
+            if self.medium is not None:
+                now = self.clock()
+                packet = self.medium.transmit(self.rf_channel, self.mac_address, now + self.phy.RX_SETTLE,
+                                              now + self.phy.ack_time())
+
+            # The ACK frame is reused, so ZMQ must take its own copy
+            self._send(reply_socket, FrameType.ACK_FRAME, ack.to_bytes(), sender_mac, 0, copy=True, packet=packet)
+            self.metrics.acks_sent[pipe] += 1
+
+    def _process_multicast_frame(self, parts: List[memoryview]) -> None:
+        """
+        Delivers a frame multicast to one of the groups the radio has joined. No
+        ACK is sent back and the ARQ isn't involved.
+
+        Args:
+            parts: Buffers of the message parts, starting with the group topic
+
+        Returns:
+            None
+        """
+        pipe = self._groups.get(bytes(parts[0]))
+        if pipe is None:
+            # Sent before the group was left
+            return
+
+        envelope = self._decode(parts[1:])
+        if envelope is None or envelope.type != FrameType.USER_DATA.value:
+            return
+
+        if self.recorder is not None:
+            self.recorder.append(self.clock(), self.mac_address, envelope.sender, pipe, Direction.RX, envelope.type,
+                                 envelope.data)
+        self._count_rx(pipe, RxFifoEntry(pipe, FrameView(envelope.data)), len(envelope.data))
+
+    def _decode(self, parts: List[memoryview]) -> Optional[Envelope]:
+        """
+        Unwraps a received message. Kept separate so the profiler can time it.
+
+        Args:
+            parts: Buffers of the message parts read from a pipe
+
+        Returns:
+            The decoded message, or None if it is malformed or failed its CRC check
+        """
+        return decode_parts(parts)
+
+    def _process_ack_frame(self, envelope: Envelope) -> None:
+        """
+        Hands an ACK addressed to this device over to the ARQ sender
+
+        Args:
+            envelope: Decoded message carrying the ACK
+
+        Returns:
+            None
+        """
+        ack = ACKFrame()
+        ack.from_bytes(envelope.data)
+
+        if not ack.is_valid() or ack.destination != self.mac_address:
+            return
+
+        sender = self._arqTx.get((envelope.sender, ack.pipe))
+        if sender is not None:
+            self.metrics.acks_received[ack.pipe] += len(sender.on_ack(ack.sequence))
+
+    def _send(self, socket: zmq.Socket, frame_type: FrameType, data: Union[bytearray, memoryview],
+              dst_mac: Optional[int], dst_pipe: int, copy: bool = False, packet: Transmission = None) -> None:
+        """
+        Wraps a packed frame in the envelope that goes out over the pipes and sends it
+
+        Args:
+            socket: Socket to send on
+            frame_type: Type of frame being sent
+            data: Packed frame. Must not change after this call unless copy is set.
+            dst_mac: Device the frame is for, which decides the wire format and topic
+            dst_pipe: Pipe on the device the frame is for
+            copy: Whether ZMQ should copy the data rather than reference it. pyzmq
+                copies anything below zmq.COPY_THRESHOLD regardless, which takes in
+                every frame, so this only matters for larger messages.
+            packet: Transmission on the shared medium that carries the frame. The
+                frame arrives once it's over, and only if it didn't collide.
+
+        Returns:
+            None
+        """
+        wire_format = self._peerFormats.get(dst_mac, self.wire_format)
+        topic = frame_topic(dst_mac or 0, frame_type)
+        frame_id = data[1] & PackedFrame.FRAME_NUMBER_MASK
+        if frame_type == FrameType.USER_DATA:
+            self.metrics.tx_frames[dst_pipe] += 1
+            self.metrics.tx_bytes[dst_pipe] += len(data)
+        if self.recorder is not None:
+            self.recorder.append(self.clock(), self.mac_address, dst_mac or 0, dst_pipe, Direction.TX,
+                                 frame_type.value, data)
+
+        link = None
+        if self.channel is not None and dst_mac is not None:
+            link = self.channel.link(self.mac_address, dst_mac)
+        if link is None and packet is None:
+            parts = encode_parts(wire_format, self.mac_address, frame_type.value, frame_id, data)
+            socket.send_multipart([topic] + parts, copy=copy)
+            return
+
+        # ---------------------------------------------------------------------
+        # Frames that arrive later are held by the radio until it's time. They
+        # are copied, as the caller may reuse the data once this returns.
+        # ---------------------------------------------------------------------
+        now = self.clock()
+        sent = max(now, packet.end) if packet is not None else now
+        for arrival, frame in (link.transmit(data, sent) if link is not None else [(sent, data)]):
+            parts = encode_parts(wire_format, self.mac_address, frame_type.value, frame_id, frame)
+            if arrival > now:
+                heapq.heappush(self._delayed, (arrival, self._delayedCount, socket, [topic] + [bytes(x) for x in parts],
+                                               packet))
+                self._delayedCount += 1
+                self._on_tx_queued()
+            elif packet is None or not packet.collided:
+                socket.send_multipart([topic] + parts, copy=copy)
+
+    def _send_multicast(self, frame: FrameView, packet: Transmission = None) -> None:
+        """
+        Publishes a frame once to the open multicast group, for ZMQ to fan out to
+        its members. Channel models are per link, so they don't apply here.
+
+        Args:
+            frame: Frame to send. Must not change after this call.
+            packet: Transmission on the shared medium that carried the frame
+
+        Returns:
+            None
+        """
+        if self._txGroup is None:
+            if self.verbose:
+                print("No multicast group open, dropping frame")
+            return
+
+        # Multicast frames leave through TX pipe 0, so they're counted there
+        data = frame.pack()
+        self.metrics.tx_frames[0] += 1
+        self.metrics.tx_bytes[0] += len(data)
+        if self.recorder is not None:
+            group = int.from_bytes(self._txGroup, NRF24_ADDRESS_ENDIAN)
+            self.recorder.append(self.clock(), self.mac_address, group, 0, Direction.TX, FrameType.USER_DATA.value,
+                                 data)
+
+        if packet is not None and packet.collided:
+            return
+
+        parts = encode_parts(self.wire_format, self.mac_address, FrameType.USER_DATA.value,
+                             data[1] & PackedFrame.FRAME_NUMBER_MASK, data)
+        self.mcastPipe.send_multipart([self._txGroup] + parts, copy=False)
+
+    def _send_delayed(self) -> None:
+        """
+        Sends every frame held back by the channel model that is due to arrive
+        Returns:
+            None
+        """
+        now = self.clock()
+        while self._delayed and self._delayed[0][0] <= now:
+            _, _, socket, parts, packet = heapq.heappop(self._delayed)
+            if packet is not None and packet.collided:
+                continue
+
+            try:
+                socket.send_multipart(parts)
+            except zmq.ZMQError:
+                # The pipe registry closed the socket in the meantime, so the frame is lost
+                pass
 
     def _dequeue_tx_pipes(self) -> None:
         """
-        Transmits all data available in the TX queue
+        Retransmits any frames whose ACK timed out, then transmits as much of
+        the TX queue as the ARQ window allows.
         Returns:
             None
         """
-        ack_timeout = 5
+        if self._delayed:
+            self._send_delayed()
 
-        with self._txLock:
-            while not self._txQueue.empty():
-                # ---------------------------------------------
-                # Transmit the raw data
-                # ---------------------------------------------
-                next_frame = PackedFrame()
-                next_frame.unpack(self._txQueue.get())
+        # ---------------------------------------------
+        # Resend frames that weren't ACK'd in time
+        # ---------------------------------------------
+        for target, sender in self._arqTx.items():
+            resend, failed = sender.poll_timers()
+            if resend or failed:
+                dst_pipe = target[1] if target is not None else 0
+                self.metrics.retransmits[dst_pipe] += len(resend)
+                self.metrics.ack_timeouts[dst_pipe] += len(failed)
 
-                self.txPipe.send(next_frame.pack())
+            if resend and self.phy is not None:
+                self._txRetries.extend((target, frame) for frame in resend)
+            elif resend:
+                tx_socket = self._tx_socket(target)
+                dst_mac, dst_pipe = target if target is not None else (None, 0)
+                for frame in resend:
+                    self._send(tx_socket, FrameType.USER_DATA, frame.pack(), dst_mac, dst_pipe)
 
-                # ---------------------------------------------
-                # Wait for the ACK if needed
-                # ---------------------------------------------
-                if next_frame.requireAck:
-                    start_time = time.time()
-                    received = False
+            # Notify if transmit failed
+            if failed and self.verbose:
+                print("Failed to receive packet ACK")
+
+        if self.phy is not None:
+            self._run_transmitter()
+            return
+
+        # ---------------------------------------------
+        # Fill up the window with new frames
+        # ---------------------------------------------
+        sender = self._arqTx[self._txTarget]
+        tx_socket = self._tx_socket(self._txTarget)
+        dst_mac, dst_pipe = self._txTarget if self._txTarget is not None else (None, 0)
+        while sender.can_send():
+            next_frame = self._pop_tx_frame(sender)
+            if next_frame is None:
+                break
+
+            if next_frame.multicast:
+                self._send_multicast(next_frame)
+            else:
+                self._send(tx_socket, FrameType.USER_DATA, next_frame.pack(), dst_mac, dst_pipe)
+
+    def _pop_tx_frame(self, sender: ArqSender) -> Optional[FrameView]:
+        """
+        Takes the next frame out of the TX FIFO, starting its ARQ timer if it needs an ACK
+
+        Args:
+            sender: ARQ state of the destination the frame goes to
+
+        Returns:
+            Frame to transmit, or None if the FIFO is empty
+        """
+        data = self._pop_tx_data()
+        if data is None:
+            return None
+
+        next_frame = FrameView(data)
+        if next_frame.requireAck and not next_frame.multicast:
+            # The sequence number is written into the frame, which is also
+            # held for retransmission, so take a private copy of the data.
+            next_frame = FrameView(bytearray(data))
+            sender.send(next_frame)
+        return next_frame
+
+    def _run_transmitter(self) -> None:
+        """
+        Moves frames through the air according to the PHY timing model. A frame
+        reaches its destination when its air time is over, and the next one
+        can't start until the transmitter is done waiting for the ACK. Frames
+        that queue up while the transmitter is busy go out back to back, even
+        if the pump woke up late.
+        Returns:
+            None
+        """
+        now = self.clock()
+        while True:
+            # ---------------------------------------------
+            # Deliver the frame on the air once it lands
+            # ---------------------------------------------
+            if self._onAir is not None:
+                arrival, target, frame, packet = self._onAir
+                if arrival > now:
+                    return
+
+                if frame.multicast:
+                    self._send_multicast(frame, packet)
+                else:
+                    dst_mac, dst_pipe = target if target is not None else (None, 0)
+                    self._send(self._tx_socket(target), FrameType.USER_DATA, frame.pack(), dst_mac, dst_pipe,
+                               packet=packet)
+                self._onAir = None
+
+            if self._txFreeAt is not None and self._txFreeAt > now:
+                return
+
+            # ---------------------------------------------
+            # Start the next attempt, retries first
+            # ---------------------------------------------
+            start = self._txFreeAt if self._txFreeAt is not None else now
+            if self._txRetries:
+                target, frame = self._txRetries.popleft()
+                delay = self.phy.retransmit_delay
+            else:
+                target = self._txTarget
+                sender = self._arqTx[target]
+                frame = self._pop_tx_frame(sender) if sender.can_send() else None
+                delay = 0.0
+
+            if frame is None:
+                self._txFreeAt = None
+                return
 
-                    while (time.time() - start_time) < ack_timeout:
-                        time.sleep(0.01)
-                        try:
-                            ack = ACKFrame()
-                            ack.from_bytes(self.rxPipe[0].recv(flags=zmq.DONTWAIT))
+            on_air = start + delay + self.phy.TX_SETTLE
+            arrival = on_air + self.phy.air_time(len(frame.pack()))
+            self._txFreeAt = arrival + self.phy.ack_time() if frame.requireAck and not frame.multicast else arrival
 
-                            if ack.is_valid():
-                                received = True
-                                break
-                        except zmq.Again:
-                            continue
+            packet = None
+            if self.medium is not None:
+                packet = self.medium.transmit(self.rf_channel, self.mac_address, on_air, arrival)
+            self._onAir = (arrival, target, frame, packet)
+
+    def _next_deadline(self) -> Optional[float]:
+        """
+        Returns:
+            Clock time of the earliest ARQ, transmitter or channel timer, or None if nothing is in flight
+        """
+        deadlines = [x for x in (sender.next_deadline() for sender in self._arqTx.values()) if x is not None]
+        if self._onAir is not None:
+            deadlines.append(self._onAir[0])
+        if self._txFreeAt is not None:
+            deadlines.append(self._txFreeAt)
+        if self._delayed:
+            deadlines.append(self._delayed[0][0])
+        return min(deadlines) if deadlines else None
+
+    def _pump_timeout_ms(self) -> int:
+        """
+        Works out how long the pump may sleep before an ARQ timer needs servicing
+        Returns:
+            Poll timeout in milliseconds
+        """
+        deadline = self._next_deadline()
+        if deadline is None:
+            return self.PUMP_IDLE_TIMEOUT_MS
+
+        remaining_ms = int((deadline - self.clock()) * 1000) + 1
+        return max(0, min(remaining_ms, self.PUMP_IDLE_TIMEOUT_MS))
+
+
+class BufferedShockBurstRadio(ShockBurstRadioBase):
+    """
+    Radio whose FIFOs are thread safe HardwareFifos. Users may call transmit()
+    and receive() from any thread, while some other thread runs the pump.
+    """
+
+    def __init__(self, context: zmq.Context, tx_fifo_depth: int = HardwareFifo.NRF24_FIFO_DEPTH,
+                 rx_fifo_depth: int = HardwareFifo.NRF24_FIFO_DEPTH,
+                 tx_overflow: OverflowPolicy = OverflowPolicy.BLOCK,
+                 rx_overflow: OverflowPolicy = OverflowPolicy.DROP_NEWEST, **kwargs):
+        """
+        Args:
+            context: ZMQ context used to create all of the pipe sockets
+            tx_fifo_depth: Number of frames transmit() may queue before applying tx_overflow
+            rx_fifo_depth: Number of received frames held before applying rx_overflow
+            tx_overflow: Backpressure applied to transmit() when the TX FIFO is full
+            rx_overflow: What happens to new frames when the RX FIFO is full. The
+                default drops them without an ACK, just like the NRF24L01.
+            kwargs: Transport and ARQ settings forwarded to ShockBurstRadioBase
+        """
+        super().__init__(context, **kwargs)
+        self._txQueue = HardwareFifo(tx_fifo_depth, tx_overflow, on_put=self._on_tx_queued)
+        self._rxQueue = HardwareFifo(rx_fifo_depth, rx_overflow)
+
+    def transmit(self, data: bytearray, block: bool = True, timeout: float = None) -> bool:
+        """
+        Queues a packed frame into the TX FIFO
+
+        Args:
+            data: Packed frame to transmit
+            block: Whether to wait for room in the TX FIFO when using the BLOCK policy
+            timeout: Max seconds to wait for room. None waits forever.
+
+        Raises:
+            queue.Full: The TX FIFO had no room and the overflow policy reports errors
+
+        Returns:
+            True if the frame was queued, False if the overflow policy dropped it
+        """
+        return self._txQueue.put((self.clock(), data), block=block, timeout=timeout)
+
+    def receive(self, block, timeout) -> RxFifoEntry:
+        """
+        Pops the oldest frame out of the RX FIFO
+
+        Args:
+            block: Whether to wait for a frame to arrive
+            timeout: Max seconds to wait. None waits forever.
+
+        Raises:
+            queue.Empty: No frame arrived in time, or the radio was killed
+
+        Returns:
+            The received frame and the pipe it arrived on
+        """
+        return self._rxQueue.get(block=block, timeout=timeout)
+
+    def has_tx_work(self) -> bool:
+        """
+        Checks if the pump has frames to send or ARQ timers to service
+        Returns:
+            bool
+        """
+        return (not self._txQueue.empty() or self._frames_in_flight() > 0 or self._txFreeAt is not None
+                or len(self._delayed) > 0)
+
+    def _pop_tx_data(self) -> Union[bytearray, bytes, memoryview, None]:
+        if self._txQueue.empty():
+            return None
+        queued_at, data = self._txQueue.get(block=False)
+        self.metrics.tx_queue.record(self.clock() - queued_at)
+        return data
+
+    def _rx_room(self) -> Optional[int]:
+        if self._rxQueue.policy != OverflowPolicy.DROP_NEWEST:
+            return None
+        return self._rxQueue.depth - len(self._rxQueue)
+
+    def _deliver_rx(self, entry: RxFifoEntry) -> bool:
+        return self._rxQueue.put(entry)
+
+    def _fifo_depths(self) -> Tuple[Optional[int], Optional[int]]:
+        return len(self._txQueue), len(self._rxQueue)
 
-                    # Notify if transmit failed
-                    if not received:
-                        print("Failed to receive packet ACK")
 
+class ShockBurstRadio(BufferedShockBurstRadio, Thread):
+    """
+    Virtual radio whose message pump runs in its own thread
+    """
 
+    def __init__(self, tx_fifo_depth: int = HardwareFifo.NRF24_FIFO_DEPTH,
+                 rx_fifo_depth: int = HardwareFifo.NRF24_FIFO_DEPTH,
+                 tx_overflow: OverflowPolicy = OverflowPolicy.BLOCK,
+                 rx_overflow: OverflowPolicy = OverflowPolicy.DROP_NEWEST,
+                 context: zmq.Context = None, **kwargs):
+        """
+        Args:
+            tx_fifo_depth: Number of frames transmit() may queue before applying tx_overflow
+            rx_fifo_depth: Number of received frames held before applying rx_overflow
+            tx_overflow: Backpressure applied to transmit() when the TX FIFO is full
+            rx_overflow: What happens to new frames when the RX FIFO is full. The
+                default drops them without an ACK, just like the NRF24L01.
+            context: ZMQ context to create sockets with. A private one is made if not given.
+            kwargs: Transport and ARQ settings forwarded to ShockBurstRadioBase
+        """
+        Thread.__init__(self)
+        BufferedShockBurstRadio.__init__(self, context if context is not None else zmq.Context(),
+                                         tx_fifo_depth, rx_fifo_depth, tx_overflow, rx_overflow, **kwargs)
+        self._owns_context = context is None
+        self._kill_switch = Event()
+
+        # ---------------------------------------------------------------------
+        # Doorbell used to wake the message pump whenever the TX queue gains
+        # work or the thread is asked to exit. The pump polls it alongside all
+        # of the RX pipes so it never has to sleep on a fixed period.
+        # ---------------------------------------------------------------------
+        doorbell_url = "inproc://shockburst_doorbell_{}".format(id(self))
+        self._doorbell_rx = self.context.socket(zmq.PAIR)
+        self._doorbell_rx.setsockopt(zmq.LINGER, 0)
+        self._doorbell_rx.bind(doorbell_url)
+        self._doorbell_tx = self.context.socket(zmq.PAIR)
+        self._doorbell_tx.setsockopt(zmq.LINGER, 0)
+        self._doorbell_tx.connect(doorbell_url)
+        self._doorbellLock = Lock()
+
+    def kill(self) -> None:
+        self._kill_switch.set()
+        self._ring_doorbell()
+        self._rxQueue.wake()
+
+    def close(self) -> None:
+        """
+        Closes all pipes, and the context if the radio made its own. The
+        message pump must not be running.
+        Returns:
+            None
+        """
+        assert(not self.is_alive())
+        self._close_pipes()
+        self._doorbell_rx.close()
+        self._doorbell_tx.close()
+
+        if self._owns_context:
+            self.context.term()
+
+    def run(self) -> None:
+        """
+        Main message pump that acts as the hardware transceiver in the NRF24L01
+        """
+        print("Starting ShockBurst processing")
+        time.sleep(0.5)
+
+        poller = zmq.Poller()
+        poller.register(self._doorbell_rx, zmq.POLLIN)
+        for pipe in self.rxPipe:
+            poller.register(pipe, zmq.POLLIN)
+
+        while not self._kill_switch.is_set():
+            # Sleep until a socket has data or the TX queue has work
+            ready = dict(poller.poll(self._pump_timeout_ms()))
+            if self._doorbell_rx in ready:
+                self._drain_doorbell()
+
+            # Pump messages through the "transceiver"
+            self._service_pipes(ready)
+
+        print("Killing ShockBurst thread")
+
+    def _ring_doorbell(self) -> None:
+        """
+        Wakes up the message pump. Safe to call repeatedly, as a pending
+        wake up is enough to get the pump to service everything.
+        Returns:
+            None
+        """
+        with self._doorbellLock:
+            try:
+                self._doorbell_tx.send(b'', flags=zmq.DONTWAIT)
+            except zmq.Again:
+                pass
+
+    def _drain_doorbell(self) -> None:
+        """
+        Clears out all pending wake up notifications
+        Returns:
+            None
+        """
+        while True:
+            try:
+                self._doorbell_rx.recv(flags=zmq.DONTWAIT)
+            except zmq.Again:
+                break
 
+    def _on_tx_queued(self) -> None:
+        self._ring_doorbell()
@@ -0,0 +1,181 @@
+# **********************************************************************************************************************
+#   FileName:
+#       wire_format.py
+#
+#   Description:
+#       Envelopes that carry a packed frame between virtual radios. Either the ShockBurstFrame
+#       protobuf, which the embedded code speaks, or a fixed layout struct for sim to sim links.
+#
+#   2021 | Brandon Braun | brandonbraun653@gmail.com
+# **********************************************************************************************************************
+
+import struct
+import zlib
+
+from enum import Enum
+from typing import List, NamedTuple, Optional, Sequence, Union
+from frame_packager import PackedFrame
+from google.protobuf.message import DecodeError
+
+import shockburst_pb2
+
+
+class WireFormat(Enum):
+    """ Envelope used on the wire. Must match with C++ definition. """
+    PROTOBUF = 0    # ShockBurstFrame from shockburst.proto
+    COMPACT = 1     # CompactFrame from shockburst_compact.hpp
+
+
+# ---------------------------------------------------------------------
+# Compact layout, little endian, 44 bytes:
+#   magic     u8      COMPACT_MAGIC
+#   sender    u32+u8  5 byte MAC, low word then high byte
+#   type      u8      FrameType
+#   frame_id  u8
+#   crc       u32     CRC-32 (zlib) of the frame
+#   data      u8[32]  Packed frame
+#
+# A serialized ShockBurstFrame always starts with the tag of its first
+# field (PROTOBUF_TAG), so the magic byte tells the two formats apart.
+#
+# Between radios the compact format is sent as a two part message, the
+# header then the frame, so neither side has to join or split buffers.
+# ---------------------------------------------------------------------
+COMPACT_MAGIC = 0xA5
+PROTOBUF_TAG = 0x0A
+COMPACT_HEADER = struct.Struct('<BIBBBI')
+COMPACT_SIZE = COMPACT_HEADER.size + PackedFrame.MAX_FRAME_SIZE
+
+_MAC_SIZE = 5
+_MAC_ENDIAN = 'little'
+_MAC_LOW_MASK = 0xFFFFFFFF
+
+Buffer = Union[bytes, bytearray, memoryview]
+
+
+class Envelope(NamedTuple):
+    """ A decoded message """
+    format: WireFormat
+    sender: int
+    type: int
+    frame_id: int
+    data: Buffer
+
+
+def encode(wire_format: WireFormat, sender: int, frame_type: int, frame_id: int, data: Buffer) -> Buffer:
+    """
+    Wraps a packed frame for transmission
+
+    Args:
+        wire_format: Envelope to use
+        sender: MAC of the transmitting device
+        frame_type: FrameType value
+        frame_id: Frame number
+        data: 32 byte packed frame
+
+    Returns:
+        Message ready to send
+    """
+    if wire_format == WireFormat.COMPACT:
+        message = bytearray(COMPACT_SIZE)
+        COMPACT_HEADER.pack_into(message, 0, COMPACT_MAGIC, sender & _MAC_LOW_MASK, sender >> 32,
+                                 frame_type, frame_id, zlib.crc32(data))
+        message[COMPACT_HEADER.size:] = data
+        return message
+
+    pb_frame = shockburst_pb2.ShockBurstFrame()
+    pb_frame.sender = sender.to_bytes(_MAC_SIZE, _MAC_ENDIAN)
+    pb_frame.crc = 0
+    pb_frame.type = frame_type
+    pb_frame.frame_id = frame_id
+    pb_frame.data = bytes(data)
+    return pb_frame.SerializeToString()
+
+
+def encode_parts(wire_format: WireFormat, sender: int, frame_type: int, frame_id: int, data: Buffer) -> List[Buffer]:
+    """
+    Wraps a packed frame for transmission as a multipart message. The frame
+    itself is passed through untouched.
+
+    Args:
+        wire_format: Envelope to use
+        sender: MAC of the transmitting device
+        frame_type: FrameType value
+        frame_id: Frame number
+        data: 32 byte packed frame
+
+    Returns:
+        Message parts ready for send_multipart()
+    """
+    if wire_format == WireFormat.COMPACT:
+        header = COMPACT_HEADER.pack(COMPACT_MAGIC, sender & _MAC_LOW_MASK, sender >> 32,
+                                     frame_type, frame_id, zlib.crc32(data))
+        return [header, data]
+
+    return [encode(wire_format, sender, frame_type, frame_id, data)]
+
+
+def detect(message: Buffer) -> WireFormat:
+    """
+    Returns:
+        Envelope the message was encoded with
+    """
+    if len(message) == COMPACT_SIZE and message[0] == COMPACT_MAGIC:
+        return WireFormat.COMPACT
+    return WireFormat.PROTOBUF
+
+
+def decode(message: Buffer) -> Optional[Envelope]:
+    """
+    Unwraps a received message of either format
+
+    Args:
+        message: Raw message from a pipe
+
+    Returns:
+        The decoded message, or None if it is malformed or failed its CRC check. For
+        the compact format the data is a view into the message rather than a copy.
+    """
+    if detect(message) == WireFormat.COMPACT:
+        return _decode_compact(message, memoryview(message)[COMPACT_HEADER.size:])
+
+    pb_frame = shockburst_pb2.ShockBurstFrame()
+    try:
+        pb_frame.ParseFromString(message)
+    except DecodeError:
+        return None
+
+    if len(pb_frame.data) != PackedFrame.MAX_FRAME_SIZE:
+        return None
+
+    sender = int.from_bytes(pb_frame.sender, _MAC_ENDIAN)
+    return Envelope(WireFormat.PROTOBUF, sender, pb_frame.type, pb_frame.frame_id, pb_frame.data)
+
+
+def decode_parts(parts: Sequence[Buffer]) -> Optional[Envelope]:
+    """
+    Unwraps a received multipart message, or a single part one of either format
+
+    Args:
+        parts: Buffers of each message part, such as zmq.Frame.buffer
+
+    Returns:
+        The decoded message, or None if it is malformed or failed its CRC check.
+        For the compact format the data is the frame part itself, not a copy.
+    """
+    if len(parts) == 1:
+        return decode(parts[0])
+    elif len(parts) != 2:
+        return None
+
+    header, data = parts
+    if len(header) != COMPACT_HEADER.size or header[0] != COMPACT_MAGIC or len(data) != PackedFrame.MAX_FRAME_SIZE:
+        return None
+    return _decode_compact(header, data)
+
+
+def _decode_compact(header: Buffer, data: Buffer) -> Optional[Envelope]:
+    _, mac_low, mac_high, frame_type, frame_id, crc = COMPACT_HEADER.unpack_from(header)
+    if zlib.crc32(data) != crc:
+        return None
+    return Envelope(WireFormat.COMPACT, mac_low | (mac_high << 32), frame_type, frame_id, data)
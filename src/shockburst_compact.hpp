@@ -0,0 +1,72 @@
+/********************************************************************************
+ *  File Name:
+ *    shockburst_compact.hpp
+ *
+ *  Description:
+ *    Fixed layout envelope for frames exchanged with the virtual radios. An
+ *    alternative to the ShockBurstFrame protobuf that needs no decoding. Must
+ *    match sim/wire_format.py.
+ *
+ *  2021 | Brandon Braun | brandonbraun653@gmail.com
+ *******************************************************************************/
+
+#pragma once
+#ifndef DRONE_NET_SHOCKBURST_COMPACT_HPP
+#define DRONE_NET_SHOCKBURST_COMPACT_HPP
+
+/* STL Includes */
+#include <cstddef>
+#include <cstdint>
+
+namespace DN::Wire
+{
+  /*---------------------------------------------------------------------------
+  Constants
+  ---------------------------------------------------------------------------*/
+  /**
+   *  First byte of every compact frame. A serialized ShockBurstFrame always
+   *  starts with 0x0A, so receivers can accept both formats.
+   */
+  static constexpr uint8_t COMPACT_MAGIC = 0xA5;
+
+  static constexpr size_t PACKED_FRAME_SIZE = 32;
+  static constexpr size_t COMPACT_FRAME_SIZE = 44;
+
+  /*---------------------------------------------------------------------------
+  Enumerations
+  ---------------------------------------------------------------------------*/
+  enum class WireFormat : uint8_t
+  {
+    PROTOBUF = 0,
+    COMPACT  = 1
+  };
+
+  enum class FrameType : uint8_t
+  {
+    INVALID    = 0,
+    ACK_FRAME  = 1,
+    NACK_FRAME = 2,
+    USER_DATA  = 3
+  };
+
+  /*---------------------------------------------------------------------------
+  Structures
+  ---------------------------------------------------------------------------*/
+  /**
+   *  All fields are little endian.
+   */
+  struct __attribute__( ( packed ) ) CompactFrame
+  {
+    uint8_t magic;                      /**< COMPACT_MAGIC */
+    uint32_t senderLow;                 /**< Low 4 bytes of the sender's MAC */
+    uint8_t senderHigh;                 /**< High byte of the sender's MAC */
+    uint8_t type;                       /**< FrameType */
+    uint8_t frameId;                    /**< Frame number of the packed frame */
+    uint32_t crc;                       /**< CRC-32 (IEEE 802.3, as zlib) of data */
+    uint8_t data[ PACKED_FRAME_SIZE ];  /**< Packed frame */
+  };
+  static_assert( sizeof( CompactFrame ) == COMPACT_FRAME_SIZE );
+
+}  // namespace DN::Wire
+
+#endif  /* !DRONE_NET_SHOCKBURST_COMPACT_HPP */